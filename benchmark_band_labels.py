@@ -0,0 +1,120 @@
+"""
+Benchmark of the band and antenna labelling of catalogue lines
+
+Times Catalogue.set_band + Catalogue.set_observed_antenna on 1e3 to 1e6 lines
+spread uniformly over 0-400 GHz, and compares them with the previous implementation
+(an iterrows loop over the lines with a .loc write for each label, copied below),
+which is only run up to 1e4 lines.
+
+Usage: python benchmark_band_labels.py
+"""
+import time
+import numpy as np
+import pandas as pd
+
+from catalogues import Catalogue
+
+
+# Previous implementation of Catalogue.set_band and Catalogue.set_observed_antenna, 
+# copied as it was, with the class passed as cls
+def previous_set_band(cls, data):
+    """
+    Function to set the frequency band ID to each line
+    
+    Parameters
+    ----------
+    data : pandas dataframe
+        Dataframe with the catalogue information
+        
+    Returns
+    -------
+    data : pandas dataframe
+        Dataframe with the catalogue information and the frequency band ID
+    """
+    # Create a new data frame called final_data -> esto lo hacemos para resolver un problema
+    # en el que pandas crea una copia del data frame original y no permitía modificarlo
+    final_data = pd.DataFrame(columns=['Status',
+                                       'Species',
+                                       'Freq[MHz]',
+                                       'Upper',
+                                       'Lower',
+                                       'Origin',
+                                       'Band'])
+    final_data['Status'] = data['Status']
+    final_data['Species'] = data['Species']
+    final_data['Freq[MHz]'] = data['Freq[MHz]']
+    final_data['Upper'] = data['Upper']
+    final_data['Lower'] = data['Lower']
+    final_data['Origin'] = data['Origin']
+    final_data['Band'] = None
+
+    for index, row in final_data.iterrows():
+        # Copy, line by line, the information from the original data frame
+        for i in range(len(cls.mmbands)):
+            # Check the frequency of the line and assign the corresponding band ID
+            if cls.mmbands[list(cls.mmbands.keys())[i]][0] <= row['Freq[MHz]'] <= cls.mmbands[list(cls.mmbands.keys())[i]][1]:
+                final_data.loc[index, 'Band'] = list(cls.mmbands.keys())[i]
+                # If 'Band' is 7mm, 13mm, 25mm, 5cm, 10cm or 20cm, change the name to the
+                # corresponding IEEE band name
+                if list(cls.mmbands.keys())[i] in ['7mm', '13mm', '25mm', '5cm', '10cm', '20cm']:
+                    final_data.loc[index, 'Band'] = cls.ieee_bands[list(cls.mmbands.keys())[i]]
+                break
+            else:
+                continue
+
+    return final_data
+
+
+def previous_set_observed_antenna(cls, data):
+    """
+    Function to set the antenna used to get the data depending on the observed range
+
+    Parameters
+    ----------
+    data : pandas dataframe
+        Dataframe with the catalogue information
+
+    Returns
+    -------
+    data : pandas dataframe
+        Dataframe with the catalogue information and the antenna used
+    """
+    data['Telescope'] = None
+    # For each line, check the frequency and assign the corresponding antenna
+    for index, row in data.iterrows():
+        for i in range(len(cls.telescopes)):
+            # Check the frequency of the line and assign the corresponding antenna
+            if cls.telescopes[list(cls.telescopes.keys())[i]][0] <= row['Freq[MHz]'] <= cls.telescopes[list(cls.telescopes.keys())[i]][1]:
+                data.loc[index, 'Telescope'] = list(cls.telescopes.keys())[i]
+                #print(data.loc[index, 'Freq[MHz]'], list(cls.telescopes.keys())[i])
+                break
+            else:
+                continue
+
+    return data
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"lines":>8} {"vectorised [s]":>15} {"iterrows [s]":>15}')
+    for n in [10**3, 10**4, 10**5, 10**6]:
+        # The previous set_band copies these columns into a new dataframe
+        data = pd.DataFrame({'Status': 'D', 'Species': 'CO', 
+                             'Freq[MHz]': rng.uniform(0.0, 400.0e3, n),
+                             'Upper': 'J=1', 'Lower': 'J=0', 'Origin': 'cdms'})
+        start = time.perf_counter()
+        labelled = Catalogue.set_observed_antenna(Catalogue.set_band(data))
+        vectorised = time.perf_counter() - start
+
+        previous = ''
+        if n <= 10**4:
+            start = time.perf_counter()
+            expected = previous_set_observed_antenna(Catalogue, previous_set_band(Catalogue, data))
+            previous = f'{time.perf_counter() - start:.3f}'
+            for column in ['Band', 'Telescope']:
+                assert (labelled[column].to_numpy(dtype=object) == expected[column].to_numpy(dtype=object)).all()
+        print(f'{n:>8} {vectorised:>15.3f} {previous:>15}')
+
+
+if __name__ == '__main__':
+    main()
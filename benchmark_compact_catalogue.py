@@ -0,0 +1,90 @@
+"""
+Benchmark of the compact column types of the catalogue dataframes
+
+Writes a synthetic catalogue (half rrls, a third molecules and the rest unidentified
+lines) and, with and without compact mode, times reading the file, building the line
+classes (rrls, molecules and uf), the filters on the origin and species columns
+that select them, and loading the processed catalogue back from the cache. The
+memory of the dataframes is given by Catalogue.memory_usage.
+
+Usage: python benchmark_compact_catalogue.py [lines]   (default: 200000 lines)
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from catalogues import Catalogue
+
+
+def write_catalogue(filename, n, seed=0):
+    # Lines in the fixed-width format of the .my-lines.list files
+    rng = np.random.default_rng(seed)
+    elements = ['H', 'D', '3He', 'He', 'C', '3HeII', 'HeII', 'CII', 'CIII', 'OIII']
+    molecules = ['CO', 'HCN', 'HCO+', 'CS', 'SiO', 'c-C3H2', 'CN', 'HNC']
+    header = ['-' * 100] * 5
+    lines = []
+    for kind, freq, eup, gup, aij in zip(rng.random(n), rng.uniform(900.0, 380000.0, n),
+                                         rng.uniform(0.0, 500.0, n), rng.integers(1, 99, n),
+                                         rng.uniform(1e-7, 1e-3, n)):
+        if kind < 0.5:
+            level = int(rng.integers(20, 300))
+            series = int(rng.integers(0, len(Catalogue.greek_series)))
+            species = f'{elements[rng.integers(0, len(elements))]}{level}\\g{Catalogue.greek_series[series]}'
+            upper, lower, origin = str(level + 1 + series), str(level), 'rrline'
+        elif kind < 0.85:
+            species = molecules[rng.integers(0, len(molecules))]
+            upper, lower = f'J={rng.integers(1, 9)}', f'J={rng.integers(0, 8)}'
+            origin = ['jpl', 'cdms'][rng.integers(0, 2)]
+        else:
+            species, upper, lower, origin = f'U-{freq:.0f}', '', '', 'unknow'
+        status = 'DT?FC'[rng.integers(0, 5)]
+        lines.append(f'{status}{1:>3d}{species:<15s}{freq:>10.3f}{0.1:>8.3f}{eup:>8.1f}{gup:>5d}'
+                     f'{aij:>10.2e}{upper:>15s} -- {lower:<15s}{origin:<6s}')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(header + lines) + '\n')
+
+
+def main():
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 200000
+    path = tempfile.mkdtemp() + '/'
+    write_catalogue(path + 'BENCH.my-lines.list', n)
+    filters = {'rrline': lambda values: values == 'rrline',
+               'molecules': lambda values: values.isin(['rrline', 'unknow']),
+               'uf': lambda values: values.str.startswith('U-')}
+
+    print(f'{n} lines')
+    print(f'{"mode":>8} {"read [s]":>9} {"classes [s]":>12} {"filters [s]":>12} {"cache [s]":>10} {"memory [MB]":>12}')
+    for compact in [False, True]:
+        cache_dir = os.path.join(path, 'compact' if compact else 'full')
+        start = time.perf_counter()
+        catalogue = Catalogue(path, 'BENCH', cache_dir=cache_dir, compact=compact)
+        read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for kind in Catalogue.line_classes:
+            getattr(catalogue, kind)
+        classes = time.perf_counter() - start
+
+        data = catalogue.catalogue
+        start = time.perf_counter()
+        for _ in range(10):
+            Catalogue.column_mask(data['Origin'], filters['rrline'])
+            Catalogue.column_mask(data['Origin'], filters['molecules'])
+            Catalogue.column_mask(data['Species'], filters['uf'])
+        mask = (time.perf_counter() - start) / 10
+
+        start = time.perf_counter()
+        cached = Catalogue(path, 'BENCH', cache_dir=cache_dir, compact=compact)
+        for kind in Catalogue.line_classes:
+            getattr(cached, kind)
+        cache = time.perf_counter() - start
+
+        memory = catalogue.memory_usage()['total'] / 1e6
+        print(f'{"compact" if compact else "full":>8} {read:>9.2f} {classes:>12.2f} {mask:>12.4f} '
+              f'{cache:>10.2f} {memory:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
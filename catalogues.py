@@ -1,12 +1,64 @@
 
 import os
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 
 os.path.abspath(os.getcwd())
 
 
+def to_mhz(values):
+    """
+    Function to get frequencies in MHz as a float array
+
+    Parameters
+    ----------
+    values : float, array-like or astropy Quantity
+        Frequencies, in MHz if they are given without units
+
+    Returns
+    -------
+    values : numpy array
+        Frequencies in MHz
+    """
+    if hasattr(values, 'to_value'):
+        values = values.to_value('MHz')
+
+    return np.asarray(values, dtype=float)
+
+
+def expand_ranges(lo, hi):
+    """
+    Function to expand index ranges into (range, index) pairs
+
+    Used to list the lines of a sorted frequency index within the [lo, hi) range of 
+    each query found with searchsorted, without a loop over the queries.
+
+    Parameters
+    ----------
+    lo : numpy array
+        First index of each range
+    hi : numpy array
+        Index after the last one of each range. Ranges with hi <= lo are empty
+
+    Returns
+    -------
+    owner : numpy array
+        Position of the range of each pair
+    index : numpy array
+        Index of each pair, increasing within each range
+    """
+    counts = np.maximum(hi - lo, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    index = np.arange(counts.sum()) + np.repeat(lo - np.cumsum(counts) + counts, counts)
+
+    return owner, index
+
+
 class Catalogue:
     """
     Class to read, classify and analyse the obseved lines in PNe
@@ -23,10 +75,30 @@ class Catalogue:
     uf : pandas dataframe
         Dataframe with the unidentified line catalogue information sorted by frequency
 
+    The rrls, molecules and uf dataframes, with their band and antenna columns, are 
+    built the first time they are used and kept until catalogue is replaced. The rrl
+    catalogue (name 'rrls') is classified the first time it is used.
+
     Methods
     -------
     read_catalogue_file(name)
         Function to read the catalogue file and return a pandas dataframe
+    line_frame(kind)
+        Function to get the dataframe of a line class, building it the first time
+    compact_frame(data)
+        Function to store a catalogue dataframe with compact column types
+    memory_usage()
+        Function to get the memory used by the catalogue dataframes
+    column_mask(values, test)
+        Function to select the rows of a column whose values pass a test
+    source_key(path, name)
+        Function to get the cache key of the catalogue file as it is parsed
+    read_cache(path, name, cache_dir)
+        Function to read a processed catalogue from the cache
+    write_cache(path, name, cache_dir, kind, data)
+        Function to add a processed dataframe to the cache
+    parse_rrls(data)
+        Function to parse the rrl species names in a single pass
     sort_greek(data)
         Function to sort lines by greek letter
     classify_rrls(data)
@@ -37,6 +109,15 @@ class Catalogue:
         Function to get the molecules from an astronomical source catalogue
     get_uf(data)
         Function to get the unidentified lines from an astronomical source catalogue
+    lines_in_range(fmin, fmax, kinds)
+        Function to get the catalogue lines in a frequency range
+    nearest(freq, k, kinds)
+        Function to get the catalogue lines closest to a frequency
+    match(freqs, tolerance, kinds, max_candidates)
+        Function to match a batch of frequencies with the catalogue lines
+    match_lines(lines, tolerance, kinds, max_candidates)
+        Function to match the lines found by spectrumfit.line_inspector with the 
+        catalogue lines
 
     Parameters
     ----------
@@ -44,6 +125,15 @@ class Catalogue:
         Path to the catalogue files
     name : str
         Name of the catalogue file to read
+    cache : bool, optional
+        Whether to reuse and store the processed catalogue in an on-disk cache
+        Default: True
+    cache_dir : str, optional
+        Directory of the cache
+        Default: .catalogue_cache inside the catalogue path
+    compact : bool, optional
+        Whether to store the dataframes with compact column types (see compact_frame)
+        Default: False
 
     Returns
     -------
@@ -86,6 +176,8 @@ class Catalogue:
     Upper level -- Lower level. Upper and lower levels of the transition
     Origin. Origin of the line: rrline for radio recombination line, unknow for UFs and jpl and
             cdms for molecular lines
+
+    The columns #. and Err[MHz]. are not kept in the dataframes.
     """
     
 
@@ -118,8 +210,52 @@ class Catalogue:
                   'IRAM30m-E1' : [130.85e3, 139.1e3],
                   'IRAM30m-E0' : [81.5e3, 89.76e3],
                   'Yebes40m' : [31.53e3, 50e3]}
+    
+    # Radio recombination line groups, in sorting order, with their element and
+    # ionisation stage
+    rrl_groups = {'H' : ['H', 1],
+                  'D' : ['D', 1],
+                  '3He' : ['3He', 1],
+                  'He' : ['He', 1],
+                  'C' : ['C', 1],
+                  '3HeII' : ['3He', 2],
+                  'HeII' : ['He', 2],
+                  'CII' : ['C', 2],
+                  'CIII' : ['C', 3],
+                  'OIII' : ['O', 3]}
+    
+    # Greek letters of the rrl series (\ga, \gb, ...), in sorting order
+    greek_series = ['a', 'b', 'g', 'd', 'e', 'z', 
+                    'h', 'q', 'i', 'k', 'l', 'm', 
+                    'n', 'x', 'o', 'p', 'r', 's', 
+                    't', 'u', 'f', 'c', 'y', 'w']
+
+    # Version of the processed catalogue cache, to be increased whenever the
+    # processing of the catalogue changes
+    cache_version = 4
+
+    # Columns stored as categoricals in compact mode, and the quantum-number levels,
+    # which share their categories
+    category_columns = ['Status', 'Species', 'Origin', 'Band', 'Telescope']
+    level_columns = ['Upper', 'Lower']
+    # Columns stored in single precision in compact mode. The frequencies are kept in
+    # double precision, since float32 resolves only ~0.03 MHz at 300 GHz
+    float32_columns = ['Eup[K]', 'Gup', 'Aij[s-1]']
+
+    # Line classes with a frequency index
+    line_classes = ['rrls', 'molecules', 'uf']
 
-    def __init__(self, path=None, name=None):
+    def __init__(self, path=None, name=None, cache=True, cache_dir=None, compact=False):
+        # Sorted frequency index of each line class, built on demand
+        self.freq_index = {}
+        # Dataframes of the catalogue and of its line classes, built on demand
+        self.frames = {}
+        self.compact = compact
+        self.name = name
+        # Directory of the cache, None if it is disabled, and key of the catalogue file
+        # the frames are built from, None if they must not be cached
+        self.cache_dir = None
+        self.cache_key = None
         if not name:
             print('Line catalogue created with any source specified')
         elif name == None:
@@ -129,19 +265,121 @@ class Catalogue:
                 self.path = os.path.abspath(os.getcwd()) + '/Source_Catalogues/'
             else:
                 self.path = path
-            self.catalogue = self.read_catalogue_file(path, name)
+            if cache_dir == None:
+                cache_dir = os.path.join(self.path, '.catalogue_cache')
+            if cache:
+                self.cache_dir = cache_dir
+                frames = self.read_cache(self.path, name, cache_dir)
+                if frames is not None:
+                    self.frames.update(frames)
+                    return
+                # Taken before parsing, so that frames of a file changed afterwards are
+                # never cached with it
+                self.cache_key = self.source_key(self.path, name)
+            data = self.read_catalogue_file(self.path, name)
             if name == 'rrls':
-                self.catalogue = self.classify_rrls(self.catalogue)
-                #self.set_band(self.catalogue)
-                self.set_observed_antenna(self.catalogue)
+                # Classified the first time the catalogue is used
+                self.frames['source'] = data
             else:
-                self.rrls = self.get_rrls(self.catalogue)
-                self.molecules = self.get_molecules(self.catalogue)
-                self.uf = self.get_uf(self.catalogue)
+                # The line classes are taken from the compact catalogue, so they share 
+                # its categories
+                self.store_frame('catalogue', data)
 
         return
     
 
+    @property
+    def catalogue(self):
+        if 'catalogue' not in self.frames and self.frames.get('source') is not None:
+            data = self.classify_rrls(self.frames.pop('source'))
+            #self.set_band(data)
+            self.set_observed_antenna(data)
+            self.store_frame('catalogue', data)
+
+        return self.frames.get('catalogue')
+    
+
+    @catalogue.setter
+    def catalogue(self, value):
+        # The line classes and frequency indexes of the previous catalogue are dropped, 
+        # and the frames built from now on do not come from the catalogue file
+        self.frames = {'catalogue': value}
+        self.freq_index = {}
+        self.cache_key = None
+    
+
+    @property
+    def rrls(self):
+        return self.line_frame('rrls')
+    
+
+    @rrls.setter
+    def rrls(self, value):
+        self.frames['rrls'] = value
+    
+
+    @property
+    def molecules(self):
+        return self.line_frame('molecules')
+    
+
+    @molecules.setter
+    def molecules(self, value):
+        self.frames['molecules'] = value
+    
+
+    @property
+    def uf(self):
+        return self.line_frame('uf')
+    
+
+    @uf.setter
+    def uf(self, value):
+        self.frames['uf'] = value
+    
+
+    def line_frame(self, kind):
+        """
+        Function to get the dataframe of a line class, building it the first time
+
+        Parameters
+        ----------
+        kind : str
+            Line class ('rrls', 'molecules' or 'uf')
+
+        Returns
+        -------
+        data : pandas dataframe
+            Dataframe of the line class, or None if the catalogue has no line classes
+        """
+        if kind not in self.frames:
+            data = self.catalogue
+            if data is None or self.name == 'rrls':
+                return None
+            builders = {'rrls': self.get_rrls, 'molecules': self.get_molecules, 'uf': self.get_uf}
+            self.store_frame(kind, builders[kind](data))
+
+        return self.frames[kind]
+    
+
+    def store_frame(self, kind, data):
+        """
+        Function to keep a dataframe built on demand and add it to the cache
+
+        Parameters
+        ----------
+        kind : str
+            Dataframe ('catalogue', 'rrls', 'molecules' or 'uf')
+        data : pandas dataframe
+            Dataframe to keep, converted with compact_frame in compact mode
+        """
+        if self.compact:
+            data = self.compact_frame(data)
+        self.frames[kind] = data
+        if self.cache_dir is not None:
+            self.write_cache(self.path, self.name, self.cache_dir, kind, data)
+    
+
     def read_catalogue_file(self, path, name):
         """
         Function to read the catalogue file and return a pandas dataframe
@@ -162,10 +400,13 @@ class Catalogue:
                            (60, 75), (75, 79), (79, 94), (94, 100)]
             data = pd.read_fwf(path + name + '.my-lines.list', colspecs=file_format, header=None)
             data = data[5:]
-            data.drop([1, 4, 5, 6, 7, 9], axis=1, inplace=True)
+            data.drop([1, 4, 9], axis=1, inplace=True)
             data.rename(columns={0: 'Status',
                                  2: 'Species',
                                  3: 'Freq[MHz]',
+                                 5: 'Eup[K]',
+                                 6: 'Gup',
+                                 7: 'Aij[s-1]',
                                  8: 'Upper',
                                  10: 'Lower',
                                  11: 'Origin'}, inplace=True)
@@ -173,6 +414,9 @@ class Catalogue:
             #data['Status'] = data['Status'].astype(str)
             #data['Species'] = data['Species'].astype(str)
             data['Freq[MHz]'] = data['Freq[MHz]'].astype(float)
+            data['Eup[K]'] = data['Eup[K]'].astype(float)
+            data['Gup'] = data['Gup'].astype(float)
+            data['Aij[s-1]'] = data['Aij[s-1]'].astype(float)
             #data['Upper'] = data['Upper'].astype(int)
             #data['Lower'] = data['Lower'].astype(int)
             #data['Origin'] = data['Origin'].astype(str)
@@ -186,6 +430,412 @@ class Catalogue:
             return None
     
 
+    @classmethod
+    def compact_frame(cls, data):
+        """
+        Function to store a catalogue dataframe with compact column types
+
+        The text columns with few distinct values (status, species, origin, band and 
+        telescope) are stored as categoricals, the upper and lower levels as integer 
+        codes of a single table of levels, and the energies, degeneracies and Einstein
+        coefficients in single precision. Categories are sorted, so sorting by any of
+        these columns gives the same order as with strings. Frames taken from a compact
+        frame keep its categories, which are shared, not copied.
+
+        Parameters
+        ----------
+        data : pandas dataframe
+            Dataframe with the catalogue information
+
+        Returns
+        -------
+        data : pandas dataframe
+            Dataframe with compact column types. Columns that are already compact are
+            not converted again
+        """
+        if data is None:
+            return None
+        data = data.copy(deep=False)
+        # Bands and antennas have fixed categories, so that the frames of all the line 
+        # classes can be concatenated without losing their categories
+        fixed = {'Band': list(dict.fromkeys(cls.band_names().values())), 
+                 'Telescope': list(cls.telescopes)}
+        for column in cls.category_columns:
+            if column in data and not isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = pd.Categorical(data[column], categories=fixed.get(column))
+        levels = [column for column in cls.level_columns 
+                  if column in data and not isinstance(data[column].dtype, pd.CategoricalDtype)]
+        if levels:
+            # A single sorted factorization of all the levels gives the shared codes
+            values = pd.concat([data[column] for column in levels], ignore_index=True)
+            codes, categories = pd.factorize(values, sort=True)
+            for k, column in enumerate(levels):
+                data[column] = pd.Categorical.from_codes(codes[k * len(data):(k + 1) * len(data)], 
+                                                         categories=categories)
+        for column in cls.float32_columns:
+            if column in data:
+                data[column] = data[column].astype(np.float32)
+
+        return data
+    
+
+    def memory_usage(self):
+        """
+        Function to get the memory used by the catalogue dataframes
+
+        Returns
+        -------
+        usage : pandas series
+            Memory in bytes of each dataframe built so far, including the strings it 
+            holds. The categories shared by the frames are counted only in the first of
+            them, and 'total' is the sum over the frames
+        """
+        usage = {}
+        seen = set()
+        for key in ['catalogue'] + self.line_classes:
+            data = self.frames.get(key)
+            if data is None:
+                continue
+            total = data.index.memory_usage(deep=True)
+            for column in data.columns:
+                values = data[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    total += values.cat.codes.memory_usage(index=False)
+                    categories = values.cat.categories
+                    if id(categories) not in seen:
+                        seen.add(id(categories))
+                        total += categories.memory_usage(deep=True)
+                else:
+                    total += values.memory_usage(index=False, deep=True)
+            usage[key] = total
+        usage = pd.Series(usage, dtype='int64')
+        usage['total'] = usage.sum()
+
+        return usage
+    
+
+    @staticmethod
+    def column_mask(values, test):
+        """
+        Function to select the rows of a column whose values pass a test
+
+        For categorical columns the test is evaluated once per category and the result
+        is taken with the codes of the rows, so filters on compact frames do not 
+        convert the column back to strings.
+
+        Parameters
+        ----------
+        values : pandas series
+            Column of a catalogue dataframe
+        test : callable
+            Function that takes a pandas series of values and returns a boolean one
+
+        Returns
+        -------
+        mask : numpy array
+            Boolean array, True for the rows whose value passes the test. Missing values
+            do not pass it
+        """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Code -1 (missing value) picks the trailing False
+            passed = test(pd.Series(values.cat.categories)).to_numpy(dtype=bool, na_value=False)
+            return np.append(passed, False)[values.cat.codes.to_numpy()]
+
+        return test(values).to_numpy(dtype=bool, na_value=False)
+    
+
+    @classmethod
+    def cache_signature(cls):
+        """
+        Function to get the signature of the catalogue processing
+
+        The signature changes whenever the cache version, the pandas version or the
+        band, antenna and rrl tables of the class change, so that processed catalogues
+        from a different setup are never reused.
+
+        Returns
+        -------
+        signature : str
+            Hash of the processing setup
+        """
+        setup = json.dumps([cls.cache_version, pd.__version__, cls.mmbands, cls.ieee_bands,
+                            cls.telescopes, cls.rrl_groups, cls.greek_series])
+
+        return hashlib.sha1(setup.encode()).hexdigest()
+    
+
+    @staticmethod
+    def file_hash(filename):
+        """
+        Function to compute the content hash of a file
+
+        Parameters
+        ----------
+        filename : str
+            Path to the file
+
+        Returns
+        -------
+        digest : str
+            SHA-1 hash of the file content
+        """
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+    
+
+    def cache_files(self, path, name, cache_dir):
+        """
+        Function to get the files used to cache a processed catalogue
+
+        Parameters
+        ----------
+        path : str
+            Path to the catalogue files
+        name : str
+            Name of the catalogue file
+        cache_dir : str
+            Directory where the processed catalogues are cached
+
+        Returns
+        -------
+        source : str
+            Path to the catalogue file
+        key_file : str
+            Path to the json file with the cache key
+        data_stem : str
+            Path of the files with the processed dataframes, which end in 
+            '.<dataframe>.parquet'
+        """
+        source = os.path.abspath(path + name + '.my-lines.list')
+        # Catalogues with the same name in different directories must not collide
+        tag = os.path.basename(name) + '.' + hashlib.sha1(source.encode()).hexdigest()[:12]
+        if getattr(self, 'compact', False):
+            tag += '.compact'
+        key_file = os.path.join(cache_dir, tag + '.json')
+        data_stem = os.path.join(cache_dir, tag)
+
+        return source, key_file, data_stem
+    
+
+    def source_key(self, path, name):
+        """
+        Function to get the cache key of the catalogue file as it is parsed
+
+        Parameters
+        ----------
+        path : str
+            Path to the catalogue files
+        name : str
+            Name of the catalogue file
+
+        Returns
+        -------
+        key : dict
+            Path, size, modification time and content hash of the catalogue file, 
+            signature of the processing setup and cached dataframes (none yet), or None
+            if the file cannot be read
+        """
+        source = self.cache_files(path, name, '')[0]
+        try:
+            stat = os.stat(source)
+            return {'file': source,
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'hash': self.file_hash(source),
+                    'signature': self.cache_signature(),
+                    'frames': []}
+        except OSError:
+            return None
+    
+
+    def read_cache(self, path, name, cache_dir):
+        """
+        Function to read a processed catalogue from the cache
+
+        The cache is valid if it was created with the same processing setup and the
+        catalogue file has the same size and modification time, or otherwise the same
+        content, as when it was cached. Its key is kept in cache_key, so that the frames
+        built later are added to the same cache. The dataframes are stored as Parquet 
+        files, which are read without running any code and do not depend on the pandas
+        version, so a shared cache directory is safe to use.
+
+        Parameters
+        ----------
+        path : str
+            Path to the catalogue files
+        name : str
+            Name of the catalogue file
+        cache_dir : str
+            Directory where the processed catalogues are cached
+
+        Returns
+        -------
+        frames : dict of pandas dataframes
+            Processed catalogue dataframes, or None if there is no valid cache
+        """
+        source, key_file, data_stem = self.cache_files(path, name, cache_dir)
+        try:
+            with open(key_file) as f:
+                key = json.load(f)
+            if key['signature'] != self.cache_signature() or 'catalogue' not in key['frames']:
+                return None
+            stat = os.stat(source)
+            if key['mtime'] != stat.st_mtime_ns or key['size'] != stat.st_size:
+                if key['size'] != stat.st_size or key['hash'] != self.file_hash(source):
+                    return None
+                # Same content with a new modification time, e.g. after a copy
+                key['mtime'] = stat.st_mtime_ns
+                self.write_key(key_file, key)
+            frames = {kind: pd.read_parquet(f'{data_stem}.{kind}.parquet') for kind in key['frames']}
+            # Parquet reads text columns as strings; those that were objects (e.g. the band
+            # with None out of the bands) are restored
+            for kind, columns in key.get('objects', {}).items():
+                for column in columns:
+                    values = frames[kind][column]
+                    frames[kind][column] = values.astype(object).where(values.notna(), None)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'Error reading cache of {name}: {e}')
+            return None
+
+        # Each frame is stored on its own, with its own copy of the categories. The 
+        # copies equal to the categories of the catalogue are replaced by them, so that
+        # they are shared again
+        reference = frames.get('catalogue')
+        if reference is not None:
+            for kind, data in frames.items():
+                if kind == 'catalogue':
+                    continue
+                for column in data.columns:
+                    dtype = data[column].dtype
+                    if (isinstance(dtype, pd.CategoricalDtype) and column in reference 
+                        and isinstance(reference[column].dtype, pd.CategoricalDtype)
+                        and dtype.categories.equals(reference[column].dtype.categories)):
+                        data[column] = pd.Categorical.from_codes(data[column].cat.codes, 
+                                                                 dtype=reference[column].dtype)
+        self.cache_key = key
+
+        return frames
+    
+
+    def write_cache(self, path, name, cache_dir, kind, data):
+        """
+        Function to add a processed dataframe to the cache
+
+        Only the new dataframe is written, and it is listed in the cache key. Nothing 
+        is written if the catalogue file has changed since it was parsed (see 
+        source_key), or if the frames do not come from the file.
+
+        Parameters
+        ----------
+        path : str
+            Path to the catalogue files
+        name : str
+            Name of the catalogue file
+        cache_dir : str
+            Directory where the processed catalogues are cached
+        kind : str
+            Dataframe ('catalogue', 'rrls', 'molecules' or 'uf')
+        data : pandas dataframe
+            Processed dataframe
+        """
+        key = self.cache_key
+        if data is None or key is None:
+            return
+        source, key_file, data_stem = self.cache_files(path, name, cache_dir)
+        try:
+            stat = os.stat(source)
+            if key['mtime'] != stat.st_mtime_ns or key['size'] != stat.st_size:
+                return
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file first, so that concurrent jobs never read a
+            # partially written cache
+            data_file = f'{data_stem}.{kind}.parquet'
+            tmp_file = f'{data_file}.{os.getpid()}.tmp'
+            data.to_parquet(tmp_file)
+            os.replace(tmp_file, data_file)
+            if kind not in key['frames']:
+                key['frames'].append(kind)
+            key.setdefault('objects', {})[kind] = [column for column in data.columns 
+                                                   if data[column].dtype == object]
+            self.write_key(key_file, key)
+        except Exception as e:
+            print(f'Error writing cache of {name}: {e}')
+    
+
+    @staticmethod
+    def write_key(key_file, key):
+        """
+        Function to write the key of a cached catalogue
+
+        Parameters
+        ----------
+        key_file : str
+            Path to the json file with the cache key
+        key : dict
+            Cache key
+        """
+        tmp_file = f'{key_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(key, f)
+        os.replace(tmp_file, key_file)
+    
+
+    @classmethod
+    def parse_rrls(cls, data):
+        """
+        Function to parse the rrl species names in a single pass
+
+        Each species name (e.g. H185\ga) is split into its element, ionisation stage,
+        principal quantum number and greek letter of the series.
+
+        Parameters
+        ----------
+        data : pandas dataframe
+            Dataframe with the catalogue information
+
+        Returns
+        -------
+        parsed : pandas dataframe
+            Dataframe with the columns 'Group', 'Element', 'Stage', 'N' and 'Series',
+            with the same index as data. Lines that do not belong to any rrl group or
+            series get missing values
+        """
+        # Each distinct name is parsed once, and the results are taken with the codes of
+        # the rows (the code -1 of a missing name picks the trailing None). Compact frames
+        # are factorized with their categorical codes
+        codes, names = pd.factorize(data['Species'])
+        species = pd.Series(list(names) + [None], dtype=object)
+        # Longest prefixes first, so that e.g. HeII is not taken as He
+        prefixes = sorted(cls.rrl_groups, key=len, reverse=True)
+        pattern = r'^(?P<Group>' + '|'.join(prefixes) + r')(?P<N>\d*)'
+        parts = species.str.extract(pattern)
+
+        group = pd.Categorical(parts['Group'], categories=list(cls.rrl_groups), ordered=True)
+        # The series is given by the last letter of the name (\ga, \gb, ...)
+        series = pd.Categorical(species.str[-1], categories=cls.greek_series, ordered=True)
+
+        elements = list(dict.fromkeys(cls.rrl_groups[key][0] for key in cls.rrl_groups))
+        group_element = np.array([elements.index(cls.rrl_groups[key][0]) for key in cls.rrl_groups] + [-1])
+        group_stage = np.array([cls.rrl_groups[key][1] for key in cls.rrl_groups] + [0], dtype='int8')
+
+        parsed = pd.DataFrame(index=species.index)
+        parsed['Group'] = group
+        parsed['Element'] = pd.Categorical.from_codes(group_element[group.codes], 
+                                                      categories=elements)
+        parsed['Stage'] = group_stage[group.codes]
+        parsed['N'] = pd.to_numeric(parts['N'], errors='coerce').astype('Int64')
+        parsed['Series'] = series
+        parsed = parsed.iloc[codes].set_axis(data.index)
+
+        return parsed
+    
+
     def sort_greek(self, data):
         """
         Function to sort lines by greek letter
@@ -200,36 +850,12 @@ class Catalogue:
         final_data : pandas dataframe
             Dataframe with the catalogue information sorted by greek letter
         """
-        ga = data[data['Species'].str.endswith('a')]
-        gb = data[data['Species'].str.endswith('b')]
-        gg = data[data['Species'].str.endswith('g')]
-        gd = data[data['Species'].str.endswith('d')]
-        ge = data[data['Species'].str.endswith('e')]
-        gz = data[data['Species'].str.endswith('z')]
-        gh = data[data['Species'].str.endswith('h')]
-        gq = data[data['Species'].str.endswith('q')]
-        gi = data[data['Species'].str.endswith('i')]
-        gk = data[data['Species'].str.endswith('k')]
-        gl = data[data['Species'].str.endswith('l')]
-        gm = data[data['Species'].str.endswith('m')]
-        gn = data[data['Species'].str.endswith('n')]
-        gx = data[data['Species'].str.endswith('x')]
-        go = data[data['Species'].str.endswith('o')]
-        gp = data[data['Species'].str.endswith('p')]
-        gr = data[data['Species'].str.endswith('r')]
-        gs = data[data['Species'].str.endswith('s')]
-        gt = data[data['Species'].str.endswith('t')]
-        gu = data[data['Species'].str.endswith('u')]
-        gf = data[data['Species'].str.endswith('f')]
-        gc = data[data['Species'].str.endswith('c')]
-        gy = data[data['Species'].str.endswith('y')]
-        gw = data[data['Species'].str.endswith('w')]
-
-        final_data = pd.concat([ga, gb, gg, gd, ge, gz,
-                                gh, gq, gi, gk, gl, gm,
-                                gn, gx, go, gp, gr, gs,
-                                gt, gu, gf, gc, gy, gw],
-                                axis=0).reset_index(drop=True)
+        series = pd.Categorical(data['Species'].astype(object).str[-1], 
+                                categories=self.greek_series, ordered=True)
+        # Lines out of the greek series are dropped and ties keep their order
+        keep = np.flatnonzero(series.codes >= 0)
+        order = np.argsort(series.codes[keep], kind='stable')
+        final_data = data.iloc[keep[order]].reset_index(drop=True)
         
         return final_data
     
@@ -248,40 +874,16 @@ class Catalogue:
         final_data : pandas dataframe
             Dataframe with the catalogue information sorted by element and series
         """
-        # Get hydrogen lines
-        # They start by H and not by He or 3He
-        Hydrogen = data[data['Species'].str.startswith('H') 
-                        & ~data['Species'].str.startswith('He') 
-                        & ~data['Species'].str.startswith('3He')]
-        Deuterium = data[data['Species'].str.startswith('D')]
-        TriHelium = data[data['Species'].str.startswith('3He') 
-                         & ~data['Species'].str.startswith('3HeII')]
-        Helium = data[data['Species'].str.startswith('He')]
-        Carbon = data[data['Species'].str.startswith('C') 
-                      & ~data['Species'].str.startswith('CII') 
-                      & ~data['Species'].str.startswith('CIII')]
-        TriHeliumII = data[data['Species'].str.startswith('3HeII')]
-        HeliumII = data[data['Species'].str.startswith('HeII')]
-        CarbonII = data[data['Species'].str.startswith('CII') 
-                        & ~data['Species'].str.startswith('CIII')]
-        CarbonIII = data[data['Species'].str.startswith('CIII')]
-        OxygenIII = data[data['Species'].str.startswith('OIII')]
-
-        # Sort lines by greek letter
-        Hydrogen = self.sort_greek(Hydrogen)
-        Deuterium = self.sort_greek(Deuterium)
-        TriHelium = self.sort_greek(TriHelium)
-        Helium = self.sort_greek(Helium)
-        Carbon = self.sort_greek(Carbon)
-        TriHeliumII = self.sort_greek(TriHeliumII)
-        HeliumII = self.sort_greek(HeliumII)
-        CarbonII = self.sort_greek(CarbonII)
-        CarbonIII = self.sort_greek(CarbonIII)
-        OxygenIII = self.sort_greek(OxygenIII)
-
-        final_data = pd.concat([Hydrogen, Deuterium, TriHelium, Helium, 
-                                Carbon, TriHeliumII, HeliumII, CarbonII, 
-                                CarbonIII, OxygenIII], axis=0).reset_index(drop=True)
+        parsed = self.parse_rrls(data)
+        group_codes = parsed['Group'].cat.codes.to_numpy()
+        series_codes = parsed['Series'].cat.codes.to_numpy()
+
+        # Keep the lines of the known groups and series, sorted by group and then by 
+        # greek letter. The sort is stable, so ties keep the catalogue order
+        keep = np.flatnonzero((group_codes >= 0) & (series_codes >= 0))
+        order = np.lexsort((series_codes[keep], group_codes[keep]))
+        final_data = pd.concat([data, parsed.drop(columns='Group')], axis=1)
+        final_data = final_data.iloc[keep[order]].reset_index(drop=True)
 
         return final_data
     
@@ -300,7 +902,7 @@ class Catalogue:
         self.rrls : pandas dataframe
             Dataframe with the catalogue information sorted by element and series
         """
-        final_data = data[data['Origin'] == 'rrline']
+        final_data = data[self.column_mask(data['Origin'], lambda values: values == 'rrline')]
         final_data = self.classify_rrls(final_data)
         final_data = self.set_band(final_data)
         final_data = self.set_observed_antenna(final_data)
@@ -322,7 +924,7 @@ class Catalogue:
         self.molecules : pandas dataframe
             Dataframe with the catalogue information sorted by element and series
         """
-        final_data = data[~data['Origin'].isin(['rrline', 'unknow'])]
+        final_data = data[~self.column_mask(data['Origin'], lambda values: values.isin(['rrline', 'unknow']))]
         final_data = self.set_band(final_data)
         final_data = self.set_observed_antenna(final_data)
         # Sort by name and frequency
@@ -345,13 +947,109 @@ class Catalogue:
         self.uf : pandas dataframe
             Dataframe with the catalogue information sorted by element and series
         """
-        final_data = data[data['Species'].str.startswith('U-')]
+        final_data = data[self.column_mask(data['Species'], lambda values: values.str.startswith('U-'))]
         final_data = self.set_band(final_data)
         final_data = self.set_observed_antenna(final_data)
         
         return final_data.reset_index(drop=True)
     
 
+    @staticmethod
+    def interval_table(ranges):
+        """
+        Function to build a sorted interval table from a dictionary of frequency ranges
+
+        The table splits the frequency axis at every range edge, so that each edge and
+        each open segment between two consecutive edges is covered by a single range.
+        When ranges overlap, the first matching key of the dictionary is kept, in the
+        same way as a sequential search over the dictionary would do.
+
+        Parameters
+        ----------
+        ranges : dict
+            Dictionary with the labels as keys and [min, max] frequencies as values
+
+        Returns
+        -------
+        edges : numpy array
+            Sorted unique edges of the ranges
+        edge_codes : numpy array
+            Position in the dictionary of the range containing each edge (-1 if none)
+        segment_codes : numpy array
+            Position in the dictionary of the range containing each open segment
+            between consecutive edges (-1 if none)
+        """
+        bounds = np.array(list(ranges.values()), dtype=float).reshape(-1, 2)
+        edges = np.unique(bounds)
+
+        def first_match(freqs):
+            # Position of the first range containing each frequency
+            inside = (bounds[:, :1] <= freqs) & (freqs <= bounds[:, 1:])
+            return np.where(inside.any(axis=0), inside.argmax(axis=0), -1)
+
+        edge_codes = first_match(edges)
+        segment_codes = first_match(0.5 * (edges[:-1] + edges[1:]))
+
+        return edges, edge_codes, segment_codes
+
+
+    @classmethod
+    def label_frequencies(cls, freqs, ranges, names=None):
+        """
+        Function to label a column of frequencies with the range they belong to
+
+        Parameters
+        ----------
+        freqs : array-like
+            Frequencies in MHz
+        ranges : dict
+            Dictionary with the labels as keys and [min, max] frequencies as values
+        names : dict, optional
+            Dictionary to rename the labels of some of the ranges
+
+        Returns
+        -------
+        labels : numpy array
+            Label of the first range containing each frequency (None if there is none)
+        """
+        freqs = np.asarray(freqs, dtype=float)
+        edges, edge_codes, segment_codes = cls.interval_table(ranges)
+        codes = np.full(len(freqs), -1)
+
+        if len(edges) > 0:
+            # NaN frequencies are sorted after the last edge and stay unlabelled
+            pos = np.searchsorted(edges, freqs, side='left')
+            inner = pos < len(edges)
+            on_edge = np.zeros(len(freqs), dtype=bool)
+            on_edge[inner] = edges[pos[inner]] == freqs[inner]
+            in_segment = ~on_edge & (pos > 0) & inner
+            codes[on_edge] = edge_codes[pos[on_edge]]
+            codes[in_segment] = segment_codes[pos[in_segment] - 1]
+
+        if names is None:
+            names = {}
+        labels = np.array([names.get(key, key) for key in ranges.keys()] + [None], dtype=object)
+
+        # Code -1 picks the trailing None
+        return labels[codes]
+
+
+    @classmethod
+    def band_names(cls):
+        """
+        Function to get the name of each frequency band
+
+        Returns
+        -------
+        names : dict
+            Name of each band of mmbands
+        """
+        # If 'Band' is 7mm, 13mm, 25mm, 5cm, 10cm or 20cm, change the name to the
+        # corresponding IEEE band name
+        return {key: cls.ieee_bands[key] if key in ['7mm', '13mm', '25mm', '5cm', '10cm', '20cm'] else key
+                for key in cls.mmbands}
+    
+
     @classmethod
     def set_band(cls, data):
         """
@@ -368,35 +1066,12 @@ class Catalogue:
             Dataframe with the catalogue information and the frequency band ID
         """
         # Create a new data frame called final_data -> esto lo hacemos para resolver un problema
-        # en el que pandas crea una copia del data frame original y no permitía modificarlo
-        final_data = pd.DataFrame(columns=['Status',
-                                           'Species',
-                                           'Freq[MHz]',
-                                           'Upper',
-                                           'Lower',
-                                           'Origin',
-                                           'Band'])
-        final_data['Status'] = data['Status']
-        final_data['Species'] = data['Species']
-        final_data['Freq[MHz]'] = data['Freq[MHz]']
-        final_data['Upper'] = data['Upper']
-        final_data['Lower'] = data['Lower']
-        final_data['Origin'] = data['Origin']
-        final_data['Band'] = None
-
-        for index, row in final_data.iterrows():
-            # Copy, line by line, the information from the original data frame
-            for i in range(len(cls.mmbands)):
-                # Check the frequency of the line and assign the corresponding band ID
-                if cls.mmbands[list(cls.mmbands.keys())[i]][0] <= row['Freq[MHz]'] <= cls.mmbands[list(cls.mmbands.keys())[i]][1]:
-                    final_data.loc[index, 'Band'] = list(cls.mmbands.keys())[i]
-                    # If 'Band' is 7mm, 13mm, 25mm, 5cm, 10cm or 20cm, change the name to the
-                    # corresponding IEEE band name
-                    if list(cls.mmbands.keys())[i] in ['7mm', '13mm', '25mm', '5cm', '10cm', '20cm']:
-                        final_data.loc[index, 'Band'] = cls.ieee_bands[list(cls.mmbands.keys())[i]]
-                    break
-                else:
-                    continue
+        # en el que pandas crea una copia del data frame original y no permitía modificarlo.
+        # The copy is shallow: the new column is added without copying the others
+        final_data = data.copy(deep=False)
+
+        bands = cls.label_frequencies(final_data['Freq[MHz]'], cls.mmbands, names=cls.band_names())
+        final_data['Band'] = pd.Series(bands, index=final_data.index, dtype=object)
 
         return final_data
     
@@ -416,17 +1091,9 @@ class Catalogue:
         data : pandas dataframe
             Dataframe with the catalogue information and the antenna used
         """
-        data['Telescope'] = None
-        # For each line, check the frequency and assign the corresponding antenna
-        for index, row in data.iterrows():
-            for i in range(len(cls.telescopes)):
-                # Check the frequency of the line and assign the corresponding antenna
-                if cls.telescopes[list(cls.telescopes.keys())[i]][0] <= row['Freq[MHz]'] <= cls.telescopes[list(cls.telescopes.keys())[i]][1]:
-                    data.loc[index, 'Telescope'] = list(cls.telescopes.keys())[i]
-                    #print(data.loc[index, 'Freq[MHz]'], list(cls.telescopes.keys())[i])
-                    break
-                else:
-                    continue
+        # Assign to each line the first antenna whose observing window contains it
+        antennas = cls.label_frequencies(data['Freq[MHz]'], cls.telescopes)
+        data['Telescope'] = pd.Series(antennas, index=data.index, dtype=object)
 
         return data
     
@@ -446,8 +1113,539 @@ class Catalogue:
         final_data : pandas dataframe
             Dataframe with the rrls in the observed bands
         """
-        final_data = data[data['Telescope'].isin(cls.telescopes.keys())]
+        final_data = data[cls.column_mask(data['Telescope'], lambda values: values.isin(cls.telescopes.keys()))]
 
         print(final_data)
 
         return final_data.reset_index(drop=True)
+    
+
+    def index_classes(self, kinds=None):
+        """
+        Function to get the line classes to search in
+
+        Parameters
+        ----------
+        kinds : str or list of str, optional
+            Line classes ('rrls', 'molecules', 'uf' or 'catalogue')
+            Default: all the line classes of the catalogue
+
+        Returns
+        -------
+        kinds : list of str
+            Line classes to search in
+        """
+        if kinds is None:
+            kinds = [kind for kind in self.line_classes if getattr(self, kind, None) is not None]
+            if not kinds:
+                kinds = ['catalogue']
+        elif isinstance(kinds, str):
+            kinds = [kinds]
+
+        return kinds
+    
+
+    def frequency_index(self, kind):
+        """
+        Function to get the sorted frequency index of a line class
+
+        The index is built the first time it is needed and rebuilt if the dataframe of
+        the line class is replaced.
+
+        Parameters
+        ----------
+        kind : str
+            Line class ('rrls', 'molecules', 'uf' or 'catalogue')
+
+        Returns
+        -------
+        data : pandas dataframe
+            Dataframe of the line class
+        freqs : numpy array
+            Sorted frequencies of the lines, without missing values
+        order : numpy array
+            Position in data of each sorted frequency
+        """
+        data = getattr(self, kind)
+        entry = self.freq_index.get(kind)
+        if entry is None or entry[0] is not data:
+            freqs = data['Freq[MHz]'].to_numpy(dtype=float)
+            order = np.argsort(freqs, kind='stable')
+            # Missing frequencies are sorted at the end
+            order = order[:np.count_nonzero(~np.isnan(freqs))]
+            entry = (data, freqs[order], order)
+            self.freq_index[kind] = entry
+
+        return entry
+    
+
+    def index_rows(self, kind, data, positions, **columns):
+        """
+        Function to get the rows of a line class found in the frequency index
+
+        Parameters
+        ----------
+        kind : str
+            Line class
+        data : pandas dataframe
+            Dataframe of the line class
+        positions : numpy array
+            Positions of the rows in data
+        **columns : numpy arrays
+            Extra columns to add after the line class
+
+        Returns
+        -------
+        rows : pandas dataframe
+            Rows of data with the line class in column 'Class' and the extra columns
+        """
+        rows = data.iloc[positions].reset_index(drop=True)
+        rows.insert(0, 'Class', kind)
+        for i, (key, value) in enumerate(columns.items()):
+            rows.insert(i + 1, key, value)
+
+        return rows
+    
+
+    def lines_in_range(self, fmin, fmax, kinds=None):
+        """
+        Function to get the catalogue lines in a frequency range
+
+        Parameters
+        ----------
+        fmin : float or astropy Quantity
+            Minimum frequency, in MHz if it is given without units
+        fmax : float or astropy Quantity
+            Maximum frequency, in MHz if it is given without units
+        kinds : str or list of str, optional
+            Line classes to search in
+            Default: all the line classes of the catalogue
+
+        Returns
+        -------
+        lines : pandas dataframe
+            Lines with fmin <= Freq[MHz] <= fmax, sorted by frequency, with their line 
+            class in column 'Class'
+        """
+        fmin, fmax = to_mhz(fmin), to_mhz(fmax)
+        found = []
+        for kind in self.index_classes(kinds):
+            data, freqs, order = self.frequency_index(kind)
+            lo = np.searchsorted(freqs, fmin, side='left')
+            hi = np.searchsorted(freqs, fmax, side='right')
+            found.append(self.index_rows(kind, data, order[lo:hi]))
+        lines = pd.concat(found, ignore_index=True)
+
+        return lines.sort_values(by='Freq[MHz]', kind='stable').reset_index(drop=True)
+    
+
+    def nearest(self, freq, k=1, kinds=None):
+        """
+        Function to get the catalogue lines closest to a frequency
+
+        Parameters
+        ----------
+        freq : float or astropy Quantity
+            Frequency, in MHz if it is given without units
+        k : int, optional
+            Number of lines to return
+            Default: 1
+        kinds : str or list of str, optional
+            Line classes to search in
+            Default: all the line classes of the catalogue
+
+        Returns
+        -------
+        lines : pandas dataframe
+            The k closest lines, sorted by distance, with their line class in column
+            'Class' and their offset from freq in column 'Offset[MHz]'
+        """
+        freq = to_mhz(freq)
+        found = []
+        for kind in self.index_classes(kinds):
+            data, freqs, order = self.frequency_index(kind)
+            # The k closest lines are among the k lines at each side of freq
+            pos = np.searchsorted(freqs, freq)
+            window = np.arange(max(pos - k, 0), min(pos + k, len(freqs)))
+            found.append(self.index_rows(kind, data, order[window], 
+                                         **{'Offset[MHz]': freqs[window] - freq}))
+        lines = pd.concat(found, ignore_index=True)
+        closest = np.argsort(np.abs(lines['Offset[MHz]'].to_numpy()), kind='stable')[:k]
+
+        return lines.iloc[closest].reset_index(drop=True)
+    
+
+    def match(self, freqs, tolerance, kinds=None, max_candidates=None):
+        """
+        Function to match a batch of frequencies with the catalogue lines
+
+        Parameters
+        ----------
+        freqs : array-like or astropy Quantity
+            Frequencies to match, in MHz if they are given without units
+        tolerance : float, array-like or astropy Quantity
+            Maximum distance between a frequency and its matched lines, in MHz if it is
+            given without units. It can be given for each frequency
+        kinds : str or list of str, optional
+            Line classes to search in
+            Default: all the line classes of the catalogue
+        max_candidates : int, optional
+            Maximum number of matched lines for each frequency
+            Default: all the matched lines
+
+        Returns
+        -------
+        matches : pandas dataframe
+            One row per matched pair, sorted by query and distance, with the line class
+            in column 'Class', the position of the frequency in freqs in 'Query', the 
+            frequency in 'Query[MHz]', the rank of the line for its query in 'Rank' (1
+            for the closest) and the offset of the line in 'Offset[MHz]'
+        """
+        freqs = np.atleast_1d(to_mhz(freqs))
+        tolerance = np.broadcast_to(to_mhz(tolerance), freqs.shape)
+        kinds = self.index_classes(kinds)
+        classes, queries, rows, offsets = [], [], [], []
+        for i, kind in enumerate(kinds):
+            data, index, order = self.frequency_index(kind)
+            lo = np.searchsorted(index, freqs - tolerance, side='left')
+            hi = np.searchsorted(index, freqs + tolerance, side='right')
+            query, pos = expand_ranges(lo, hi)
+            classes.append(np.full(len(pos), i))
+            queries.append(query)
+            rows.append(order[pos])
+            offsets.append(index[pos] - freqs[query])
+        classes, queries = np.concatenate(classes), np.concatenate(queries)
+        rows, offsets = np.concatenate(rows), np.concatenate(offsets)
+
+        # Rank the matches of each query by distance, before building any dataframe.
+        # The distance is scaled to [0, 0.5) of the tolerance of its query, so that a
+        # single sort on query + distance orders by query and then by distance
+        scale = 2 * np.where(tolerance > 0, tolerance, 1.0)[queries]
+        ranking = np.argsort(queries + np.abs(offsets) / scale, kind='stable')
+        classes, queries = classes[ranking], queries[ranking]
+        rows, offsets = rows[ranking], offsets[ranking]
+        rank = np.arange(len(queries)) - np.searchsorted(queries, queries, side='left') + 1
+        if max_candidates is not None:
+            keep = rank <= max_candidates
+            classes, queries, rows = classes[keep], queries[keep], rows[keep]
+            offsets, rank = offsets[keep], rank[keep]
+
+        found, positions = [], []
+        for i, kind in enumerate(kinds):
+            selected = np.flatnonzero(classes == i)
+            found.append(self.index_rows(kind, getattr(self, kind), rows[selected]))
+            positions.append(selected)
+        matches = pd.concat(found, ignore_index=True)
+        matches = matches.iloc[np.argsort(np.concatenate(positions))].reset_index(drop=True)
+        matches.insert(1, 'Query', queries)
+        matches.insert(2, 'Query[MHz]', freqs[queries])
+        matches.insert(3, 'Rank', rank)
+        matches.insert(4, 'Offset[MHz]', offsets)
+
+        return matches
+    
+
+    def match_lines(self, lines, tolerance, kinds=None, max_candidates=None):
+        """
+        Function to match the lines found by spectrumfit.line_inspector with the 
+        catalogue lines
+
+        Parameters
+        ----------
+        lines : QTable
+            Table with the lines found in a spectrum
+        tolerance : float, array-like or astropy Quantity
+            Maximum distance between a line and its matched lines, in MHz if it is
+            given without units. It can be given for each line
+        kinds : str or list of str, optional
+            Line classes to search in
+            Default: all the line classes of the catalogue
+        max_candidates : int, optional
+            Maximum number of matched lines for each line
+            Default: all the matched lines
+
+        Returns
+        -------
+        matches : pandas dataframe
+            One row per matched pair, as returned by match, where 'Query' is the row of
+            the line in lines
+        """
+        return self.match(lines['line_center'], tolerance, kinds=kinds, 
+                          max_candidates=max_candidates)
+
+
+def load_catalogue(path, name, cache=True, cache_dir=None, compact=False):
+    """
+    Function to read the catalogue of a source, e.g. in a worker process
+
+    Parameters
+    ----------
+    path : str
+        Path to the catalogue files
+    name : str
+        Name of the catalogue file to read
+    cache : bool, optional
+        Whether to use the on-disk cache of processed catalogues
+        Default: True
+    cache_dir : str, optional
+        Directory of the cache
+        Default: .catalogue_cache inside the catalogue path
+    compact : bool, optional
+        Whether to store the dataframe with compact column types
+        Default: False
+
+    Returns
+    -------
+    catalogue : pandas dataframe
+        Dataframe with the catalogue information, or None if it could not be read
+    """
+    return Catalogue(path, name, cache=cache, cache_dir=cache_dir, compact=compact).catalogue
+
+
+class CatalogueSet:
+    """
+    Class to load the catalogues of many sources and query them together
+
+    Attributes
+    ----------
+    names : list of str
+        Names of the sources loaded
+    table : pandas dataframe
+        Lines of all the sources, with the source of each line in the categorical 
+        column 'Source' and its band and antenna in 'Band' and 'Telescope'
+    freqs : numpy array
+        Sorted frequencies of the lines of table, without missing values
+    order : numpy array
+        Row of table of each sorted frequency
+
+    Methods
+    -------
+    lines_in_range(fmin, fmax, status)
+        Function to get the lines of all the sources in a frequency range
+    match(freqs, tolerance, status)
+        Function to match a batch of frequencies with the lines of all the sources
+    sources_with(species, status)
+        Function to count the lines of some species in each source
+    band_counts(status, by)
+        Function to count the lines of each source in each band
+
+    Parameters
+    ----------
+    path : str
+        Path to the catalogue files
+    names : list of str
+        Names of the catalogue files to read, one per source. Repeated names are read
+        only once
+    cache : bool, optional
+        Whether to use the on-disk cache of processed catalogues
+        Default: True
+    cache_dir : str, optional
+        Directory of the cache
+        Default: .catalogue_cache inside the catalogue path
+    compact : bool, optional
+        Whether to store the table with compact column types (see 
+        Catalogue.compact_frame)
+        Default: False
+    workers : int, optional
+        Number of processes or threads reading the catalogues. With 1 they are read in
+        this process
+        Default: one for each catalogue, up to the number of CPUs
+    processes : bool, optional
+        Whether to read the catalogues in processes (for files that have to be 
+        parsed) or in threads (e.g. for catalogues already in the cache)
+        Default: True
+    """
+
+    def __init__(self, path=None, names=None, cache=True, cache_dir=None, compact=False, 
+                 workers=None, processes=True):
+        if path == None:
+            path = os.path.abspath(os.getcwd()) + '/Source_Catalogues/'
+        names = list(names) if names is not None else []
+        if len(set(names)) < len(names):
+            # The names are the categories of the Source column, which must be unique
+            print('Repeated catalogue names are read only once')
+            names = list(dict.fromkeys(names))
+        if workers is None:
+            workers = min(len(names), os.cpu_count() or 1)
+
+        args = [(path, name, cache, cache_dir, compact) for name in names]
+        if workers <= 1:
+            frames = [load_catalogue(*arg) for arg in args]
+        else:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with pool(max_workers=workers) as executor:
+                frames = list(executor.map(load_catalogue, *zip(*args)))
+
+        self.names = [name for name, data in zip(names, frames) if data is not None]
+        for name, data in zip(names, frames):
+            if data is None:
+                print(f'Catalogue of {name} not loaded')
+        frames = [data for data in frames if data is not None]
+
+        if frames:
+            table = pd.concat(frames, ignore_index=True)
+        else:
+            table = pd.DataFrame({'Freq[MHz]': np.zeros(0)})
+        counts = [len(data) for data in frames]
+        table.insert(0, 'Source', pd.Categorical.from_codes(np.repeat(np.arange(len(frames)), counts), 
+                                                           categories=self.names))
+        # Bands and antennas are labelled once for all the sources
+        table = Catalogue.set_band(table)
+        table = Catalogue.set_observed_antenna(table)
+        if compact:
+            table = Catalogue.compact_frame(table)
+        self.table = table
+
+        # Shared frequency index, with the missing frequencies left out
+        freqs = table['Freq[MHz]'].to_numpy(dtype=float)
+        order = np.argsort(freqs, kind='stable')
+        self.order = order[:np.count_nonzero(~np.isnan(freqs))]
+        self.freqs = freqs[self.order]
+
+        return
+    
+
+    def status_mask(self, status=None):
+        """
+        Function to select the lines of the table with some status
+
+        Parameters
+        ----------
+        status : str or list of str, optional
+            Status of the lines (e.g. 'D' for detected, see Catalogue)
+            Default: all the lines
+
+        Returns
+        -------
+        mask : numpy array
+            Boolean array, True for the lines with the status
+        """
+        if status is None:
+            return np.ones(len(self.table), dtype=bool)
+        if isinstance(status, str):
+            status = [status]
+
+        return Catalogue.column_mask(self.table['Status'], lambda values: values.isin(status))
+    
+
+    def lines_in_range(self, fmin, fmax, status=None):
+        """
+        Function to get the lines of all the sources in a frequency range
+
+        Parameters
+        ----------
+        fmin : float or astropy Quantity
+            Minimum frequency, in MHz if it is given without units
+        fmax : float or astropy Quantity
+            Maximum frequency, in MHz if it is given without units
+        status : str or list of str, optional
+            Status of the lines to get
+            Default: all the lines
+
+        Returns
+        -------
+        lines : pandas dataframe
+            Lines with fmin <= Freq[MHz] <= fmax, sorted by frequency
+        """
+        lo = np.searchsorted(self.freqs, to_mhz(fmin), side='left')
+        hi = np.searchsorted(self.freqs, to_mhz(fmax), side='right')
+        rows = self.order[lo:hi]
+        rows = rows[self.status_mask(status)[rows]]
+
+        return self.table.iloc[rows].reset_index(drop=True)
+    
+
+    def match(self, freqs, tolerance, status=None):
+        """
+        Function to match a batch of frequencies with the lines of all the sources
+
+        Parameters
+        ----------
+        freqs : array-like or astropy Quantity
+            Frequencies to match, in MHz if they are given without units
+        tolerance : float, array-like or astropy Quantity
+            Maximum distance between a frequency and its matched lines, in MHz if it is
+            given without units. It can be given for each frequency
+        status : str or list of str, optional
+            Status of the lines to match
+            Default: all the lines
+
+        Returns
+        -------
+        matches : pandas dataframe
+            One row per matched pair, sorted by query and distance, with the position of
+            the frequency in freqs in 'Query', the frequency in 'Query[MHz]' and the 
+            offset of the line in 'Offset[MHz]'
+        """
+        freqs = np.atleast_1d(to_mhz(freqs))
+        tolerance = np.broadcast_to(to_mhz(tolerance), freqs.shape)
+        lo = np.searchsorted(self.freqs, freqs - tolerance, side='left')
+        hi = np.searchsorted(self.freqs, freqs + tolerance, side='right')
+        query, pos = expand_ranges(lo, hi)
+        keep = self.status_mask(status)[self.order[pos]]
+        query, pos = query[keep], pos[keep]
+        offsets = self.freqs[pos] - freqs[query]
+        ranking = np.lexsort((np.abs(offsets), query))
+        query, pos, offsets = query[ranking], pos[ranking], offsets[ranking]
+
+        matches = self.table.iloc[self.order[pos]].reset_index(drop=True)
+        matches.insert(0, 'Query', query)
+        matches.insert(1, 'Query[MHz]', freqs[query])
+        matches.insert(2, 'Offset[MHz]', offsets)
+
+        return matches
+    
+
+    def sources_with(self, species, status='D'):
+        """
+        Function to count the lines of some species in each source
+
+        Parameters
+        ----------
+        species : str or list of str
+            Species names
+        status : str or list of str, optional
+            Status of the lines to count
+            Default: 'D' (detected)
+
+        Returns
+        -------
+        counts : pandas dataframe
+            Number of lines of each species (columns) in each source (rows). The 
+            sources with lines of a species are those with a count above 0
+        """
+        if isinstance(species, str):
+            species = [species]
+        mask = self.status_mask(status) & Catalogue.column_mask(self.table['Species'], 
+                                                                 lambda values: values.isin(species))
+        selected = self.table[mask]
+        counts = selected.groupby([selected['Source'], selected['Species'].astype(str)], 
+                                  observed=True).size()
+        counts = counts.unstack(fill_value=0).reindex(index=self.names, columns=species, fill_value=0)
+
+        return counts.rename_axis(index='Source', columns='Species')
+    
+
+    def band_counts(self, status='D', by='Band'):
+        """
+        Function to count the lines of each source in each band
+
+        Parameters
+        ----------
+        status : str or list of str, optional
+            Status of the lines to count
+            Default: 'D' (detected)
+        by : str, optional
+            Column to count the lines by, e.g. 'Band' or 'Telescope'
+            Default: 'Band'
+
+        Returns
+        -------
+        counts : pandas dataframe
+            Number of lines of each source (rows) in each band (columns). Lines out of
+            all the bands are not counted
+        """
+        selected = self.table[self.status_mask(status)]
+        counts = selected.groupby([selected['Source'], selected[by]], observed=True).size()
+
+        return counts.unstack(fill_value=0).reindex(index=self.names, fill_value=0)
@@ -0,0 +1,113 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def spectrum_envelope(x, y, xlim=None, pixels=1000):
+    """
+    Function to reduce a spectrum to the minimum and maximum of each pixel
+
+    The channels inside xlim are split in pixels bins and only the channels with the 
+    minimum and the maximum of each bin are kept, in their order, together with the 
+    first and last channels, so the plot of the envelope looks the same as the plot of
+    all the channels.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Spectral axis, sorted
+    y : numpy.ndarray
+        Flux of each channel
+    xlim : tuple of float, optional
+        Range of the spectral axis to reduce
+        Default: the whole spectrum
+    pixels : int, optional
+        Number of bins
+        Default: 1000
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        Spectral axis and flux of the envelope, with at most 2 * pixels + 2 channels
+    """
+    if len(x) > 1 and x[0] > x[-1]:
+        x, y = x[::-1], y[::-1]
+    lo, hi = 0, len(x)
+    if xlim is not None:
+        # Keep one channel more on each side so the line reaches the edges of the axes
+        lo = max(np.searchsorted(x, np.min(xlim), side='left') - 1, 0)
+        hi = min(np.searchsorted(x, np.max(xlim), side='right') + 1, len(x))
+    n = hi - lo
+    if n <= 2 * pixels:
+        return x[lo:hi], y[lo:hi]
+
+    size = -(-n // pixels)
+    bins = -(-n // size)
+    block = np.empty(bins * size, dtype=np.float64)
+    block[:n] = y[lo:hi]
+    block[n:] = y[hi - 1]
+    block = block.reshape(bins, size)
+    blank = np.isnan(block)
+    if blank.any():
+        imin = np.where(blank, np.inf, block).argmin(axis=1)
+        imax = np.where(blank, -np.inf, block).argmax(axis=1)
+    else:
+        imin = block.argmin(axis=1)
+        imax = block.argmax(axis=1)
+    index = np.sort(np.column_stack([imin, imax]), axis=1) + (lo + size * np.arange(bins))[:, None]
+    index = np.concatenate([[lo], np.minimum(index, hi - 1).ravel(), [hi - 1]])
+
+    return x[index], y[index]
+
+
+def plot_envelope(ax, x, y, pixels=None, **kwargs):
+    """
+    Function to plot a spectrum reduced to its envelope, recomputed on zoom
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axes to plot in
+    x : numpy.ndarray
+        Spectral axis, sorted
+    y : numpy.ndarray
+        Flux of each channel
+    pixels : int, optional
+        Number of bins of the envelope (see spectrum_envelope)
+        Default: the width of the axes in pixels
+    **kwargs
+        Arguments of matplotlib.axes.Axes.plot
+
+    Returns
+    -------
+    line : matplotlib.lines.Line2D
+        Line of the envelope
+    """
+    x, y = np.asarray(x), np.asarray(y)
+
+    def bins():
+        return pixels or max(int(ax.bbox.width), 1)
+
+    line, = ax.plot(*spectrum_envelope(x, y, pixels=bins()), **kwargs)
+    ax.callbacks.connect('xlim_changed', 
+                         lambda axes: line.set_data(*spectrum_envelope(x, y, axes.get_xlim(), bins())))
+
+    return line
+
+
+def show_figure(fig, filename=None):
+    """
+    Function to show a figure, or to save it to a file without showing it
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to show
+    filename : str, optional
+        File to save the figure to; the figure is closed after saving it
+        Default: show the figure
+    """
+    if filename is None:
+        plt.show()
+    else:
+        fig.savefig(filename)
+        plt.close(fig)
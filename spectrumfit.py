@@ -1,26 +1,66 @@
 import os
+import json
+import time
+import signal
+import threading
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from numpy.lib.stride_tricks import sliding_window_view
+
 from astropy import units as u
 from astropy.constants import si
 from astropy.units import equivalencies as eq
-from astropy.table import QTable
+from astropy.table import QTable, vstack
+from astropy.nddata import StdDevUncertainty
 
 from specutils import Spectrum1D, SpectralRegion
-from specutils.analysis import equivalent_width, snr_derived
+from specutils.analysis import equivalent_width
 from specutils.fitting import fit_generic_continuum, find_lines_derivative, find_lines_threshold
 from specutils.manipulation import noise_region_uncertainty
 
+from catalogues import expand_ranges
+from plotting import plot_envelope, show_figure
+
 
 os.path.abspath(os.getcwd())
 
+# Speed of light in km/s
+c_kms = si.c.to_value('km/s')
+
+
+def read_spectrum_file(filename):
+    """
+    Function to read the velocity and flux columns of a spectrum file
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file
+
+    Returns
+    -------
+    data : numpy.ndarray
+        Array of shape (channels, 2) with the velocity and flux of each channel
+    """
+    # Whitespace separated columns are parsed by the C engine of pandas
+    data = pd.read_csv(filename, sep=r'\s+', header=None, names=['rx(km/s)', 'ry(Tmb)'], 
+                       dtype=np.float64, engine='c')
+
+    return data.to_numpy(dtype=np.float64)
+
 
-def read_spectrum(path, filename, n=None):
+def read_spectrum(path, filename, n=None, workers=None):
     """
     Function to read a spectrum from a file
 
+    The files are parsed concurrently and the channels with -1 K < Tmb < 1 K are copied,
+    in the order of the files, into a single array.
+
     Parameters
     ----------
     path : str
@@ -29,6 +69,9 @@ def read_spectrum(path, filename, n=None):
         List of files to read
     n : int, optional
         Number of files to read
+    workers : int, optional
+        Number of threads used to read the files
+        Default: one for each file, up to the number of CPUs
 
     Returns
     -------
@@ -36,16 +79,25 @@ def read_spectrum(path, filename, n=None):
         Data read from the file
     """
     try:
-        data = pd.DataFrame
-        full_paths = [os.path.join(path, f) for f in filename]
-        data = pd.concat((pd.read_csv(f, sep='\s+', header=None, names=['rx(km/s)', 'ry(Tmb)']) for f in full_paths), ignore_index=True)
-        #for i in range(n):
-        #    dat = pd.read_csv(filename[i], sep='\s+', header=None, names=['rx(km/s)', 'ry(Tmb)'])
-        #    data = dat if i == 0 else pd.concat([data, dat], ignore_index=True)
-        if not data.empty:
-            data = data.astype({'rx(km/s)': 'float64', 'ry(Tmb)': 'float64'})
-            data = data[(data['ry(Tmb)'].astype(float) > -1.0) & (data['ry(Tmb)'].astype(float) < 1.0)]
-        return data.reset_index(drop=True)
+        full_paths = [os.path.join(path, f) for f in filename][:n]
+        if workers is None:
+            workers = min(len(full_paths), os.cpu_count() or 1)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                blocks = list(pool.map(read_spectrum_file, full_paths))
+        else:
+            blocks = [read_spectrum_file(f) for f in full_paths]
+
+        # Copy the valid channels of every file into one preallocated array
+        masks = [(block[:, 1] > -1.0) & (block[:, 1] < 1.0) for block in blocks]
+        values = np.empty((sum(int(np.count_nonzero(mask)) for mask in masks), 2), dtype=np.float64)
+        start = 0
+        for block, mask in zip(blocks, masks):
+            end = start + np.count_nonzero(mask)
+            np.compress(mask, block, axis=0, out=values[start:end])
+            start = end
+        data = pd.DataFrame(values, columns=['rx(km/s)', 'ry(Tmb)'], copy=False)
+        return data
     except FileNotFoundError:
         print(f'File {filename} not found')
         return None
@@ -60,8 +112,8 @@ def get_source_info(filename):
 
     Parameters
     ----------
-    filename : str
-        Name of the file to read
+    filename : str or list
+        Name of the file to read, or list of files of the same spectrum
 
     Returns
     -------
@@ -70,6 +122,9 @@ def get_source_info(filename):
     band : str
         Frequency band of the spectrum
     """
+    # All the files of a spectrum share the source and band
+    if isinstance(filename, (list, tuple)):
+        filename = filename[0]
     # Convert filename to string
     filename = str(filename)
     # Get source name
@@ -80,6 +135,90 @@ def get_source_info(filename):
     return source, band
 
 
+# File with the parameters of each source and band
+source_params_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'source_params.csv')
+
+# Registry of source parameters, keyed by (source, band), loaded on first use
+source_params = {}
+
+
+def load_source_params(filename=None):
+    """
+    Function to load the registry of source parameters from a csv file
+
+    Parameters
+    ----------
+    filename : str, optional
+        Path to the csv file, with columns source, band, vel[km/s], restfreq[MHz] and
+        offset[MHz]
+        Default: source_params.csv next to this module
+
+    Returns
+    -------
+    source_params : dict
+        Registry keyed by (source, band) with the velocity, rest frequency, offset and
+        radio Doppler equivalency of each entry
+    """
+    if filename is None:
+        filename = source_params_file
+    data = pd.read_csv(filename, comment='#', skipinitialspace=True, 
+                       dtype={'source': str, 'band': str})
+
+    registry = {}
+    for source, band, vel, restfreq, offset in zip(data['source'], data['band'], 
+                                                   data['vel[km/s]'], 
+                                                   data['restfreq[MHz]'], 
+                                                   data['offset[MHz]']):
+        restfreq = restfreq * u.MHz
+        registry[(source, band)] = {'vel': vel * u.km / u.s,
+                                    'restfreq': restfreq,
+                                    'offset': offset * u.MHz,
+                                    'doppler': u.doppler_radio(restfreq)}
+    source_params.clear()
+    source_params.update(registry)
+
+    return source_params
+
+
+def get_source_entry(source, band):
+    """
+    Function to get the registry entry of a source and band
+
+    Parameters
+    ----------
+    source : str
+        Source name. If it is not registered, the registered source contained in the 
+        name is used (e.g. IC418 for IC418-offset)
+    band : str
+        Frequency band of the spectrum
+
+    Returns
+    -------
+    entry : dict
+        Velocity, rest frequency, offset and radio Doppler equivalency of the source
+
+    Raises
+    ------
+    ValueError
+        If the source or the band are not registered
+    """
+    if not source_params:
+        load_source_params()
+    entry = source_params.get((source, band))
+    if entry is not None:
+        return entry
+
+    sources = [name for name, _ in source_params if name in source]
+    if not sources:
+        raise ValueError(f"Unknown source: {source}")
+    # Remember the match, so that the next lookup of this source is direct
+    for name in sorted(sources, key=len, reverse=True):
+        if (name, band) in source_params:
+            source_params[(source, band)] = source_params[(name, band)]
+            return source_params[(source, band)]
+    raise ValueError(f"Unknown band: {band}")
+
+
 def get_source_param(source, band):
     """
     Function to get the source parameters
@@ -101,42 +240,8 @@ def get_source_param(source, band):
         Offset in frequency
     """
     try:
-        if 'IC418' in source:
-            vel = 42.59999847412109 * u.km / u.s
-            if band == 'Qband':
-                restfreq = 39550.0 * u.MHz
-                offset = 5.5 * u.MHz
-            elif band == '3mm':
-                restfreq = 87317.0 * u.MHz
-                offset = 12.0 * u.MHz
-            elif band == '2mm':
-                restfreq = 136649.0 * u.MHz
-                offset = 18.0 * u.MHz
-            elif band == '1mm':
-                restfreq = 230538.0 * u.MHz
-                offset = 31.0 * u.MHz
-            else:
-                raise ValueError(f"Unknown band: {band}")
-        elif 'NGC7027' in source or 'NGC_7027' in source:
-            vel = 26.0 * u.km / u.s
-            if band == 'Qband':
-                restfreq = 39550.0 * u.MHz
-                offset = 3.5 * u.MHz
-            elif band == '3mm':
-                restfreq = 87317.0 * u.MHz
-                offset = 7.0 * u.MHz
-            elif band == '2mm':
-                restfreq = 136649.0 * u.MHz
-                offset = 11.0 * u.MHz
-            else:
-                raise ValueError(f"Unknown band: {band}")
-            '''elif band == '1mm':
-                restfreq = 230538.0 * u.MHz
-                offset = 31.0 * u.MHz'''
-        else:
-            raise ValueError(f"Unknown source: {source}")
-            
-        return vel, restfreq, offset
+        entry = get_source_entry(source, band)
+        return entry['vel'], entry['restfreq'], entry['offset']
         
     except Exception as e:
         print(f'Error getting source parameters: {e}')
@@ -144,8 +249,195 @@ def get_source_param(source, band):
         return None, None, None
 
 
+def spectrum_store_files(store):
+    """
+    Function to get the files of a binary spectrum store
+
+    Parameters
+    ----------
+    store : str
+        Path and base name of the store
+
+    Returns
+    -------
+    freq_file : str
+        Path to the .npy file with the frequency of each channel in MHz
+    flux_file : str
+        Path to the .npy file with the flux of each channel in K
+    meta_file : str
+        Path to the json file with the source parameters
+    """
+    return store + '.freq.npy', store + '.flux.npy', store + '.json'
+
+
+def source_files_info(full_paths):
+    """
+    Function to get the size and modification time of the files of a spectrum
+
+    Parameters
+    ----------
+    full_paths : list
+        Paths to the files
+
+    Returns
+    -------
+    info : list of dict
+        Absolute path, size and modification time of each file
+    """
+    info = []
+    for f in full_paths:
+        stat = os.stat(f)
+        info.append({'name': os.path.abspath(f), 'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+
+    return info
+
+
+def write_spectrum_store(store, spectrum, source, band, offset, full_paths=None):
+    """
+    Function to write a spectrum to a binary store
+
+    The frequency and flux of the channels are saved as raw float64 .npy files and the
+    source parameters in a json sidecar. The files are written to temporary files and
+    then moved into place, so spectra still memory-mapped from a previous version of 
+    the store keep reading the old channels.
+
+    Parameters
+    ----------
+    store : str
+        Path and base name of the store
+    spectrum : specutils.Spectrum1D
+        Spectrum to store
+    source : str
+        Source name
+    band : str
+        Frequency band of the spectrum
+    offset : astropy.units.Quantity
+        Offset in frequency already applied to the spectral axis
+    full_paths : list, optional
+        Paths to the text files the spectrum was read from, used to detect changes
+
+    Returns
+    -------
+    None
+    """
+    freq_file, flux_file, meta_file = spectrum_store_files(store)
+    meta = {'source': source,
+            'band': band,
+            'restfreq': spectrum.rest_value.to_value(u.MHz),
+            'vel': spectrum.radial_velocity.to_value(u.km / u.s),
+            'offset': u.Quantity(offset, u.MHz).to_value(u.MHz),
+            'channels': len(spectrum.spectral_axis),
+            'files': source_files_info(full_paths) if full_paths is not None else None}
+    # Without its sidecar the store is not opened while the channels are replaced
+    try:
+        os.remove(meta_file)
+    except FileNotFoundError:
+        pass
+    for filename, values in [(freq_file, spectrum.spectral_axis.to_value(u.MHz)), 
+                             (flux_file, spectrum.flux.to_value(u.K))]:
+        tmp_file = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.asarray(values, dtype=np.float64))
+        os.replace(tmp_file, filename)
+    # The sidecar is written last, so that an incomplete store is never opened
+    tmp_file = f'{meta_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_file, meta_file)
+
+    return None
+
+
+def read_spectrum_store(store, full_paths=None, entry=None):
+    """
+    Function to open a spectrum from a binary store
+
+    The channels are memory-mapped, so the spectrum is neither parsed nor converted. 
+    The flux stays backed by the file; specutils keeps its own copy of the spectral 
+    axis.
+
+    Parameters
+    ----------
+    store : str
+        Path and base name of the store
+    full_paths : list, optional
+        Paths to the text files of the spectrum. If they have changed since the store
+        was written, the store is not used
+    entry : dict, optional
+        Registry entry of the source and band (see get_source_entry). If its velocity,
+        rest frequency or offset differ from those of the store, the store is not used
+
+    Returns
+    -------
+    spectrum : specutils.Spectrum1D
+        Spectrum read from the store, or None if the store does not exist, is out of
+        date or cannot be read
+    """
+    freq_file, flux_file, meta_file = spectrum_store_files(store)
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if full_paths is not None and meta['files'] != source_files_info(full_paths):
+            return None
+        if entry is not None and not np.allclose(
+                [meta['vel'], meta['restfreq'], meta['offset']],
+                [entry['vel'].to_value(u.km / u.s), entry['restfreq'].to_value(u.MHz), 
+                 entry['offset'].to_value(u.MHz)], rtol=1e-12, atol=0.0):
+            return None
+        frequency = np.load(freq_file, mmap_mode='r')
+        flux = np.load(flux_file, mmap_mode='r')
+        if len(frequency) != meta['channels'] or len(flux) != meta['channels']:
+            return None
+    except FileNotFoundError:
+        return None
+    except (KeyError, TypeError, ValueError):
+        # Sidecar of an older version or corrupt files (json.JSONDecodeError is a 
+        # ValueError), rebuilt by the caller like a missing store
+        return None
+
+    spectrum = Spectrum1D(flux=u.Quantity(flux, u.K, copy=False), 
+                          spectral_axis=u.Quantity(frequency, u.MHz, copy=False), 
+                          velocity_convention='radio', 
+                          rest_value=meta['restfreq'] * u.MHz, 
+                          radial_velocity=meta['vel'] * u.km / u.s)
+
+    return spectrum
+
+
+def radio_velocity_to_freq(velocity, restfreq, offset=0.0, out=None):
+    """
+    Function to convert radio velocities to frequencies without units
+
+    Uses the radio Doppler relation f = f0 * (1 - v / c) on plain float64 arrays, the
+    same as astropy's u.doppler_radio equivalency.
+
+    Parameters
+    ----------
+    velocity : numpy.ndarray
+        Velocities in km/s
+    restfreq : float
+        Rest frequency in MHz
+    offset : float, optional
+        Offset in MHz added to the frequencies
+        Default: 0.0
+    out : numpy.ndarray, optional
+        Array to store the frequencies, which can be velocity itself to convert it in
+        place
+        Default: a new array
+
+    Returns
+    -------
+    frequency : numpy.ndarray
+        Frequencies in MHz
+    """
+    frequency = np.multiply(velocity, -restfreq / c_kms, out=out)
+    frequency += restfreq + offset
+
+    return frequency
+
+
 #def create_spectrum(data, restfreq, vel, offset=None):
-def create_spectrum(path, filename):
+def create_spectrum(path, filename, store=None, stack=False, channel_width=None, source=None, band=None):
     """
     Function to create a spectrum from a data frame
 
@@ -155,32 +447,67 @@ def create_spectrum(path, filename):
         Path to the file
     filename : str
         Name of the file to read
+    store : str, optional
+        Path and base name of a binary store of the spectrum. If it is up to date, the
+        spectrum is memory-mapped from it; otherwise it is created from the text files 
+        and written to the store
+    stack : bool, optional
+        Whether to average the files on a common frequency grid with stack_spectra,
+        instead of concatenating their channels
+        Default: False
+    channel_width : float, optional
+        Width of the channels in MHz when stack is True (see stack_spectra)
+    source, band : str, optional
+        Source and band of the spectrum, whose parameters are taken from the registry
+        (see get_source_entry)
+        Default: taken from the first file name (see get_source_info)
         
     Returns
     -------
     spectrum : specutils.Spectrum1D
         Spectrum created from the data
+
+    Raises
+    ------
+    FileNotFoundError
+        If a file of the spectrum is not found
     """
+    files = [filename] if isinstance(filename, str) else list(filename)
+    full_paths = [os.path.join(path, f) for f in files]
+    for full_path in full_paths:
+        if not os.path.isfile(full_path):
+            raise FileNotFoundError(f'File {full_path} not found')
+    if source is None or band is None:
+        source, band = get_source_info(filename)
+    entry = get_source_entry(source, band)
+
+    if store is not None:
+        spectrum = read_spectrum_store(store, full_paths, entry)
+        if spectrum is not None:
+            return spectrum
+
+    if stack:
+        spectrum = stack_spectra(path, files, channel_width=channel_width, source=source, band=band)
+        if store is not None:
+            write_spectrum_store(store, spectrum, source, band, entry['offset'], full_paths)
+        return spectrum
+
     # Read spectrum from file
-    data = read_spectrum(path, filename)
+    data = read_spectrum(path, files)
     if data is None:
         raise ValueError(f"File {filename} not found or could not be read.")
 
-    source, band = get_source_info(filename)
-    vel, restfreq, offset = get_source_param(source, band)
-
-    # Asegúrate de que restfreq tenga la unidad correcta
-    if not isinstance(restfreq, u.Quantity):
-        restfreq = restfreq * u.MHz
+    vel, restfreq, offset = entry['vel'], entry['restfreq'], entry['offset']
 
-    # Define equivalence velocity - frequency
-    vel_to_freq = u.doppler_radio(restfreq)
-    
     # Set units
     if 'rx(km/s)' not in data.columns or 'ry(Tmb)' not in data.columns:
         raise ValueError("The required columns 'rx(km/s)' and 'ry(Tmb)' are not present in the data.")
-    frequency = (data['rx(km/s)'].values * u.km / u.s).to(u.MHz, equivalencies=vel_to_freq)
-    flux = data['ry(Tmb)'].values * u.K
+    # Convert velocity to frequency, with the offset, in a single float64 buffer and
+    # attach units once (pandas may hand out read-only views, so it is not done in place)
+    frequency = radio_velocity_to_freq(data['rx(km/s)'].to_numpy(dtype=np.float64), 
+                                       restfreq.to_value(u.MHz), offset.to_value(u.MHz))
+    frequency = u.Quantity(frequency, u.MHz, copy=False)
+    flux = u.Quantity(data['ry(Tmb)'].to_numpy(dtype=np.float64), u.K, copy=False)
 
     # Check if restfreq and vel are given with units or not
     '''if not isinstance(restfreq, u.Quantity):
@@ -191,17 +518,625 @@ def create_spectrum(path, filename):
     offset = 0.0 * u.MHz if offset is None else offset * u.MHz'''
 
     # Create spectrum
-    spectrum = Spectrum1D(flux=flux, spectral_axis=frequency+offset, 
+    spectrum = Spectrum1D(flux=flux, spectral_axis=frequency, 
                           velocity_convention='radio', 
                           rest_value=restfreq, 
                           radial_velocity=vel)
     
-    print('snr: ', snr_derived(spectrum))
+    if store is not None:
+        write_spectrum_store(store, spectrum, source, band, offset, full_paths)
 
     return spectrum
 
 
-def line_inspector(spectrum, rms, source, line_type=None):
+def channel_edges(centers):
+    """
+    Function to compute the edges of channels from their increasing centers
+
+    Parameters
+    ----------
+    centers : numpy.ndarray
+        Increasing centers of the channels
+
+    Returns
+    -------
+    edges : numpy.ndarray
+        Edges of the channels (one more than the centers), halfway between the centers
+    """
+    edges = np.empty(len(centers) + 1)
+    edges[1:-1] = (centers[1:] + centers[:-1]) / 2.0
+    edges[0] = centers[0] - (edges[1] - centers[0])
+    edges[-1] = centers[-1] + (centers[-1] - edges[-2])
+
+    return edges
+
+
+def rebin_flux(edges, flux, new_edges, weight=None):
+    """
+    Function to rebin a spectrum onto new channels conserving the flux
+
+    The weighted flux and the weights are integrated with cumulative sums, and the
+    integrals are interpolated at the new edges (exact for a flux constant within each
+    channel), so every channel contributes to each new channel with the fraction of its 
+    width that falls inside it.
+
+    Parameters
+    ----------
+    edges : numpy.ndarray
+        Increasing edges of the channels
+    flux : numpy.ndarray
+        Flux of the channels
+    new_edges : numpy.ndarray
+        Increasing edges of the new channels
+    weight : numpy.ndarray, optional
+        Weight of each channel (e.g. inverse variance, 0 for bad channels). The channels
+        with a non-finite flux or weight get weight 0
+        Default: 1 for every channel
+
+    Returns
+    -------
+    sum_flux : numpy.ndarray
+        Sum of weight x flux x fraction of the channels in each new channel
+    sum_weight : numpy.ndarray
+        Sum of weight x fraction of the channels in each new channel. The rebinned flux
+        is sum_flux / sum_weight
+    """
+    weight = np.ones(len(flux)) if weight is None else weight
+    # Non-finite channels are left out, or the NaN would spread to every later sum
+    good = np.isfinite(flux) & np.isfinite(weight)
+    weight = np.where(good, weight, 0.0)
+    flux = np.where(good, flux, 0.0)
+    cum_weight = np.concatenate([[0.0], np.cumsum(weight)])
+    cum_flux = np.concatenate([[0.0], np.cumsum(weight * flux)])
+
+    return (np.diff(np.interp(new_edges, edges, cum_flux)), 
+            np.diff(np.interp(new_edges, edges, cum_weight)))
+
+
+def stack_spectra(path, filename, channel_width=None, weighting='noise', window=8192, source=None, 
+                  band=None):
+    """
+    Function to stack the scans of a spectrum on a common frequency grid
+
+    The files are read one at a time, converted to frequency with the parameters of
+    the source and band (see get_source_entry), rebinned onto a grid of channels of 
+    channel_width (with rebin_flux) and added to running sums of the weighted flux and 
+    the weights, which are the only arrays kept between files. The channels of each file
+    are weighted with the inverse of the variance of their noise profile (noise_profile),
+    so overlapping scans are averaged with inverse-variance weights. As in read_spectrum, 
+    the channels with |Tmb| >= 1 K are left out.
+
+    Parameters
+    ----------
+    path : str
+        Path to the files
+    filename : list
+        List of files to stack, of the same source and band
+    channel_width : float, optional
+        Width of the channels of the stacked spectrum in MHz
+        Default: the median channel width of the first file
+    weighting : str, optional
+        'noise' for inverse-variance weights, or None for equal weights per channel
+        Default: 'noise'
+    window : int, optional
+        Number of channels of the windows of noise_profile
+        Default: 8192
+    source, band : str, optional
+        Source and band of the files
+        Default: taken from the first file name (see get_source_info)
+
+    Returns
+    -------
+    spectrum : specutils.Spectrum1D
+        Stacked spectrum on the channels with data, with the noise of each channel in 
+        spectrum.uncertainty when weighting is 'noise' (1 / sqrt of the sum of the 
+        weights, exact for channels wider than those of the files and an upper bound
+        otherwise)
+    """
+    if source is None or band is None:
+        source, band = get_source_info(filename)
+    entry = get_source_entry(source, band)
+    restfreq, offset = entry['restfreq'].to_value(u.MHz), entry['offset'].to_value(u.MHz)
+
+    sum_flux = sum_weight = None
+    for name in filename:
+        data = read_spectrum_file(os.path.join(path, name))
+        frequency = radio_velocity_to_freq(data[:, 0], restfreq, offset)
+        flux = data[:, 1]
+        if frequency[0] > frequency[-1]:
+            frequency, flux = frequency[::-1], flux[::-1]
+        valid = (flux > -1.0) & (flux < 1.0)
+        if weighting == 'noise':
+            centers, rms, mad = noise_profile(np.where(valid, flux, np.nan), window=window)
+            noise = np.interp(np.arange(len(flux)), centers, rms)
+            weight = np.where(valid & (noise > 0), 1.0 / np.where(noise > 0, noise, 1.0) ** 2, 0.0)
+        else:
+            weight = valid.astype(np.float64)
+        edges = channel_edges(frequency)
+
+        if sum_flux is None:
+            width = channel_width if channel_width is not None else float(np.median(np.diff(edges)))
+            anchor = edges[0]
+            first = last = 0
+            sum_flux, sum_weight = np.zeros(0), np.zeros(0)
+        # Grid channels k cover [anchor + k width, anchor + (k + 1) width); the sums
+        # cover the channels first to last and grow when a file extends them
+        lo = int(np.floor((edges[0] - anchor) / width))
+        hi = int(np.ceil((edges[-1] - anchor) / width))
+        if lo < first or hi > last:
+            pad = (first - min(lo, first), max(hi, last) - last)
+            sum_flux, sum_weight = np.pad(sum_flux, pad), np.pad(sum_weight, pad)
+            first, last = min(lo, first), max(hi, last)
+        new_flux, new_weight = rebin_flux(edges, flux, anchor + np.arange(lo, hi + 1) * width, weight)
+        sum_flux[lo - first:hi - first] += new_flux
+        sum_weight[lo - first:hi - first] += new_weight
+
+    covered = sum_weight > 0
+    frequency = anchor + (np.arange(first, last)[covered] + 0.5) * width
+    flux = sum_flux[covered] / sum_weight[covered]
+    uncertainty = None
+    if weighting == 'noise':
+        uncertainty = StdDevUncertainty(1.0 / np.sqrt(sum_weight[covered]))
+
+    return Spectrum1D(flux=u.Quantity(flux, u.K, copy=False), 
+                      spectral_axis=u.Quantity(frequency, u.MHz, copy=False), 
+                      velocity_convention='radio', 
+                      rest_value=entry['restfreq'], 
+                      radial_velocity=entry['vel'],
+                      uncertainty=uncertainty)
+
+
+def noise_profile(flux, window=8192, step=None, nsigma=3.0, iterations=5, differences=True, 
+                  chunk=1024):
+    """
+    Function to estimate the noise of a spectrum in sliding windows
+
+    The windows are strided views of the flux (no copy of the spectrum), processed 
+    chunk windows at a time. In each window the noise is estimated as 1.4826 times the 
+    median absolute deviation (MAD) and as the rms of the values that survive an 
+    iterative nsigma clipping started from the median and the MAD. By default the 
+    values are the differences between consecutive channels divided by sqrt(2), which
+    have the noise of the channels but not the lines (much wider than a channel) nor 
+    the baseline; this assumes that the noise of consecutive channels is independent.
+
+    Parameters
+    ----------
+    flux : array-like
+        Flux of the channels (e.g. a numpy.memmap)
+    window : int, optional
+        Number of channels of each window
+        Default: 8192
+    step : int, optional
+        Number of channels between the starts of consecutive windows
+        Default: window // 2
+    nsigma : float, optional
+        Clipping threshold in standard deviations
+        Default: 3.0
+    iterations : int, optional
+        Number of clipping iterations
+        Default: 5
+    differences : bool, optional
+        Whether to estimate the noise from the differences between consecutive channels
+        instead of the flux
+        Default: True
+    chunk : int, optional
+        Number of windows processed at once
+        Default: 1024
+
+    Returns
+    -------
+    centers : numpy.ndarray
+        Central channel of each window. Windows longer than the spectrum are cut to 
+        its length, and spectra with less than 2 channels give a single window with
+        NaN noise
+    rms : numpy.ndarray
+        Sigma-clipped rms of each window
+    mad : numpy.ndarray
+        MAD noise of each window
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    if len(flux) < 2:
+        # Too short to estimate the noise: a single window without noise estimate
+        nan = np.full(1, np.nan)
+        return np.array([max(len(flux) - 1, 0) / 2.0]), nan, nan.copy()
+    window = max(2, min(window, len(flux)))
+    step = max(1, window // 2) if step is None else step
+    windows = sliding_window_view(flux, window)[::step]
+    starts = np.arange(len(windows)) * step
+    blocks = [windows[start:start + chunk] for start in range(0, len(windows), chunk)]
+    # The last window ends at the last channel, so the whole spectrum is covered
+    if starts[-1] + window < len(flux):
+        blocks.append(flux[None, len(flux) - window:])
+        starts = np.append(starts, len(flux) - window)
+    centers = starts + (window - 1) / 2.0
+
+    rms, mad = [], []
+    for block in blocks:
+        if differences:
+            block = np.diff(block, axis=1) / np.sqrt(2.0)
+        median = np.nanmedian(block, axis=1, keepdims=True)
+        deviation = np.nanmedian(np.abs(block - median), axis=1, keepdims=True) * 1.4826
+        center, scale = median, deviation
+        for _ in range(iterations):
+            keep = np.abs(block - center) <= nsigma * scale
+            count = np.count_nonzero(keep, axis=1, keepdims=True)
+            center = np.where(keep, block, 0.0).sum(axis=1, keepdims=True) / np.maximum(count, 1)
+            scale = np.sqrt(np.where(keep, (block - center) ** 2, 0.0).sum(axis=1, keepdims=True) 
+                            / np.maximum(count - 1, 1))
+        rms.append(scale[:, 0])
+        mad.append(deviation[:, 0])
+    rms, mad = np.concatenate(rms), np.concatenate(mad)
+
+    return centers, rms, mad
+
+
+def estimate_noise(spectrum, window=8192, step=None, nsigma=3.0, iterations=5, differences=True):
+    """
+    Function to estimate the noise of a spectrum
+
+    The noise is computed once with noise_profile and cached in spectrum.meta['noise'],
+    so later calls with the same parameters do not read the spectrum again.
+
+    Parameters
+    ----------
+    spectrum : specutils.Spectrum1D
+        Spectrum to estimate the noise
+    window : int, optional
+        Number of channels of each window
+        Default: 8192
+    step : int, optional
+        Number of channels between the starts of consecutive windows
+        Default: window // 2
+    nsigma : float, optional
+        Clipping threshold in standard deviations
+        Default: 3.0
+    iterations : int, optional
+        Number of clipping iterations
+        Default: 5
+    differences : bool, optional
+        Whether to estimate the noise from the differences between consecutive channels
+        Default: True
+
+    Returns
+    -------
+    noise : dict
+        Dictionary with the rms of the spectrum ('rms', median of the sigma-clipped rms 
+        of the windows), its MAD noise ('mad', median of the MAD noise of the windows), 
+        both in K, and the noise of each channel ('profile', astropy.units.Quantity 
+        interpolated between the centers of the windows)
+    """
+    params = (window, step, nsigma, iterations, differences)
+    noise = spectrum.meta.get('noise')
+    if noise is not None and noise['params'] == params:
+        return noise
+
+    flux = spectrum.flux.to_value(u.K)
+    centers, rms, mad = noise_profile(flux, window=window, step=step, nsigma=nsigma, 
+                                      iterations=iterations, differences=differences)
+    noise = {'params': params, 
+             'rms': float(np.median(rms)), 
+             'mad': float(np.median(mad)),
+             'profile': u.Quantity(np.interp(np.arange(len(flux)), centers, rms), u.K, copy=False)}
+    spectrum.meta['noise'] = noise
+
+    return noise
+
+
+def fit_baseline(flux, order=3, segment=None, nsigma=3.0, iterations=5, mask=None, grow=0):
+    """
+    Function to fit the baseline of one or many spectra with masked polynomials
+
+    The spectra are cut in segments of segment channels that overlap by half, and a 
+    Legendre polynomial of the channel index is fitted to each segment. All the segments
+    of all the spectra share the same design matrix, so the normal equations of every 
+    segment are computed with two matrix products and solved in one batched call. The 
+    fits of the segments are blended with triangular weights into a continuous baseline.
+    The channels of the lines are masked iteratively: a channel is masked when it is 
+    farther than nsigma times the noise of its segment (from the differences between 
+    consecutive channels) from the baseline, and the runs of masked channels are grown by
+    grow channels.
+
+    Parameters
+    ----------
+    flux : numpy.ndarray
+        Flux of a spectrum, or array with the flux of a spectrum (e.g. a scan) in each 
+        row, all on the same channels
+    order : int, optional
+        Order of the polynomial of each segment
+        Default: 3
+    segment : int, optional
+        Number of channels of each segment
+        Default: the whole spectrum
+    nsigma : float, optional
+        Threshold of the line channels in standard deviations
+        Default: 3.0
+    iterations : int, optional
+        Maximum number of masking iterations
+        Default: 5
+    mask : numpy.ndarray, optional
+        Channels that are always masked (e.g. known lines), with the shape of flux
+    grow : int, optional
+        Number of channels added at each side of the runs of at least three masked 
+        channels, to mask the wings of the lines
+        Default: 0
+
+    Returns
+    -------
+    baseline : numpy.ndarray
+        Baseline of each spectrum, with the shape of flux
+    mask : numpy.ndarray
+        Channels masked in the last iteration
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    single = flux.ndim == 1
+    flux = np.atleast_2d(flux)
+    spectra, channels = flux.shape
+    fixed = np.zeros(flux.shape, dtype=bool) if mask is None else np.atleast_2d(np.asarray(mask, dtype=bool))
+    fixed = fixed | ~np.isfinite(flux)
+    flux = np.where(np.isfinite(flux), flux, 0.0)
+
+    length = channels if segment is None else max(order + 2, min(int(segment), channels))
+    step = max(1, length // 2)
+    starts = np.arange(0, channels - length + 1, step)
+    if starts[-1] + length < channels:
+        starts = np.append(starts, channels - length)
+    # Design matrix shared by all the segments
+    design = np.polynomial.legendre.legvander(np.linspace(-1.0, 1.0, length), order)
+    ridge = 1e-12 * np.eye(order + 1)
+    block = 65536
+
+    segments = sliding_window_view(flux, length, axis=1)[:, starts]
+    noise = (np.median(np.abs(np.diff(segments, axis=2)), axis=2) * 1.4826 / np.sqrt(2.0))[:, :, None]
+    # Triangular weights of the segments; they add up to one in the channels covered twice
+    taper = 1.0 - np.abs(np.linspace(-1.0, 1.0, length)) + 1e-6
+    index = (np.arange(spectra)[:, None, None] * channels + starts[None, :, None] 
+             + np.arange(length)[None, None, :]).reshape(-1)
+    norm = np.bincount((starts[:, None] + np.arange(length)).reshape(-1), 
+                       weights=np.tile(taper, len(starts)), minlength=channels)
+
+    def normal_equations(weights):
+        # Normal matrix of each segment, accumulated in blocks of channels so that the
+        # products of the columns of the design matrix take at most block x (order + 1)^2
+        # values, whatever the length of the segments
+        flat = weights.reshape(-1, length)
+        normal = np.zeros((len(flat), (order + 1) ** 2))
+        for start in range(0, length, block):
+            part = design[start:start + block]
+            normal += flat[:, start:start + block] @ (part[:, :, None] * part[:, None, :]).reshape(len(part), -1)
+        return normal.reshape(spectra, len(starts), order + 1, order + 1)
+
+    def window_count(values, half):
+        # Number of True values within half channels of each channel
+        counts = np.cumsum(np.pad(values, ((0, 0), (half + 1, half))), axis=1)
+        return counts[:, 2 * half + 1:] - counts[:, :-(2 * half + 1)]
+
+    mask = core_mask = fixed
+    for iteration in range(iterations + 1):
+        weights = ~sliding_window_view(mask, length, axis=1)[:, starts]
+        # Segments left with less than a quarter of free channels by the grown masks use
+        # the masks before growing, so a bad fit cannot mask more channels and get worse
+        crowded = weights.sum(axis=2) < max(length // 4, 2 * (order + 1))
+        if crowded.any():
+            weights = weights.copy()
+            weights[crowded] = ~sliding_window_view(core_mask, length, axis=1)[:, starts][crowded]
+        normal = normal_equations(weights)
+        rhs = np.where(weights, segments, 0.0) @ design
+        coefficients = np.linalg.solve(normal + ridge, rhs[..., None])[..., 0]
+        fits = coefficients @ design.T
+        baseline = (np.bincount(index, weights=(fits * taper).reshape(-1), minlength=spectra * channels)
+                    .reshape(spectra, channels) / norm)
+        if iteration == iterations:
+            break
+        # Lines are the channels far from the baseline of any segment that covers them
+        far = np.bincount(index, weights=(np.abs(segments - fits) > nsigma * noise).reshape(-1), 
+                          minlength=spectra * channels)
+        lines = far.reshape(spectra, channels) > 0
+        core_mask = fixed | lines
+        if grow > 0:
+            # Only runs of at least three channels (not noise spikes) are grown
+            core = window_count(lines, 1) == 3
+            lines = window_count(window_count(core, 1) > 0, grow) > 0
+        new_mask = fixed | lines
+        if np.array_equal(new_mask, mask):
+            break
+        mask = new_mask
+
+    if single:
+        return baseline[0], mask[0]
+    return baseline, mask
+
+
+def subtract_baseline(spectrum, order=3, segment=None, nsigma=3.0, iterations=5, lines=None,
+                      vel_width=None, grow=0):
+    """
+    Function to subtract the baseline of a spectrum
+
+    See fit_baseline for the baseline model and the masking of the lines.
+
+    Parameters
+    ----------
+    spectrum : specutils.Spectrum1D
+        Spectrum, e.g. from create_spectrum
+    order : int, optional
+        Order of the polynomial of each segment
+        Default: 3
+    segment : int, optional
+        Number of channels of each segment. Wideband spectra need segments much shorter
+        than the spectrum and much longer than the lines
+        Default: the whole spectrum
+    nsigma : float, optional
+        Threshold of the line channels in standard deviations
+        Default: 3.0
+    iterations : int, optional
+        Maximum number of masking iterations
+        Default: 5
+    lines : QTable, optional
+        Lines found by line_inspector, masked in all the iterations
+    vel_width : float, optional
+        Velocity width of the lines masked with lines
+        Default: 50 km/s
+    grow : int, optional
+        Number of channels added at each side of the runs of masked channels
+        Default: 0
+
+    Returns
+    -------
+    spectrum : specutils.Spectrum1D
+        Spectrum without the baseline, with the baseline (astropy.units.Quantity) in 
+        spectrum.meta['baseline'] and the masked channels in spectrum.meta['baseline_mask']
+    """
+    flux = spectrum.flux.to_value(u.K)
+    mask = None
+    if lines is not None and len(lines) > 0:
+        freq = spectrum.spectral_axis.to_value(u.MHz)
+        channels = len(freq)
+        index = np.asarray(lines['line_center_index'], dtype=np.int64)
+        step = np.abs(freq[np.minimum(index + 1, channels - 1)] - freq[np.maximum(index - 1, 0)]) / 2.0
+        half = line_freq_width(freq[index] * u.MHz, vel_width).to_value(u.MHz) / 2.0
+        half = np.ceil(half / np.where(step > 0, step, np.inf)).astype(np.int64)
+        # Mark the [index - half, index + half] interval of each line
+        edges = np.zeros(channels + 1, dtype=np.int64)
+        np.add.at(edges, np.clip(index - half, 0, channels), 1)
+        np.add.at(edges, np.clip(index + half + 1, 0, channels), -1)
+        mask = np.cumsum(edges[:-1]) > 0
+
+    baseline, mask = fit_baseline(flux, order=order, segment=segment, nsigma=nsigma, 
+                                  iterations=iterations, mask=mask, grow=grow)
+
+    meta = dict(spectrum.meta)
+    meta.pop('noise', None)
+    meta['baseline'] = u.Quantity(baseline, u.K, copy=False)
+    meta['baseline_mask'] = mask
+
+    # The spectral axis carries the rest frequency and the velocity of the source
+    return Spectrum1D(flux=u.Quantity(flux - baseline, u.K, copy=False), 
+                      spectral_axis=spectrum.spectral_axis, meta=meta)
+
+
+def iter_lines(spectrum, rms=None, window=1048576, overlap=1024, snr=3.0):
+    """
+    Function to find lines in a spectrum window by window
+
+    The spectrum is walked in windows of window channels that overlap by overlap 
+    channels, and find_lines_derivative is run on each of them. Every line is yielded 
+    once, by the window whose central part (without half of the overlap at each side)
+    contains its center, so only one window of channels is in memory at a time.
+
+    Parameters
+    ----------
+    spectrum : specutils.Spectrum1D or str
+        Spectrum to find lines, or path and base name of a binary store written by
+        create_spectrum, which is memory-mapped
+    rms : float, optional
+        RMS of the spectrum, used as the flux threshold of the lines
+        Default: snr times the noise of each window, from the noise profile of 
+        estimate_noise (or from noise_profile of the window for a store)
+    window : int, optional
+        Number of channels of each window
+        Default: 1048576
+    overlap : int, optional
+        Number of channels shared by consecutive windows. It must be larger than the
+        width of the lines in channels
+        Default: 1024
+    snr : float, optional
+        Signal to noise ratio of the threshold when rms is not given
+        Default: 3.0
+
+    Yields
+    ------
+    lines : QTable
+        Table with the lines found in each window, with line_center_index referred to
+        the whole spectrum
+    """
+    if overlap >= window:
+        raise ValueError(f"The overlap ({overlap}) must be smaller than the window ({window}).")
+    if isinstance(spectrum, str):
+        freq_file, flux_file, meta_file = spectrum_store_files(spectrum)
+        frequency = u.Quantity(np.load(freq_file, mmap_mode='r'), u.MHz, copy=False)
+        flux = u.Quantity(np.load(flux_file, mmap_mode='r'), u.K, copy=False)
+    else:
+        frequency, flux = spectrum.spectral_axis, spectrum.flux
+        if rms is None:
+            profile = estimate_noise(spectrum)['profile'].to_value(u.K)
+
+    channels = len(flux)
+    half = overlap // 2
+    for start in range(0, channels, window - overlap):
+        stop = min(start + window, channels)
+        part = Spectrum1D(flux=flux[start:stop], spectral_axis=frequency[start:stop])
+        if rms is not None:
+            threshold = rms
+        elif isinstance(spectrum, str):
+            threshold = snr * float(np.median(noise_profile(part.flux.to_value(u.K))[1]))
+        else:
+            threshold = snr * float(np.median(profile[start:stop]))
+        lines = find_lines_derivative(part, flux_threshold=threshold)
+        lines['line_center_index'] += start
+        # Lines in the overlaps belong to the window where they are farther from the edge
+        first = start + overlap - half if start > 0 else 0
+        last = stop - half if stop < channels else channels
+        keep = (lines['line_center_index'] >= first) & (lines['line_center_index'] < last)
+        if keep.any():
+            yield lines[keep]
+        if stop == channels:
+            break
+
+
+def select_lines(lines, freq_width, flux=None, cluster=False):
+    """
+    Function to select the lines that are not duplicates of a close line
+
+    By default, a line is kept if its center is farther than half the line width from
+    the center of the previous line of the table (the first line is never kept). With
+    cluster=True, the lines of each type are sorted by frequency, grouped in runs with
+    consecutive centers closer than half the line width, and only the peak of each run
+    is kept.
+
+    Parameters
+    ----------
+    lines : QTable
+        Table with the lines found by find_lines_derivative
+    freq_width : astropy.units.Quantity
+        Line width in units of frequency
+    flux : astropy.units.Quantity, optional
+        Flux of the spectrum, needed to find the peaks when cluster is True
+    cluster : bool, optional
+        Whether to merge runs of close lines keeping their peak
+        Default: False
+
+    Returns
+    -------
+    keep : numpy.ndarray
+        Boolean mask of the lines to keep
+    """
+    half_width = (freq_width / 2).to_value(lines['line_center'].unit)
+    centers = np.asarray(lines['line_center'].value, dtype=np.float64)
+    keep = np.zeros(len(lines), dtype=bool)
+    if not cluster:
+        keep[1:] = np.abs(np.diff(centers)) > half_width
+        return keep
+
+    types = np.asarray(lines['line_type'])
+    # An empty table from find_lines_derivative has float indexes
+    peaks = np.asarray(flux.value)[np.asarray(lines['line_center_index'], dtype=np.int64)]
+    for line_type, sign in (('emission', 1.0), ('absorption', -1.0)):
+        rows = np.flatnonzero(types == line_type)
+        rows = rows[np.argsort(centers[rows], kind='stable')]
+        # A run starts whenever the gap to the previous center is larger than half width
+        starts = np.ones(len(rows), dtype=bool)
+        starts[1:] = np.diff(centers[rows]) > half_width
+        run = np.cumsum(starts)
+        # Highest (emission) or lowest (absorption) line first within each run
+        order = np.lexsort((-sign * peaks[rows], run))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = run[order][1:] != run[order][:-1]
+        keep[rows[order[first]]] = True
+
+    return keep
+
+
+def line_inspector(spectrum, rms, source, line_type=None, window=None, overlap=1024, 
+                   cluster=False, verbose=True, save=True, snr=3.0):
     """
     Function to find lines in a spectrum
 
@@ -209,76 +1144,873 @@ def line_inspector(spectrum, rms, source, line_type=None):
     ----------
     spectrum : specutils.Spectrum1D
         Spectrum to find lines
-    rms : float
-        RMS of the spectrum
+    rms : float or None
+        RMS of the spectrum, used as the flux threshold of the lines. If it is None, the
+        threshold is snr times the noise estimated with estimate_noise (the noise of 
+        each window with window)
     line_type : str, optional
         Type of lines to find (emission or absorption)
+    window : int, optional
+        Number of channels of the windows used to find the lines with iter_lines.
+        If it is not given, the whole spectrum is searched at once
+    overlap : int, optional
+        Number of channels shared by consecutive windows
+        Default: 1024
+    cluster : bool, optional
+        Whether to merge runs of close emission lines keeping their peak, instead of
+        comparing each line with the previous one (see select_lines)
+        Default: False
+    verbose : bool, optional
+        Whether to print the emission line candidates
+        Default: True
+    save : bool, optional
+        Whether to save the lines to a file in the working directory
+        Default: True
+    snr : float, optional
+        Signal to noise ratio of the threshold when rms is None
+        Default: 3.0
 
     Returns
     -------
     lines : QTable
         Table with the lines found
     """
-    # Set noise region
-    noise_region = SpectralRegion(min(spectrum.spectral_axis), 
-                                  max(spectrum.spectral_axis))
-    lines = find_lines_derivative(spectrum, flux_threshold=rms)
-    clean_lines = QTable(names=('line_center', 'line_type', 'line_center_index'),
-                            dtype=('float64', 'str', 'int64'))
+    if window is None:
+        threshold = snr * estimate_noise(spectrum)['rms'] if rms is None else rms
+        lines = find_lines_derivative(spectrum, flux_threshold=threshold)
+    else:
+        found = list(iter_lines(spectrum, rms, window=window, overlap=overlap, snr=snr))
+        if found:
+            lines = vstack(found)
+            # Same order as find_lines_derivative: emission lines first, by channel
+            lines = lines[np.lexsort((np.asarray(lines['line_center_index']), 
+                                      np.asarray(lines['line_type']) != 'emission'))]
+        else:
+            lines = QTable(names=('line_center', 'line_type', 'line_center_index'),
+                           dtype=('float64', 'str', 'int64'), units=(u.MHz, None, None))
 
     if line_type == 'emission':
         # Check line width for each emission line
         freq_width = line_freq_width(87317.0)
-        for i in range(1, len(lines)):
-            if abs(lines[i]['line_center'] - lines[i-1]['line_center']) > freq_width/2:
-                print(i, lines[i]['line_center'])
-                clean_lines.add_row([lines[i]['line_center'], 
-                                     lines[i]['line_type'], 
-                                     lines[i]['line_center_index']])
-            else:
-                print(i, 'No')
-            #if equivalent_width(spectrum, regions=SpectralRegion(lines[i]['line_center']-10 * u.MHz, 
-            #                                                     lines[i]['line_center']+10 * u.MHz)) < freq_width:
-            #    lines.remove_row(i)
+        keep = select_lines(lines, freq_width, flux=spectrum.flux, cluster=cluster)
+        #if equivalent_width(spectrum, regions=SpectralRegion(lines[i]['line_center']-10 * u.MHz, 
+        #                                                     lines[i]['line_center']+10 * u.MHz)) < freq_width:
+        #    lines.remove_row(i)
+        if verbose:
+            centers = np.asarray(lines['line_center'].value)
+            unit = lines['line_center'].unit
+            first = 0 if cluster else 1
+            print('\n'.join(f'{i} {centers[i]} {unit}' if keep[i] else f'{i} No' 
+                            for i in range(first, len(lines))))
+        clean_lines = QTable([np.asarray(lines['line_center'].value, dtype='float64')[keep],
+                              np.asarray(lines['line_type'], dtype='str')[keep],
+                              np.asarray(lines['line_center_index'], dtype='int64')[keep]],
+                             names=('line_center', 'line_type', 'line_center_index'))
         # Save lines to file
-        clean_lines.write(f'{source}_emission_lines.txt', format='ascii.ecsv', overwrite=True)
+        if save:
+            clean_lines.write(f'{source}_emission_lines.txt', format='ascii.ecsv', overwrite=True)
         #print(lines[1]['line_center'])
         #print(lines.info)
         return clean_lines[clean_lines['line_type'] == 'emission'] #lines[lines['line_type'] == 'emission']
     elif line_type == 'absorption':
         # Save lines to file
-        lines.write(f'{source}_absorption_lines.txt', format='ascii.ecsv', overwrite=True)
+        if save:
+            lines.write(f'{source}_absorption_lines.txt', format='ascii.ecsv', overwrite=True)
         return lines[lines['line_type'] == 'absorption']
     else:
         # Save lines to file
-        lines.write(f'{source}_lines.txt', format='ascii.ecsv', overwrite=True)
+        if save:
+            lines.write(f'{source}_lines.txt', format='ascii.ecsv', overwrite=True)
         return lines
     
 
-def plot_spectrum(spectrum, lines=None):
+def identify_lines(lines, catalogue, vel_width=None, kinds=None, max_candidates=None):
+    """
+    Function to identify the lines found in a spectrum with the lines of a catalogue
+
+    Every line center is matched with all the catalogue lines closer than half the 
+    line width, computed from vel_width with line_freq_width at the line center.
+
+    Parameters
+    ----------
+    lines : QTable
+        Table with the lines found by line_inspector
+    catalogue : catalogues.Catalogue
+        Catalogue of the source
+    vel_width : float, optional
+        Velocity width of the lines
+        Default: 50 km/s
+    kinds : str or list of str, optional
+        Line classes of the catalogue to search in ('rrls', 'molecules', 'uf')
+        Default: all the line classes of the catalogue
+    max_candidates : int, optional
+        Maximum number of candidates for each line
+        Default: all the candidates
+
+    Returns
+    -------
+    identified : QTable
+        Table with one row per candidate, sorted by line and distance, with the row of
+        the line in lines ('line_index'), its center, the rank of the candidate (1 for 
+        the closest), its line class, species, status, origin and frequency, and its 
+        offset in frequency and velocity. Lines without candidates are not included. The
+        offset is the catalogue frequency minus the line center, so the velocity offset
+        is the radio velocity of the line with respect to the catalogue frequency (as in
+        match_synthetic_lines)
+    """
+    centers = lines['line_center']
+    if not isinstance(centers, u.Quantity):
+        centers = np.asarray(centers, dtype=float) * u.MHz
+    tolerance = line_freq_width(centers.to(u.MHz), vel_width) / 2
+
+    matches = catalogue.match(centers, tolerance, kinds=kinds, max_candidates=max_candidates)
+
+    freq = matches['Freq[MHz]'].to_numpy(dtype=float)
+    offset = matches['Offset[MHz]'].to_numpy(dtype=float)
+    identified = QTable()
+    identified['line_index'] = matches['Query'].to_numpy(dtype='int64')
+    identified['line_center'] = matches['Query[MHz]'].to_numpy(dtype=float) * u.MHz
+    identified['rank'] = matches['Rank'].to_numpy(dtype='int64')
+    identified['line_class'] = matches['Class'].to_numpy(dtype=str)
+    identified['species'] = matches['Species'].to_numpy(dtype=str)
+    identified['status'] = matches['Status'].to_numpy(dtype=str)
+    identified['origin'] = matches['Origin'].to_numpy(dtype=str)
+    identified['freq'] = freq * u.MHz
+    identified['offset'] = offset * u.MHz
+    # Radio velocity of the line with respect to the catalogue frequency
+    identified['vel_offset'] = c_kms * offset / freq * u.km / u.s
+
+    return identified
+
+
+def match_synthetic_lines(lines, synthetic, vel_width=None):
+    """
+    Function to match the lines found in a spectrum with synthetic line lists
+
+    Parameters
+    ----------
+    lines : QTable
+        Table with the lines found by line_inspector
+    synthetic : dictionary of dataframes or pandas.DataFrame
+        Dictionary of synthetic spectra with the column 'Freq[MHz]', or table of all the
+        species with the columns 'Species' and 'Freq[MHz]' (see synthetics.stack_species)
+    vel_width : float, optional
+        Velocity width of the lines; synthetic lines closer than half of it match
+        Default: 50 km/s
+
+    Returns
+    -------
+    matches : QTable
+        Table with one row per synthetic line closer than half the line width to a line,
+        sorted by line and distance, with the row of the line in lines ('line_index'), 
+        its center, the species and frequency of the synthetic line and its offset in
+        frequency and velocity. The offset is the synthetic frequency minus the line 
+        center, so the velocity offset is the radio velocity of the line with respect to
+        the synthetic frequency (as in identify_lines)
+    """
+    if isinstance(synthetic, pd.DataFrame):
+        species = np.asarray(synthetic['Species'], dtype=str)
+        freqs = synthetic['Freq[MHz]'].to_numpy(dtype=np.float64)
+    else:
+        species = np.repeat(np.array(list(synthetic.keys()), dtype=str), 
+                            [len(value) for value in synthetic.values()])
+        freqs = np.concatenate([value['Freq[MHz]'].to_numpy(dtype=np.float64) 
+                                for value in synthetic.values()] or [np.zeros(0)])
+    order = np.argsort(freqs, kind='stable')
+    species, freqs = species[order], freqs[order]
+
+    centers = lines['line_center']
+    centers = np.asarray(centers.to_value(u.MHz) if isinstance(centers, u.Quantity) else centers, 
+                         dtype=np.float64)
+    tolerance = line_freq_width(centers * u.MHz, vel_width).to_value(u.MHz) / 2.0
+    lo = np.searchsorted(freqs, centers - tolerance, side='left')
+    hi = np.searchsorted(freqs, centers + tolerance, side='right')
+    # Candidate synthetic lines of each line, as (line, synthetic line) pairs
+    line, candidate = expand_ranges(lo, hi)
+    offset = freqs[candidate] - centers[line]
+    rank = np.lexsort((np.abs(offset), line))
+    line, candidate, offset = line[rank], candidate[rank], offset[rank]
+
+    matches = QTable()
+    matches['line_index'] = line.astype('int64')
+    matches['line_center'] = centers[line] * u.MHz
+    matches['species'] = species[candidate]
+    matches['freq'] = freqs[candidate] * u.MHz
+    matches['offset'] = offset * u.MHz
+    matches['vel_offset'] = c_kms * offset / freqs[candidate] * u.km / u.s
+
+    return matches
+
+
+def read_manifest(filename):
+    """
+    Function to read a manifest of spectra to process in batch
+
+    The manifest is a CSV file with the columns source, band, path and files, with the
+    files of each spectrum separated by ';'. Lines starting with '#' are comments.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the manifest
+
+    Returns
+    -------
+    tasks : list of dict
+        One dictionary per spectrum with the keys 'source', 'band', 'path' and 'files'
+    """
+    table = pd.read_csv(filename, comment='#', skipinitialspace=True, dtype=str)
+    table.columns = table.columns.str.strip()
+
+    return [{'source': row['source'].strip(), 'band': row['band'].strip(), 
+             'path': row['path'].strip(), 'files': [f.strip() for f in row['files'].split(';') if f.strip()]}
+            for _, row in table.iterrows()]
+
+
+# Line lists loaded by each batch worker, by kind and source
+worker_resources = {}
+worker_loaders = {}
+task_state = {}
+
+
+def init_worker(catalogue=None, synthetic=None):
+    """
+    Function to set up a batch worker with the loaders of its line lists
+
+    Parameters
+    ----------
+    catalogue : callable, optional
+        Function that returns the catalogue of a source from its name, e.g. 
+        functools.partial(catalogues.Catalogue, 'path/to/catalogues/')
+    synthetic : callable, optional
+        Function that returns the synthetic line lists of a source from its name
+    """
+    worker_resources.clear()
+    worker_loaders.clear()
+    worker_loaders.update({'catalogue': catalogue, 'synthetic': synthetic})
+
+
+def worker_resource(kind, source):
+    """
+    Function to get a line list of a source, loading it only once per worker
+
+    Parameters
+    ----------
+    kind : str
+        'catalogue' or 'synthetic'
+    source : str
+        Source name
+
+    Returns
+    -------
+    resource : object
+        Line list returned by the loader of kind, or None if there is no loader
+    """
+    loader = worker_loaders.get(kind)
+    if loader is None:
+        return None
+    if (kind, source) not in worker_resources:
+        worker_resources[(kind, source)] = loader(source)
+
+    return worker_resources[(kind, source)]
+
+
+def task_timeout(signum, frame):
+    task_state['timed_out'] = True
+    raise TimeoutError('Task timed out')
+
+
+def run_task(task, output_dir, options, timeout=None):
+    """
+    Function to process one spectrum of a batch
+
+    The stages are: read the files and create the spectrum (kept in a binary store in
+    the output directory of the task), subtract the baseline (optional), estimate the 
+    noise, find the lines, and identify them with the catalogue and the synthetic line 
+    lists of the worker. All the outputs are written to output_dir/<source>_<band>.
+
+    Parameters
+    ----------
+    task : dict
+        Spectrum to process, with the keys 'source', 'band', 'path' and 'files', and 
+        optionally 'name', the directory of its outputs
+        Default name: <source>_<band>
+    output_dir : str
+        Directory of the outputs of the batch
+    options : dict
+        Options of the stages (see run_batch)
+    timeout : float, optional
+        Maximum time in seconds; the task raises TimeoutError when it is exceeded. The 
+        limit uses SIGALRM, so it only applies on POSIX systems and in the main thread 
+        (as in the workers of run_batch); elsewhere the task runs without limit
+        Default: no limit
+
+    Returns
+    -------
+    result : dict
+        Summary of the task: number of lines, identifications, noise and output files
+    """
+    if timeout and not (hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()):
+        print(f'Warning: the timeout needs SIGALRM in the main thread, running {task["source"]} {task["band"]} without limit')
+        timeout = None
+    if timeout:
+        task_state['timed_out'] = False
+        previous = signal.signal(signal.SIGALRM, task_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        source, band = task['source'], task['band']
+        name = task.get('name', f'{source}_{band}')
+        task_dir = os.path.join(output_dir, name)
+        os.makedirs(task_dir, exist_ok=True)
+
+        spectrum = create_spectrum(task['path'], task['files'], store=os.path.join(task_dir, 'spectrum'), 
+                                   stack=options.get('stack', False), source=source, band=band)
+        if options.get('baseline') is not None:
+            spectrum = subtract_baseline(spectrum, **options['baseline'])
+        noise = estimate_noise(spectrum)
+        lines = line_inspector(spectrum, options.get('rms'), source, line_type=options.get('line_type'),
+                               window=options.get('window'), verbose=False, save=False, 
+                               snr=options.get('snr', 3.0))
+        outputs = {'lines': os.path.join(task_dir, f'{name}_lines.txt')}
+        lines.write(outputs['lines'], format='ascii.ecsv', overwrite=True)
+        result = {'lines': len(lines), 'rms': noise['rms']}
+
+        catalogue = worker_resource('catalogue', source)
+        if catalogue is not None:
+            identified = identify_lines(lines, catalogue, vel_width=options.get('vel_width'), 
+                                        max_candidates=options.get('max_candidates'))
+            outputs['identified'] = os.path.join(task_dir, f'{name}_identified.txt')
+            identified.write(outputs['identified'], format='ascii.ecsv', overwrite=True)
+            result['identified'] = len(np.unique(np.asarray(identified['line_index'])))
+        synthetic = worker_resource('synthetic', source)
+        if synthetic is not None:
+            matches = match_synthetic_lines(lines, synthetic, vel_width=options.get('vel_width'))
+            outputs['synthetic'] = os.path.join(task_dir, f'{name}_synthetic.txt')
+            matches.write(outputs['synthetic'], format='ascii.ecsv', overwrite=True)
+            result['synthetic'] = len(np.unique(np.asarray(matches['line_index'])))
+        result['outputs'] = outputs
+        return result
+    except Exception:
+        # The readers catch their own errors, so the timeout may surface as another error
+        if timeout and task_state.get('timed_out'):
+            raise TimeoutError(f'Task exceeded {timeout} s') from None
+        raise
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def run_batch(manifest, output_dir, catalogue=None, synthetic=None, workers=None, timeout=None,
+              retries=1, verbose=True, **options):
+    """
+    Function to run the line pipeline over many spectra in a pool of processes
+
+    Every spectrum of the manifest is processed by run_task in a worker process. Each 
+    worker loads the catalogue and the synthetic line lists of a source only once, 
+    with the given loaders. Tasks that fail or exceed timeout are retried up to retries
+    times. When a worker dies, the tasks that were running are run again one at a 
+    time without counting that attempt, so only the task that kills a worker alone is 
+    charged for it. The outputs of each task go to its own directory, 
+    output_dir/<source>_<band>, or output_dir/<source>_<band>_<row> (row of the task in
+    the manifest, from 0) when several tasks share the source and band, and a summary 
+    of the batch to output_dir/batch_summary.csv.
+
+    Parameters
+    ----------
+    manifest : str or list of dict
+        Path to a manifest (see read_manifest) or list of tasks with the keys 'source', 
+        'band', 'path' and 'files'
+    output_dir : str
+        Directory of the outputs
+    catalogue : callable, optional
+        Function that returns the catalogue of a source from its name, e.g. 
+        functools.partial(catalogues.Catalogue, 'path/to/catalogues/'). It must be 
+        picklable (a module-level function, class or functools.partial)
+    synthetic : callable, optional
+        Function that returns the synthetic line lists of a source from its name
+    workers : int, optional
+        Number of processes. With 1 the tasks are run in this process
+        Default: one for each task, up to the number of CPUs
+    timeout : float, optional
+        Maximum time of each attempt of a task in seconds (see run_task; with workers=1 
+        it only applies if run_batch is called from the main thread)
+        Default: no limit
+    retries : int, optional
+        Number of times a failed task is retried
+        Default: 1
+    verbose : bool, optional
+        Whether to print the progress
+        Default: True
+    **options
+        Options of the stages: stack (create_spectrum), baseline (dictionary of 
+        arguments of subtract_baseline), rms, snr, line_type and window (line_inspector),
+        vel_width and max_candidates (identify_lines)
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        One row per task with its status ('done' or 'failed'), number of attempts, 
+        elapsed time, results and error
+    """
+    tasks = read_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+    os.makedirs(output_dir, exist_ok=True)
+    # Tasks with the same source and band (e.g. two observing runs) get their own outputs
+    keys = Counter((task['source'], task['band']) for task in tasks)
+    tasks = [dict(task, name=f"{task['source']}_{task['band']}" 
+                  + (f'_{i}' if keys[(task['source'], task['band'])] > 1 else ''))
+             for i, task in enumerate(tasks)]
+    if workers is None:
+        workers = min(len(tasks), os.cpu_count() or 1)
+
+    rows = [None] * len(tasks)
+    attempts = [0] * len(tasks)
+    started = [0.0] * len(tasks)
+    done = 0
+
+    def finish(i, result=None, error=None):
+        nonlocal done
+        done += 1
+        task = tasks[i]
+        row = {'source': task['source'], 'band': task['band'], 
+               'status': 'done' if error is None else 'failed', 'attempts': attempts[i], 
+               'elapsed[s]': time.perf_counter() - started[i], 'error': error}
+        if result is not None:
+            row.update({key: value for key, value in result.items() if key != 'outputs'})
+            row['output'] = os.path.dirname(result['outputs']['lines'])
+        rows[i] = row
+        if verbose:
+            message = f"{row['status']} ({row['elapsed[s]']:.1f} s)" + (f': {error}' if error else '')
+            print(f"[{done}/{len(tasks)}] {task['source']} {task['band']}: {message}")
+
+    def failed(i, error):
+        # Retry the task, or finish it as failed; returns whether it is retried
+        if attempts[i] <= retries:
+            if verbose:
+                print(f"Retrying {tasks[i]['source']} {tasks[i]['band']} after: {error}")
+            return True
+        finish(i, error=error)
+        return False
+
+    if workers <= 1:
+        init_worker(catalogue, synthetic)
+        for i, task in enumerate(tasks):
+            started[i] = time.perf_counter()
+            while True:
+                attempts[i] += 1
+                try:
+                    result = run_task(task, output_dir, options, timeout)
+                except Exception as e:
+                    if failed(i, f'{type(e).__name__}: {e}'):
+                        continue
+                    break
+                finish(i, result)
+                break
+    else:
+        queue = list(range(len(tasks)))
+        # Tasks that were running when a worker died, to be run alone
+        suspects = set()
+        while queue:
+            # A new pool is started if a worker died and broke the previous one
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, 
+                                     initargs=(catalogue, synthetic)) as pool:
+                futures = {}
+                broken = False
+                while futures or (queue and not broken):
+                    # One task per worker, or one at a time while there are suspects
+                    limit = 1 if suspects else workers
+                    while queue and not broken and len(futures) < limit:
+                        i = queue.pop(0)
+                        if attempts[i] == 0:
+                            started[i] = time.perf_counter()
+                        attempts[i] += 1
+                        futures[pool.submit(run_task, tasks[i], output_dir, options, timeout)] = i
+                    running = len(futures)
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        i = futures.pop(future)
+                        suspects.discard(i)
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool as e:
+                            broken = True
+                            if running > 1:
+                                # Any of the running tasks may have killed the worker
+                                attempts[i] -= 1
+                            elif not failed(i, f'worker died ({e})'):
+                                continue
+                            suspects.add(i)
+                            queue.insert(0, i)
+                            continue
+                        except Exception as e:
+                            if failed(i, f'{type(e).__name__}: {e}'):
+                                queue.append(i)
+                            continue
+                        finish(i, result)
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(output_dir, 'batch_summary.csv'), index=False)
+
+    return summary
+
+
+def gaussian_profiles(x, params, jacobian=True):
+    """
+    Function to evaluate sums of Gaussians and their derivatives
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Frequencies of the channels of each window, with shape (windows, channels)
+    params : numpy.ndarray
+        Peak, center and standard deviation of each Gaussian of each window, with shape
+        (windows, 3 x components)
+    jacobian : bool, optional
+        Whether to return the derivatives of the model
+        Default: True
+
+    Returns
+    -------
+    model : numpy.ndarray
+        Sum of the Gaussians of each window, with shape (windows, channels)
+    jacobian : numpy.ndarray
+        Derivatives of the model with respect to the parameters, with shape 
+        (windows, 3 x components, channels), only if jacobian is True
+    """
+    peak, center, sigma = params[:, 0::3, None], params[:, 1::3, None], params[:, 2::3, None]
+    z = (x[:, None, :] - center) / sigma
+    profile = np.exp(-0.5 * z * z)
+    model = np.matmul(params[:, None, 0::3], profile)[:, 0]
+    if not jacobian:
+        return model
+    derivatives = np.empty(params.shape + (x.shape[1],))
+    derivatives[:, 0::3] = profile
+    derivatives[:, 1::3] = peak * profile * z / sigma
+    derivatives[:, 2::3] = derivatives[:, 1::3] * z
+
+    return model, derivatives
+
+
+def fit_gaussian_batch(x, y, weight, params, maxiter=100, tol=1e-6):
+    """
+    Function to fit sums of Gaussians to many windows at once with Levenberg-Marquardt
+
+    All the windows have the same number of channels (padded with zero weight) and of
+    components, and every iteration updates all the windows that have not converged 
+    with batched linear algebra. Steps that make a width non-positive or move a center
+    out of its window are rejected.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Frequencies of the channels of each window, with shape (windows, channels)
+    y : numpy.ndarray
+        Flux of the channels of each window
+    weight : numpy.ndarray
+        Inverse of the noise of the channels of each window (0 for padding)
+    params : numpy.ndarray
+        Initial peak, center and standard deviation of each Gaussian of each window, 
+        with shape (windows, 3 x components)
+    maxiter : int, optional
+        Maximum number of iterations
+        Default: 100
+    tol : float, optional
+        Relative decrease of chi2 below which a window has converged
+        Default: 1e-6
+
+    Returns
+    -------
+    params : numpy.ndarray
+        Fitted parameters
+    covariance : numpy.ndarray
+        Covariance of the parameters of each window (NaN if they are degenerate)
+    chi2 : numpy.ndarray
+        Chi-square of each window
+    converged : numpy.ndarray
+        Whether each window has converged
+    """
+    params = np.array(params, dtype=np.float64)
+    windows, n_params = params.shape
+    diagonal = np.arange(n_params)
+    lower = np.where(weight > 0, x, np.inf).min(axis=1)[:, None]
+    upper = np.where(weight > 0, x, -np.inf).max(axis=1)[:, None]
+
+    def normal_equations(rows, params):
+        # J^T J and J^T r of the weighted residuals
+        model, jacobian = gaussian_profiles(x[rows], params)
+        residuals = (model - y[rows]) * weight[rows]
+        jacobian *= weight[rows, None, :]
+        return (np.matmul(jacobian, jacobian.transpose(0, 2, 1)), 
+                np.matmul(jacobian, residuals[:, :, None])[:, :, 0], 
+                np.einsum('bc,bc->b', residuals, residuals))
+
+    rows = np.arange(windows)
+    normal, gradient, chi2 = normal_equations(rows, params)
+    damping = np.full(windows, 1e-3)
+    converged = np.zeros(windows, dtype=bool)
+    for _ in range(maxiter):
+        active = np.flatnonzero(~converged)
+        if len(active) == 0:
+            break
+        damped = normal[active]
+        damped[:, diagonal, diagonal] *= 1.0 + damping[active, None]
+        damped[:, diagonal, diagonal] += 1e-300
+        try:
+            step = np.linalg.solve(damped, -gradient[active, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = -np.matmul(np.linalg.pinv(damped), gradient[active, :, None])[:, :, 0]
+        trial = params[active] + step
+        residuals = (gaussian_profiles(x[active], trial, jacobian=False) - y[active]) * weight[active]
+        trial_chi2 = np.einsum('bc,bc->b', residuals, residuals)
+        valid = ((trial[:, 2::3] > 0).all(axis=1) & (trial[:, 1::3] >= lower[active]).all(axis=1)
+                 & (trial[:, 1::3] <= upper[active]).all(axis=1) & np.isfinite(trial_chi2))
+        better = valid & (trial_chi2 <= chi2[active])
+
+        accepted = active[better]
+        converged[accepted] = chi2[accepted] - trial_chi2[better] <= tol * chi2[accepted]
+        params[accepted] = trial[better]
+        if len(accepted):
+            normal[accepted], gradient[accepted], chi2[accepted] = normal_equations(accepted, params[accepted])
+        damping[accepted] /= 10.0
+        rejected = active[~better]
+        damping[rejected] *= 10.0
+        # A window whose steps keep failing is at its minimum within precision
+        converged[rejected[damping[rejected] > 1e12]] = True
+
+    covariance = np.linalg.pinv(normal)
+    # Parameters without constraint (e.g. a component with zero peak) have no uncertainty
+    covariance[np.linalg.matrix_rank(normal) < n_params] = np.nan
+
+    return params, covariance, chi2, converged
+
+
+def line_blends(index, half, max_components=None):
+    """
+    Function to group the lines whose fitting windows overlap
+
+    Parameters
+    ----------
+    index : numpy.ndarray
+        Channel of the center of each line, sorted
+    half : numpy.ndarray
+        Half width of the window of each line in channels
+    max_components : int, optional
+        Maximum number of lines of a group. Longer chains of overlapping lines are cut,
+        so the lines at the cuts are fitted without their neighbours
+        Default: no limit
+
+    Returns
+    -------
+    blend : numpy.ndarray
+        Group of each line, numbered from 0 in order
+    """
+    starts = np.ones(len(index), dtype=bool)
+    starts[1:] = np.diff(index) > half[1:] + half[:-1]
+    if max_components is None:
+        return np.cumsum(starts) - 1
+    run = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    position = np.arange(len(index)) - first[run]
+    # Long chains of overlapping lines are cut every max_components lines
+    return np.cumsum(starts | (position % max_components == 0)) - 1
+
+
+def fit_line_profiles(spectrum, lines, rms=None, vel_width=None, window=4.0, max_components=None,
+                      workers=None, batch=4096, max_bytes=67108864, maxiter=100):
+    """
+    Function to fit Gaussian profiles to the lines found in a spectrum
+
+    Each line is fitted in a window of +-window standard deviations of its initial width
+    around its center. Lines whose windows overlap are fitted together, with one
+    Gaussian per line (see line_blends). The groups with the same
+    number of components are fitted in batches of similar width with fit_gaussian_batch,
+    and the batches are spread over a pool of workers processes.
+
+    Parameters
+    ----------
+    spectrum : specutils.Spectrum1D
+        Spectrum where the lines were found
+    lines : QTable
+        Table with the lines found by line_inspector
+    rms : float, optional
+        RMS of the spectrum, used as the noise of every channel
+        Default: the noise profile of estimate_noise
+    vel_width : float, optional
+        Initial velocity width (FWHM) of the lines
+        Default: 50 km/s
+    window : float, optional
+        Half width of the window of each line, in initial standard deviations
+        Default: 4.0
+    max_components : int, optional
+        Maximum number of lines fitted together
+        Default: no limit
+    workers : int, optional
+        Number of processes. With 1 the batches are fitted in this process
+        Default: one for each batch, up to the number of CPUs
+    batch : int, optional
+        Maximum number of groups of lines fitted at once
+        Default: 4096
+    max_bytes : int, optional
+        Approximate maximum size of the Jacobian of each batch
+        Default: 67108864 (64 MB)
+    maxiter : int, optional
+        Maximum number of Levenberg-Marquardt iterations
+        Default: 100
+
+    Returns
+    -------
+    profiles : QTable
+        Table with one row per line, in the order of lines, with its row in lines 
+        ('line_index'), its group ('blend'), the number of lines of the group, the center, 
+        FWHM, peak and velocity integrated intensity of the fitted Gaussian and their
+        uncertainties, the reduced chi2 of the group and whether the fit converged
+    """
+    freq = np.asarray(spectrum.spectral_axis.to_value(u.MHz), dtype=np.float64)
+    flux = np.asarray(spectrum.flux.to_value(u.K), dtype=np.float64)
+    channels = len(freq)
+    if rms is None:
+        noise = estimate_noise(spectrum)['profile'].to_value(u.K)
+    else:
+        noise = np.full(channels, float(rms))
+
+    index = np.asarray(lines['line_center_index'], dtype=np.int64)
+    order = np.argsort(index, kind='stable')
+    index = index[order]
+    sigma = line_freq_width(freq[index] * u.MHz, vel_width).to_value(u.MHz) / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+    step = np.abs(freq[np.minimum(index + 1, channels - 1)] - freq[np.maximum(index - 1, 0)]) / 2.0
+    half = np.ceil(window * sigma / np.where(step > 0, step, np.inf)).astype(np.int64) + 1
+
+    blend = line_blends(index, half, max_components)
+    # Without lines there are no groups, and an empty table with all the columns is built
+    first = np.flatnonzero(np.r_[len(index) > 0, blend[1:] != blend[:-1]])
+    components = np.diff(np.r_[first, len(index)])
+    lo = np.maximum(index[first] - half[first], 0)
+    hi = np.minimum(index[first + components - 1] + half[first + components - 1] + 1, channels)
+
+    # Batches of groups with the same number of components, padded to a common width
+    tasks = []
+    for k in np.unique(components):
+        groups = np.flatnonzero(components == k)
+        groups = groups[np.argsort(hi[groups] - lo[groups], kind='stable')]
+        widths = hi[groups] - lo[groups]
+        start = 0
+        while start < len(groups):
+            # The widths are increasing, so the last group of a batch is the widest
+            size = min(batch, len(groups) - start)
+            size = int(min(size, max(1, max_bytes // (24 * k * widths[start + size - 1]))))
+            chunk = groups[start:start + size]
+            start += size
+            width = int(widths[start - 1])
+            cols = lo[chunk, None] + np.arange(width)
+            inside = cols < hi[chunk, None]
+            cols = np.minimum(cols, channels - 1)
+            members = first[chunk, None] + np.arange(k)
+            reference = freq[index[first[chunk]]][:, None]
+            x = freq[cols] - reference
+            y = np.where(inside, flux[cols], 0.0)
+            weight = np.where(inside & np.isfinite(y), 1.0 / noise[cols], 0.0)
+            y = np.where(np.isfinite(y), y, 0.0)
+            params = np.empty((len(chunk), 3 * k))
+            params[:, 0::3] = flux[index[members]]
+            params[:, 1::3] = freq[index[members]] - reference
+            params[:, 2::3] = sigma[members]
+            tasks.append((chunk, members, reference, x, y, weight, params))
+
+    if workers is None:
+        workers = min(len(tasks), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fit_gaussian_batch, x, y, weight, params, maxiter)
+                       for chunk, members, reference, x, y, weight, params in tasks]
+            results = [future.result() for future in futures]
+    else:
+        results = [fit_gaussian_batch(x, y, weight, params, maxiter) 
+                   for chunk, members, reference, x, y, weight, params in tasks]
+
+    n = len(index)
+    fitted = np.empty((n, 3))
+    errors = np.empty((n, 3))
+    cov_peak_sigma = np.empty(n)
+    chi2 = np.empty(n)
+    converged = np.empty(n, dtype=bool)
+    for (chunk, members, reference, x, y, weight, params), (best, covariance, chi2_chunk, done) in zip(tasks, results):
+        k = members.shape[1]
+        best = best.reshape(len(chunk), k, 3)
+        best[:, :, 1] += reference
+        variance = np.diagonal(covariance, axis1=1, axis2=2).reshape(len(chunk), k, 3)
+        dof = np.maximum(np.count_nonzero(weight, axis=1) - 3 * k, 1)
+        fitted[members] = best
+        errors[members] = np.sqrt(np.maximum(variance, 0.0))
+        cov_peak_sigma[members] = covariance[:, 3 * np.arange(k), 3 * np.arange(k) + 2]
+        chi2[members] = (chi2_chunk / dof)[:, None]
+        converged[members] = done[:, None]
+
+    peak, center, sigma = fitted[:, 0], fitted[:, 1], fitted[:, 2]
+    peak_err, center_err, sigma_err = errors[:, 0], errors[:, 1], errors[:, 2]
+    fwhm_factor = 2.0 * np.sqrt(2.0 * np.log(2.0))
+    # Integral of the Gaussian over the radio velocity
+    integrated = np.sqrt(2.0 * np.pi) * peak * sigma * c_kms / center
+    integrated_err = np.abs(integrated) * np.sqrt(np.maximum((peak_err / peak) ** 2 + (sigma_err / sigma) ** 2 
+                                                             + 2.0 * cov_peak_sigma / (peak * sigma), 0.0))
+
+    # Back to the order of lines
+    rows = np.empty(n, dtype=np.int64)
+    rows[order] = np.arange(n)
+    profiles = QTable()
+    profiles['line_index'] = np.arange(n, dtype=np.int64)
+    profiles['blend'] = blend[rows]
+    profiles['components'] = np.repeat(components, components)[rows]
+    profiles['line_center'] = center[rows] * u.MHz
+    profiles['line_center_err'] = center_err[rows] * u.MHz
+    profiles['fwhm'] = fwhm_factor * sigma[rows] * u.MHz
+    profiles['fwhm_err'] = fwhm_factor * sigma_err[rows] * u.MHz
+    profiles['vel_fwhm'] = fwhm_factor * c_kms * sigma[rows] / center[rows] * u.km / u.s
+    profiles['peak'] = peak[rows] * u.K
+    profiles['peak_err'] = peak_err[rows] * u.K
+    profiles['integrated'] = integrated[rows] * u.K * u.km / u.s
+    profiles['integrated_err'] = integrated_err[rows] * u.K * u.km / u.s
+    profiles['reduced_chi2'] = chi2[rows]
+    profiles['converged'] = converged[rows]
+
+    return profiles
+
+
+def plot_spectrum(spectrum, lines=None, pixels=None, filename=None):
     """
     Function to plot a spectrum
 
+    The spectrum is reduced to the minimum and maximum of each pixel of the axes, and 
+    recomputed when the plot is zoomed (see plot_envelope).
+
     Parameters
     ----------
     spectrum : specutils.Spectrum1D
         Spectrum to plot
     lines : QTable, optional
         Table with the detected lines to plot
+    pixels : int, optional
+        Number of bins of the envelope
+        Default: the width of the axes in pixels
+    filename : str, optional
+        File to save the plot to without showing it, e.g. in batch jobs
+        Default: show the plot
     """
+    freq = spectrum.spectral_axis.to_value(u.MHz)
+    flux = spectrum.flux.value
     fig, ax = plt.subplots()
-    ax.plot(spectrum.spectral_axis, spectrum.flux)
-    ax.hlines(0.0, min(spectrum.spectral_axis/u.MHz), 
-              max(spectrum.spectral_axis/u.MHz), color='black')
+    plot_envelope(ax, freq, flux, pixels=pixels)
+    ax.hlines(0.0, np.min(freq), np.max(freq), color='black')
     if lines is not None:
-        ax.vlines([lines['line_center']], 0, max(spectrum.flux/u.K), colors='r')
-    ax.set_xlabel(spectrum.spectral_axis.unit)
+        centers = lines['line_center']
+        centers = centers.to_value(u.MHz) if isinstance(centers, u.Quantity) else np.asarray(centers)
+        ax.vlines(centers, 0, np.nanmax(flux), colors='r')
+    ax.set_xlabel(u.MHz)
     ax.set_ylabel(spectrum.flux.unit)
-    plt.show()
+    show_figure(fig, filename)
 
     return None
 
-def plot_synthetic_spectrum(spectrum, lines):
+def plot_synthetic_spectrum(spectrum, lines, pixels=None, filename=None):
     """
     Function to plot the synthetic data with the observational spectrum
 
@@ -288,22 +2020,28 @@ def plot_synthetic_spectrum(spectrum, lines):
         Spectrum to plot
     lines : pandas.DataFrame
         Data with the detected lines to plot
+    pixels : int, optional
+        Number of bins of the envelope of the spectrum (see plot_envelope)
+        Default: the width of the axes in pixels
+    filename : str, optional
+        File to save the plot to without showing it, e.g. in batch jobs
+        Default: show the plot
 
     Returns
     -------
     None
     """
+    freq = spectrum.spectral_axis.to_value(u.MHz)
+    flux = spectrum.flux.value
     fig, ax = plt.subplots()
-    ax.plot(spectrum.spectral_axis, spectrum.flux)
-    ax.hlines(0.0, min(spectrum.spectral_axis/u.MHz), 
-              max(spectrum.spectral_axis/u.MHz), color='black')
-    ax.vlines(lines['Freq[MHz]'], 0, max(spectrum.flux/u.K), colors='r')
+    plot_envelope(ax, freq, flux, pixels=pixels)
+    ax.hlines(0.0, np.min(freq), np.max(freq), color='black')
+    ax.vlines(lines['Freq[MHz]'], 0, np.nanmax(flux), colors='r')
     # Set x-axis limits
-    ax.set_xlim(min(spectrum.spectral_axis/u.MHz), 
-                max(spectrum.spectral_axis/u.MHz))
-    ax.set_xlabel(spectrum.spectral_axis.unit)
+    ax.set_xlim(np.min(freq), np.max(freq))
+    ax.set_xlabel(u.MHz)
     ax.set_ylabel(spectrum.flux.unit)
-    plt.show()
+    show_figure(fig, filename)
 
     return None
 
@@ -336,6 +2074,6 @@ def line_freq_width(restfreq, vel_width=None):
         if not isinstance(vel_width, u.quantity.Quantity):
             vel_width = vel_width * u.km / u.s
 
-    freq_width = abs(restfreq * vel_width / (si.c.to_value('km/s') * u.km / u.s))
+    freq_width = abs(restfreq * vel_width / (c_kms * u.km / u.s))
 
     return freq_width
\ No newline at end of file
@@ -2,9 +2,23 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import get_cmap
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 from astropy import constants as const
 from astropy import units as u
 from specutils import Spectrum1D
+from scipy import sparse
+from scipy.optimize import least_squares
+
+from catalogues import expand_ranges
+from plotting import plot_envelope, show_figure
+
+
+# Speed of light in km/s
+c_kms = const.c.to_value('km/s')
+
+# h c^3 / (8 pi k_B) in SI units, with c^3 in km^3/s^3, as used by anttemp
+anttemp_factor = (const.h * const.c**3 * 1e-9 / (8 * np.pi * const.k_B)).value
 
 
 def read_synthetic_spectra(path, filename):
@@ -66,10 +80,71 @@ def read_synthetic_rrls(path, filename):
         return None
     
 
-def plot_synthetic_spectrum(source, obs_spectra, molec_spectra, rrls=None, ufs=None, molecules=None, names=None):
+def lines_in_window(freqs, fmin, fmax):
+    """
+    Function to find the lines inside a frequency window
+
+    Parameters
+    ----------
+    freqs : array_like
+        Frequencies of the lines
+    fmin, fmax : float
+        Limits of the window
+
+    Returns
+    -------
+    index : numpy.ndarray
+        Rows of the lines inside the window, sorted by frequency
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    order = np.argsort(freqs, kind='stable')
+    lo = np.searchsorted(freqs[order], fmin, side='left')
+    hi = np.searchsorted(freqs[order], fmax, side='right')
+
+    return order[lo:hi]
+
+
+def cull_labels(freqs, separation):
+    """
+    Function to select labels that do not overlap
+
+    Parameters
+    ----------
+    freqs : numpy.ndarray
+        Sorted frequencies of the labels
+    separation : float
+        Minimum distance between two labels, in units of frequency
+
+    Returns
+    -------
+    keep : numpy.ndarray
+        Rows of the labels to draw, from the lowest frequency up
+    """
+    if len(freqs) == 0 or separation <= 0:
+        return np.arange(len(freqs))
+    # At most one label per slot of the separation, then a greedy pass over the few left
+    slot = np.floor((freqs - freqs[0]) / separation).astype(np.int64)
+    candidates = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+    keep = []
+    last = -np.inf
+    for i in candidates:
+        if freqs[i] - last >= separation:
+            keep.append(i)
+            last = freqs[i]
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+def plot_synthetic_spectrum(source, obs_spectra, molec_spectra, rrls=None, ufs=None, molecules=None, names=None,
+                            pixels=None, filename=None):
     """
     Function to plot the observational and synthetic spectra
 
+    Only the lines inside the frequency range of the observational spectrum are drawn,
+    with one collection of lines for each of RRLs, UFs and molecules and one for all 
+    the synthetic species. The names are drawn only where they do not overlap, and are
+    selected again when the plot is zoomed.
+
     Parameters
     ----------
     source : str
@@ -86,6 +161,13 @@ def plot_synthetic_spectrum(source, obs_spectra, molec_spectra, rrls=None, ufs=N
         Dataframe with the molecules frequencies
     names : boolean, optional
         Boolean to indicate whether to plot the names of the species or not
+    pixels : int, optional
+        Number of bins of the envelope of the observational spectrum, recomputed when 
+        the plot is zoomed (see plot_envelope)
+        Default: the width of the axes in pixels
+    filename : str, optional
+        File to save the plot to without showing it, e.g. in batch jobs
+        Default: show the plot
 
     Returns
     -------
@@ -97,82 +179,210 @@ def plot_synthetic_spectrum(source, obs_spectra, molec_spectra, rrls=None, ufs=N
     #colors = [cmap(i) for i in range(len(molec_spectra))]
     values = [i / len(molec_spectra) for i in range(len(molec_spectra))]
 
+    freq = obs_spectra.spectral_axis.to_value(u.MHz)
+    fmin, fmax = np.min(freq), np.max(freq)
+    top = np.nanmax(obs_spectra.flux.value)
+
     fig, ax = plt.subplots(figsize=(10, 6))
-    ax.plot(obs_spectra.spectral_axis, obs_spectra.flux, 
-            label=source, color='navy', linewidth=1.1, alpha=0.8)
-    
-    if rrls is not None:
-        ax.vlines(rrls['Freq[MHz]'], 0, max(obs_spectra.flux/obs_spectra.flux.unit),
-                    color='red', linewidth=1.2, linestyle='--', label='RRLs')
-
-    if ufs is not None:
-        ax.vlines(ufs['Freq[MHz]'], 0, max(obs_spectra.flux/obs_spectra.flux.unit),
-                    color='green', linewidth=1.2, linestyle='--', label='UFs')
-
-    if molecules is not None:
-        ax.vlines(molecules['Freq[MHz]'], 0, max(obs_spectra.flux/obs_spectra.flux.unit),
-                    color='black', linewidth=1.2, linestyle='--', label='Molecules')
-
-    if names is True:
-        if rrls is not None:
-            for i in range(len(rrls)):
-                ax.text(rrls['Freq[MHz]'][i], -0.01, 
-                        rrls['Species'][i], rotation=90, fontsize=12, color='red')
-        if ufs is not None:
-            for i in range(len(ufs)):
-                ax.text(ufs['Freq[MHz]'][i], -0.01, 
-                        ufs['Species'][i], rotation=90, fontsize=12, color='green')
-        if molecules is not None:
-            for i in range(len(molecules)):
-                ax.text(molecules['Freq[MHz]'][i], -0.01, 
-                        molecules['Species'][i], rotation=90, fontsize=12, color='black')
-    else:
-        pass
+    plot_envelope(ax, freq, obs_spectra.flux.value, pixels=pixels,
+                  label=source, color='navy', linewidth=1.1, alpha=0.8)
+
+    # Lines of the catalogue inside the window, with their names for the labels
+    label_freqs, label_names, label_colors = [], [], []
+    for table, color, label in [(rrls, 'red', 'RRLs'), (ufs, 'green', 'UFs'), 
+                                (molecules, 'black', 'Molecules')]:
+        if table is None:
+            continue
+        index = lines_in_window(table['Freq[MHz]'], fmin, fmax)
+        freqs = table['Freq[MHz]'].to_numpy(dtype=np.float64)[index]
+        ax.add_collection(LineCollection(line_segments(freqs, top), colors=color, linewidths=1.2, 
+                                         linestyles='--', label=label))
+        if names is True:
+            label_freqs.append(freqs)
+            label_names.append(table['Species'].to_numpy(dtype=str)[index])
+            label_colors.append(np.full(len(index), color))
 
     # Plot horizontal grey line at y=0
     ax.axhline(y=0, color='grey', linestyle='--', linewidth=1.2)
 
+    # All the synthetic species in one collection, with a legend entry for each of them
+    segments, colors, handles = [], [], []
     for key, value, value_index in zip(molec_spectra.keys(), 
                                        molec_spectra.values(), 
                                        range(len(molec_spectra))):
         # in molec_spectra.items():
         color = cmap(values[value_index])
-        ax.vlines(value['Freq[MHz]'], 0, max(obs_spectra.flux/obs_spectra.flux.unit),
-                  color=color, linewidth=1.0, label=key)
-    
+        index = lines_in_window(value['Freq[MHz]'], fmin, fmax)
+        segments.append(line_segments(value['Freq[MHz]'].to_numpy(dtype=np.float64)[index], top))
+        colors.append(np.tile(color, (len(index), 1)))
+        handles.append(Line2D([], [], color=color, linewidth=1.0, label=key))
+    if segments:
+        ax.add_collection(LineCollection(np.concatenate(segments), colors=np.concatenate(colors), 
+                                         linewidths=1.0))
+
+    if label_freqs:
+        label_freqs = np.concatenate(label_freqs)
+        order = np.argsort(label_freqs, kind='stable')
+        label_freqs = label_freqs[order]
+        label_names = np.concatenate(label_names)[order]
+        label_colors = np.concatenate(label_colors)[order]
+        texts = []
+
+        def draw_labels(axes):
+            for text in texts:
+                text.remove()
+            texts.clear()
+            xmin, xmax = np.sort(axes.get_xlim())
+            lo = np.searchsorted(label_freqs, xmin, side='left')
+            hi = np.searchsorted(label_freqs, xmax, side='right')
+            # Width of a label in units of frequency
+            separation = 12 * fig.dpi / 72 * (xmax - xmin) / max(axes.bbox.width, 1)
+            for i in lo + cull_labels(label_freqs[lo:hi], separation):
+                texts.append(axes.text(label_freqs[i], -0.01, label_names[i], rotation=90, 
+                                       fontsize=12, color=label_colors[i]))
+
+        ax.callbacks.connect('xlim_changed', draw_labels)
+
     # Set axis limits
-    ax.set_xlim(min(obs_spectra.spectral_axis/obs_spectra.spectral_axis.unit), 
-                max(obs_spectra.spectral_axis/obs_spectra.spectral_axis.unit))
+    ax.set_xlim(fmin, fmax)
+    ax.autoscale_view(scalex=False)
     
     # Set legend outside the plot
-    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
+    handles = ax.get_legend_handles_labels()[0] + handles
+    ax.legend(handles=handles, bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
     
     ax.set_xlabel(obs_spectra.spectral_axis.unit)
     ax.set_ylabel(obs_spectra.flux.unit)
     #ax.set_title('Spectrum')
-    ax.legend()
+    ax.legend(handles=handles)
 
-    plt.show()
+    show_figure(fig, filename)
 
 
-def anttemp(molec_spectra, width, dilution=None, tau=None):
+def line_segments(freqs, top):
     """
-    Function to calculate the antenna temperature of a synthetic spectrum
-    
+    Function to build the segments of vertical lines from 0 to top
+
+    Parameters
+    ----------
+    freqs : numpy.ndarray
+        Frequencies of the lines
+    top : float
+        Height of the lines
+
+    Returns
+    -------
+    segments : numpy.ndarray
+        Segments of the lines, with shape (lines, 2, 2)
+    """
+    segments = np.zeros((len(freqs), 2, 2))
+    segments[:, :, 0] = freqs[:, None]
+    segments[:, 1, 1] = top
+
+    return segments
+
+
+def stack_species(molec_spectra):
+    """
+    Function to stack the synthetic spectra of all the species in one table
+
     Parameters
     ----------
     molec_spectra : dictionary of dataframes
         Dictionary of synthetic spectra, each of them stored in a dataframe
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        Table with the lines of all the species, one species after the other, and the
+        name of the species of each line in the categorical column 'Species'
+    """
+    species = list(molec_spectra.keys())
+    counts = [len(value) for value in molec_spectra.values()]
+    table = pd.concat(list(molec_spectra.values()), ignore_index=True)
+    codes = np.repeat(np.arange(len(species)), counts)
+    # The keys give the species, also for frames that have their own 'Species' column 
+    # (e.g. taken from a catalogue)
+    table = table.drop(columns='Species', errors='ignore')
+    table.insert(0, 'Species', pd.Categorical.from_codes(codes, categories=species))
+
+    return table
+
+
+def split_species(table):
+    """
+    Function to split a table made by stack_species into one dataframe per species
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Table with the lines of all the species, one species after the other
+
+    Returns
+    -------
+    molec_spectra : dictionary of dataframes
+        Dictionary of synthetic spectra, each of them a slice of the rows of table 
+        (without copying them) without the 'Species' column
+    """
+    species = table['Species'].cat.categories
+    counts = np.bincount(table['Species'].cat.codes.to_numpy(), minlength=len(species))
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    lines = table.drop(columns='Species')
+
+    return {key: lines.iloc[starts[i]:starts[i+1]] for i, key in enumerate(species)}
+
+
+def species_codes(table):
+    """
+    Function to get the species of the lines of a table
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Table with the name of the species of each line in the column 'Species', 
+        categorical (e.g. made by stack_species, or a compact catalogue) or not (e.g. 
+        Catalogue.molecules)
+
+    Returns
+    -------
+    species : list
+        Names of the species: the categories of a categorical column, or the sorted 
+        names of the lines otherwise
+    codes : numpy.ndarray
+        Position in species of the species of each line
+    """
+    if isinstance(table['Species'].dtype, pd.CategoricalDtype):
+        return list(table['Species'].cat.categories), table['Species'].cat.codes.to_numpy().astype(np.int64)
+    codes, species = pd.factorize(table['Species'], sort=True)
+
+    return list(species), codes.astype(np.int64)
+
+
+def anttemp(molec_spectra, width, dilution=None, tau=None, stacked=False):
+    """
+    Function to calculate the antenna temperature of a synthetic spectrum
+    
+    Parameters
+    ----------
+    molec_spectra : dictionary of dataframes or pandas.DataFrame
+        Dictionary of synthetic spectra, each of them stored in a dataframe, or table
+        of all the species made by stack_species
     width : float
         Width of the line in velocity units
     dilution : float, optional
         Dilution factor
     tau : float, optional
         Optical depth
+    stacked : bool, optional
+        Whether to return all the species stacked in one table (see stack_species) 
+        instead of a dictionary. The antenna temperature of all the lines is then
+        computed in one operation
+        Default: False
 
     Returns
     -------
-    None
+    molec_spectra : dictionary of dataframes or pandas.DataFrame
+        Synthetic spectra with the antenna temperature in column 'T_A'
     """
     if tau is None:
         corr_tau = 1.0
@@ -181,17 +391,196 @@ def anttemp(molec_spectra, width, dilution=None, tau=None):
     if dilution is None:
         dilution = 1.0
     population = 1.0
-    c3 = const.c * const.c * const.c * 1e-3 * 1e-3 * 1e-3
+    # Constant factor of the antenna temperature for frequencies in MHz
+    factor = anttemp_factor * population * dilution / (corr_tau * width)
+
+    if stacked or isinstance(molec_spectra, pd.DataFrame):
+        table = molec_spectra if isinstance(molec_spectra, pd.DataFrame) else stack_species(molec_spectra)
+        freq = table['Freq[MHz]'].to_numpy(dtype=np.float64)
+        table['T_A'] = factor * table['Aij'].to_numpy(dtype=np.float64) / (freq * freq)
+        return table
 
     for key, value in molec_spectra.items():
         # Calculate the antenna temperature
-        value['T_A'] = const.h * c3 / (8 * np.pi * const.k_B * value['Freq[MHz]'] * value['Freq[MHz]'] * width) * population * value['Aij'] * dilution / corr_tau
+        freq = value['Freq[MHz]'].to_numpy(dtype=np.float64)
+        value['T_A'] = factor * value['Aij'].to_numpy(dtype=np.float64) / (freq * freq)
         # Store results in a new column in the dataframe
         molec_spectra[key] = value
 
     return molec_spectra
 
 
+def partition_function(lines, tex):
+    """
+    Function to approximate the partition function from the levels of a line list
+
+    The partition function of a species is the sum of g_u exp(-E_u / Tex) over the 
+    distinct upper levels of its lines, so it underestimates it if the lines do not 
+    cover all the populated levels. If the lines have a 'Species' column (e.g. the 
+    table made by stack_species or Catalogue.molecules), each species gets the 
+    partition function of its own levels; otherwise all the lines are taken as one 
+    species.
+
+    Parameters
+    ----------
+    lines : pandas.DataFrame
+        Lines with the columns 'Eup[K]' and 'Gup', and optionally 'Species'
+    tex : numpy.ndarray
+        Excitation temperatures in K
+
+    Returns
+    -------
+    partition : numpy.ndarray
+        Partition function of the species of each line at each excitation 
+        temperature, with shape (tex, lines)
+    """
+    tex = np.atleast_1d(np.asarray(tex, dtype=np.float64))
+    if 'Species' in lines.columns:
+        codes, species = pd.factorize(lines['Species'], use_na_sentinel=False)
+    else:
+        codes, species = np.zeros(len(lines), dtype=np.int64), [None]
+    levels, inverse = np.unique(np.column_stack([codes, lines['Eup[K]'].to_numpy(dtype=np.float64), 
+                                                 lines['Gup'].to_numpy(dtype=np.float64)]), 
+                                axis=0, return_inverse=True)
+    # Sum of the levels of each species, as in SyntheticFit
+    level_sum = sparse.csr_matrix((np.ones(len(levels)), (levels[:, 0].astype(np.int64), np.arange(len(levels)))), 
+                                  shape=(len(species), len(levels)))
+    weights = np.exp(-levels[:, 1] / tex[:, None]) * levels[:, 2]
+    partition = np.asarray(level_sum @ weights.T).T
+
+    return partition[:, codes]
+
+
+def iter_excitation_grid(lines, width, tex, column, dilution=1.0, tau=0.0, partition=None, 
+                         max_bytes=268435456):
+    """
+    Function to compute the antenna temperature of a line list over a parameter grid
+
+    The lines are assumed in LTE at the excitation temperature Tex, so the upper level
+    of each line is populated with N g_u exp(-E_u / Tex) / Q(Tex) of the column density
+    N, which replaces the unit population of anttemp. The grid is computed in chunks of
+    excitation temperatures that take up to max_bytes each.
+
+    Parameters
+    ----------
+    lines : pandas.DataFrame
+        Lines with the columns 'Freq[MHz]', 'Eup[K]', 'Gup' and 'Aij' (or 'Aij[s-1]', as
+        in the catalogues)
+    width : float
+        Width of the lines in velocity units
+    tex : array-like
+        Excitation temperatures in K
+    column : array-like
+        Column densities
+    dilution : float or array-like, optional
+        Dilution factors
+        Default: 1.0
+    tau : float or array-like, optional
+        Optical depths
+        Default: 0.0 (optically thin)
+    partition : callable or array-like, optional
+        Partition function, as a function of the excitation temperature or its values
+        at tex, with shape (tex,) or (tex, lines)
+        Default: partition_function of the lines, for each species
+    max_bytes : int, optional
+        Maximum size of each chunk of the grid. A chunk has at least one excitation
+        temperature, so it is larger if column x dilution x tau x lines does not fit
+        in max_bytes; a warning is printed then
+        Default: 268435456 (256 MB)
+
+    Yields
+    ------
+    tex_slice : slice
+        Excitation temperatures of the chunk
+    chunk : numpy.ndarray
+        Antenna temperatures with shape (tex, column, dilution, tau, lines), with 
+        tex restricted to tex_slice
+    """
+    tex = np.atleast_1d(np.asarray(tex, dtype=np.float64))
+    column = np.atleast_1d(np.asarray(column, dtype=np.float64))
+    dilution = np.atleast_1d(np.asarray(dilution, dtype=np.float64))
+    tau = np.atleast_1d(np.asarray(tau, dtype=np.float64))
+
+    freq = lines['Freq[MHz]'].to_numpy(dtype=np.float64)
+    aij = lines['Aij' if 'Aij' in lines.columns else 'Aij[s-1]'].to_numpy(dtype=np.float64)
+    eup = lines['Eup[K]'].to_numpy(dtype=np.float64)
+    gup = lines['Gup'].to_numpy(dtype=np.float64)
+    if partition is None:
+        # Computed for each chunk, so it takes (tex, lines) values only for the chunk
+        partition = lambda values: partition_function(lines, values)
+    elif not callable(partition):
+        partition = np.asarray(partition, dtype=np.float64)
+
+    # The antenna temperature is separable: line factor x level population x N, 
+    # dilution and opacity correction
+    line_factor = anttemp_factor * aij * gup / (width * freq * freq)
+    corr_tau = np.where(tau > 0, tau / -np.expm1(-np.where(tau > 0, tau, 1.0)), 1.0)
+    source = (column[:, None, None] * dilution[None, :, None] / corr_tau[None, None, :])
+
+    row_bytes = 8 * source.size * max(len(freq), 1)
+    if row_bytes > max_bytes:
+        print(f'Warning: one excitation temperature of the grid takes {row_bytes} bytes, '
+              f'more than max_bytes ({max_bytes})')
+    step = max(1, int(max_bytes // row_bytes))
+    for start in range(0, len(tex), step):
+        stop = min(start + step, len(tex))
+        values = partition(tex[start:stop]) if callable(partition) else partition[start:stop]
+        values = np.asarray(values, dtype=np.float64)
+        population = np.exp(-eup / tex[start:stop, None]) / (values[:, None] if values.ndim == 1 else values)
+        chunk = (population * line_factor)[:, None, None, None, :] * source[None, :, :, :, None]
+        yield slice(start, stop), chunk
+
+
+def excitation_grid(lines, width, tex, column, dilution=1.0, tau=0.0, partition=None, 
+                    max_bytes=268435456, out=None):
+    """
+    Function to compute the antenna temperature cube of a line list over a parameter grid
+
+    See iter_excitation_grid for the model and the parameters.
+
+    Parameters
+    ----------
+    lines : pandas.DataFrame
+        Lines with the columns 'Freq[MHz]', 'Eup[K]', 'Gup' and 'Aij' (or 'Aij[s-1]')
+    width : float
+        Width of the lines in velocity units
+    tex : array-like
+        Excitation temperatures in K
+    column : array-like
+        Column densities
+    dilution : float or array-like, optional
+        Dilution factors
+        Default: 1.0
+    tau : float or array-like, optional
+        Optical depths
+        Default: 0.0 (optically thin)
+    partition : callable or array-like, optional
+        Partition function, as a function of the excitation temperature or its values
+        at tex, with shape (tex,) or (tex, lines)
+        Default: partition_function of the lines, for each species
+    max_bytes : int, optional
+        Maximum size of each chunk computed at once
+        Default: 268435456 (256 MB)
+    out : numpy.ndarray, optional
+        Array to store the cube, e.g. a numpy.memmap for cubes larger than memory
+        Default: a new array
+
+    Returns
+    -------
+    cube : numpy.ndarray
+        Antenna temperatures with shape (tex, column, dilution, tau, lines)
+    """
+    shape = tuple(np.atleast_1d(np.asarray(values)).size 
+                  for values in (tex, column, dilution, tau)) + (len(lines),)
+    if out is None:
+        out = np.empty(shape, dtype=np.float64)
+    for tex_slice, chunk in iter_excitation_grid(lines, width, tex, column, dilution, tau,
+                                                 partition=partition, max_bytes=max_bytes):
+        out[tex_slice] = chunk
+
+    return out
+
+
 def create_synth_spectrum(molec_spectra):
     """
     Function to create a synthetic spectrum from a dictionary of dataframes
@@ -217,6 +606,585 @@ def create_synth_spectrum(molec_spectra):
     return synth_spectra
 
 
+def line_windows(grid, freqs, sigmas, nsigma=5.0):
+    """
+    Function to find the channels of a frequency grid around each line
+
+    Parameters
+    ----------
+    grid : numpy.ndarray
+        Strictly increasing frequencies of the channels in MHz
+    freqs : numpy.ndarray
+        Frequencies of the lines in MHz
+    sigmas : numpy.ndarray
+        Standard deviations of the lines in MHz
+    nsigma : float, optional
+        Half width of the window of each line, in standard deviations
+        Default: 5.0
+
+    Returns
+    -------
+    line : numpy.ndarray
+        Index of the line of each (line, channel) pair
+    channel : numpy.ndarray
+        Index of the channel of each (line, channel) pair
+    """
+    lo = np.searchsorted(grid, freqs - nsigma * sigmas, side='left')
+    hi = np.searchsorted(grid, freqs + nsigma * sigmas, side='right')
+
+    return expand_ranges(lo, hi)
+
+
+def render_synth_spectra(molec_spectra, spectral_axis, vel_width, nsigma=5.0, batch=1000000):
+    """
+    Function to render the synthetic lines of many species on an observed frequency grid
+
+    Each line is a Gaussian with peak T_A and a full width at half maximum of vel_width,
+    evaluated only in the channels closer than nsigma standard deviations to the line
+    frequency. The species are stacked in one (species x channel) array.
+
+    Parameters
+    ----------
+    molec_spectra : dictionary of dataframes or pandas.DataFrame
+        Dictionary of synthetic spectra, each of them stored in a dataframe with the
+        columns 'Freq[MHz]' and 'T_A' (see anttemp), or table of all the species with
+        the species of each line in 'Species' (see species_codes)
+    spectral_axis : astropy.units.Quantity
+        Spectral axis of the observed spectrum (e.g. spectrum.spectral_axis), strictly
+        increasing or decreasing
+    vel_width : float
+        Full width at half maximum of the lines in velocity units (km/s if it is given
+        without units)
+    nsigma : float, optional
+        Half width of the window where each line is evaluated, in standard deviations
+        Default: 5.0
+    batch : int, optional
+        Approximate number of lines, and of (species x channel) values, rendered at 
+        once, to bound the memory used
+        Default: 1000000
+
+    Returns
+    -------
+    species : list
+        Names of the species, in the order of the rows of the synthetic spectrum
+    synth_spectrum : specutils.Spectrum1D
+        Synthetic spectrum with one row of flux for each species
+    """
+    if isinstance(vel_width, u.Quantity):
+        vel_width = vel_width.to_value(u.km / u.s)
+    grid = np.asarray(spectral_axis.to_value(u.MHz), dtype=np.float64)
+    # Work on an increasing grid; a decreasing one is read backwards
+    descending = len(grid) > 1 and grid[0] > grid[-1]
+    if descending:
+        grid = grid[::-1]
+    channels = len(grid)
+
+    if isinstance(molec_spectra, pd.DataFrame):
+        # Table of all the species (see species_codes), with the lines sorted by species
+        lines = molec_spectra.sort_values(by='Species', kind='stable')
+        species, codes = species_codes(lines)
+        counts = np.bincount(codes, minlength=len(species))
+    else:
+        species = list(molec_spectra.keys())
+        counts = np.array([len(value) for value in molec_spectra.values()], dtype=np.int64)
+        # One concatenation instead of extracting the columns of each species
+        lines = pd.concat(list(molec_spectra.values()), ignore_index=True)
+    freqs = lines['Freq[MHz]'].to_numpy(dtype=np.float64)
+    peaks = lines['T_A'].to_numpy(dtype=np.float64)
+    rows = np.repeat(np.arange(len(species)), counts)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    # Standard deviation of each line in frequency, from its velocity FWHM
+    sigmas = freqs * vel_width / c_kms / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+    flux = np.zeros((len(species), channels), dtype=np.float64)
+    # Blocks of species rows; each block is accumulated on its own with bincount
+    block_rows = max(1, batch // max(channels, 1))
+    for first in range(0, len(species), block_rows):
+        last = min(first + block_rows, len(species))
+        block = flux[first:last].reshape(-1)
+        for start in range(starts[first], starts[last], batch):
+            stop = min(start + batch, starts[last])
+            f, sigma = freqs[start:stop], sigmas[start:stop]
+            line, channel = line_windows(grid, f, sigma, nsigma)
+            values = peaks[start:stop][line] * np.exp(-0.5 * ((grid[channel] - f[line]) 
+                                                              / sigma[line]) ** 2)
+            block += np.bincount((rows[start:stop][line] - first) * channels + channel, 
+                                 weights=values, minlength=block.size)
+    if descending:
+        flux = flux[:, ::-1]
+
+    synth_spectrum = Spectrum1D(flux=u.Quantity(flux, u.K, copy=False), spectral_axis=spectral_axis)
+
+    return species, synth_spectrum
+
+
+class SyntheticFit:
+    """
+    Class to fit the synthetic spectra of many species to observed spectra
+
+    The model of each observed spectrum is the sum of the synthetic lines of all the
+    species, rendered as Gaussians as in render_synth_spectra, and the fit minimises
+    chi2 = sum(((model - flux) / rms)**2) over the channels of all the spectra. If the
+    lines have the columns 'Eup[K]' and 'Gup' the parameters of each species are the
+    log10 of its column density and its excitation temperature (LTE populations, as in
+    iter_excitation_grid); otherwise they are the log10 of a scale factor of its 'T_A'
+    (see anttemp). The parameters are stored as [log10 N of each species, Tex of each 
+    species], in the order of species.
+
+    The line profiles are stored in a sparse (channel x line) matrix that only keeps
+    the channels reached by some line; the other channels add a constant to chi2.
+
+    Attributes
+    ----------
+    species : list
+        Names of the species, in the order of the parameters
+    excitation : bool
+        Whether the parameters include the excitation temperatures
+    n_params : int
+        Number of parameters of the model
+    n_channels : int
+        Number of valid channels of all the spectra
+    profiles : scipy.sparse.csr_matrix
+        Unit peak profile of each line in the channels reached by the lines
+    flux : numpy.ndarray
+        Observed flux of the channels reached by the lines
+    weight : numpy.ndarray
+        Inverse of the rms of the channels reached by the lines
+    chi2_floor : float
+        Contribution to chi2 of the channels that no line reaches
+
+    Methods
+    -------
+    amplitudes(params)
+        Function to compute the peak antenna temperature of the lines for many models
+    mean_energy(tex)
+        Function to compute the mean upper level energy of each species in LTE
+    residuals(params)
+        Function to compute the weighted residuals of a model
+    jacobian(params)
+        Function to compute the Jacobian of the weighted residuals
+    chi_square(params, gradient)
+        Function to compute chi2 of a model and its gradient
+    chi_square_batch(params, max_bytes)
+        Function to compute chi2 of many models at once
+    chi_square_grid(tex, column, species, params, max_bytes)
+        Function to compute chi2 over a grid of excitation temperatures and column 
+        densities
+    initial_params(tex)
+        Function to estimate the column densities by linear least squares
+    fit(params, tex, tex_bounds, max_nfev)
+        Function to fit the model to the observed spectra
+    models(params)
+        Function to render the model of each observed spectrum
+    """
+
+    def __init__(self, spectra, molec_spectra, vel_width, rms=None, dilution=None, tau=None, 
+                 nsigma=5.0):
+        """
+        Parameters
+        ----------
+        spectra : specutils.Spectrum1D or list of specutils.Spectrum1D
+            Observed spectra (e.g. one for each band), with the flux in K
+        molec_spectra : dictionary of dataframes or pandas.DataFrame
+            Dictionary of synthetic spectra, each of them stored in a dataframe, or table
+            of all the species with the species of each line in 'Species' (see 
+            species_codes), e.g. Catalogue.molecules. The lines need the column 'T_A' 
+            (see anttemp), or the columns 'Aij' (or 'Aij[s-1]'), 'Eup[K]' and 'Gup'
+        vel_width : float
+            Full width at half maximum of the lines in velocity units (km/s if it is 
+            given without units)
+        rms : float or list of float, optional
+            Noise of each spectrum in K
+            Default: 1.4826 times the median absolute deviation of the flux
+        dilution : float, optional
+            Dilution factor, for lines with excitation parameters
+        tau : float, optional
+            Optical depth, for lines with excitation parameters
+        nsigma : float, optional
+            Half width of the window where each line is evaluated, in standard deviations
+            Default: 5.0
+        """
+        if isinstance(spectra, Spectrum1D):
+            spectra = [spectra]
+        if rms is None or np.ndim(rms) == 0:
+            rms = [rms] * len(spectra)
+        if isinstance(vel_width, u.Quantity):
+            vel_width = vel_width.to_value(u.km / u.s)
+
+        table = molec_spectra if isinstance(molec_spectra, pd.DataFrame) else stack_species(molec_spectra)
+        self.species, self.codes = species_codes(table)
+        n_species = len(self.species)
+        freqs = table['Freq[MHz]'].to_numpy(dtype=np.float64)
+        sigmas = freqs * vel_width / c_kms / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+        self.excitation = 'Eup[K]' in table.columns and 'Gup' in table.columns
+        if self.excitation:
+            corr_tau = 1.0 if tau is None else tau / (1 - np.exp(-tau))
+            dilution = 1.0 if dilution is None else dilution
+            aij = table['Aij' if 'Aij' in table.columns else 'Aij[s-1]'].to_numpy(dtype=np.float64)
+            self.eup = table['Eup[K]'].to_numpy(dtype=np.float64)
+            gup = table['Gup'].to_numpy(dtype=np.float64)
+            # Antenna temperature of each line for a unit column density and population
+            self.line_factor = anttemp_factor * dilution * aij * gup / (corr_tau * vel_width * freqs * freqs)
+            # Distinct upper levels of each species, summed by species for the partition function
+            levels = np.unique(np.column_stack([self.codes, self.eup, gup]), axis=0)
+            self.level_species = levels[:, 0].astype(np.int64)
+            self.level_eup = levels[:, 1]
+            self.level_gup = levels[:, 2]
+            self.level_sum = sparse.csr_matrix((np.ones(len(levels)), (self.level_species, np.arange(len(levels)))),
+                                               shape=(n_species, len(levels)))
+            self.n_params = 2 * n_species
+        else:
+            self.line_factor = table['T_A'].to_numpy(dtype=np.float64)
+            self.n_params = n_species
+
+        rows, cols, values, flux, weight, self.bounds = [], [], [], [], [], [0]
+        for spectrum, noise in zip(spectra, rms):
+            grid = np.asarray(spectrum.spectral_axis.to_value(u.MHz), dtype=np.float64)
+            data = np.asarray(spectrum.flux.to_value(u.K), dtype=np.float64)
+            valid = np.isfinite(data)
+            if noise is None:
+                noise = 1.4826 * np.median(np.abs(data[valid] - np.median(data[valid])))
+            # Work on an increasing grid; a decreasing one is read backwards
+            order = np.arange(len(grid))[::-1] if len(grid) > 1 and grid[0] > grid[-1] else np.arange(len(grid))
+            line, channel = line_windows(grid[order], freqs, sigmas, nsigma)
+            rows.append(order[channel] + self.bounds[-1])
+            cols.append(line)
+            values.append(np.exp(-0.5 * ((grid[order][channel] - freqs[line]) / sigmas[line]) ** 2))
+            flux.append(np.where(valid, data, 0.0))
+            weight.append(np.where(valid, 1.0 / noise, 0.0))
+            self.bounds.append(self.bounds[-1] + len(grid))
+        self.spectra = spectra
+        rows, flux, weight = np.concatenate(rows), np.concatenate(flux), np.concatenate(weight)
+        self.n_channels = int(np.count_nonzero(weight))
+
+        # Keep only the channels reached by some line
+        self.channels = np.unique(rows)
+        self.profiles = sparse.csr_matrix((np.concatenate(values), (np.searchsorted(self.channels, rows), 
+                                                                    np.concatenate(cols))),
+                                          shape=(len(self.channels), len(freqs)))
+        self.flux = flux[self.channels]
+        self.weight = weight[self.channels]
+        outside = np.ones(len(flux), dtype=bool)
+        outside[self.channels] = False
+        self.chi2_floor = float(np.sum((flux[outside] * weight[outside]) ** 2))
+
+    def amplitudes(self, params):
+        """
+        Function to compute the peak antenna temperature of the lines for many models
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Parameters of one model, or array with the parameters of a model in each row
+
+        Returns
+        -------
+        amplitudes : numpy.ndarray
+            Peak antenna temperature of each line (columns) for each model (rows)
+        """
+        params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+        n_species = len(self.species)
+        amplitudes = 10.0 ** params[:, :n_species][:, self.codes] * self.line_factor
+        if self.excitation:
+            tex = params[:, n_species:]
+            boltzmann = self.level_gup * np.exp(-self.level_eup / tex[:, self.level_species])
+            partition = (self.level_sum @ boltzmann.T).T
+            amplitudes *= np.exp(-self.eup / tex[:, self.codes]) / partition[:, self.codes]
+
+        return amplitudes
+
+    def mean_energy(self, tex):
+        """
+        Function to compute the mean upper level energy of each species in LTE
+
+        The derivative of the logarithm of the partition function with respect to Tex
+        is mean_energy(tex) / tex^2.
+
+        Parameters
+        ----------
+        tex : numpy.ndarray
+            Excitation temperature of each species in K
+
+        Returns
+        -------
+        mean_eup : numpy.ndarray
+            Mean upper level energy of each species in K
+        """
+        boltzmann = self.level_gup * np.exp(-self.level_eup / tex[self.level_species])
+
+        return (self.level_sum @ (boltzmann * self.level_eup)) / (self.level_sum @ boltzmann)
+
+    def residuals(self, params):
+        """
+        Function to compute the weighted residuals of a model
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Parameters of the model
+
+        Returns
+        -------
+        residuals : numpy.ndarray
+            (model - flux) / rms in the channels reached by the lines
+        """
+        return (self.profiles @ self.amplitudes(params)[0] - self.flux) * self.weight
+
+    def jacobian(self, params):
+        """
+        Function to compute the Jacobian of the weighted residuals
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Parameters of the model
+
+        Returns
+        -------
+        jacobian : scipy.sparse.csr_matrix
+            Derivative of each residual (rows) with respect to each parameter (columns)
+        """
+        params = np.asarray(params, dtype=np.float64)
+        amplitudes = self.amplitudes(params)[0]
+        n_species = len(self.species)
+        lines = np.arange(len(amplitudes))
+        # Derivative of the amplitude of each line with respect to the parameters of its species
+        values, rows, cols = [np.log(10.0) * amplitudes], [lines], [self.codes]
+        if self.excitation:
+            tex = params[n_species:]
+            values.append(amplitudes * (self.eup - self.mean_energy(tex)[self.codes]) 
+                          / tex[self.codes] ** 2)
+            rows.append(lines)
+            cols.append(n_species + self.codes)
+        derivatives = sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                                        shape=(len(amplitudes), self.n_params))
+
+        return sparse.diags(self.weight) @ (self.profiles @ derivatives)
+
+    def chi_square(self, params, gradient=False):
+        """
+        Function to compute chi2 of a model and its gradient
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Parameters of the model
+        gradient : bool, optional
+            Whether to return the gradient of chi2 with respect to the parameters
+            Default: False
+
+        Returns
+        -------
+        chi2 : float
+            Chi-square of the model
+        grad : numpy.ndarray
+            Gradient of chi2, only if gradient is True
+        """
+        params = np.asarray(params, dtype=np.float64)
+        amplitudes = self.amplitudes(params)[0]
+        residuals = (self.profiles @ amplitudes - self.flux) * self.weight
+        chi2 = self.chi2_floor + residuals @ residuals
+        if not gradient:
+            return chi2
+
+        n_species = len(self.species)
+        # Derivative of chi2 with respect to the logarithm of the amplitude of each line
+        dlog = 2.0 * (self.profiles.T @ (residuals * self.weight)) * amplitudes
+        grad = np.empty(self.n_params)
+        grad[:n_species] = np.log(10.0) * np.bincount(self.codes, weights=dlog, minlength=n_species)
+        if self.excitation:
+            # d log(amplitude) / d Tex = (E_u - <E_u>) / Tex^2, with <E_u> the mean energy of the species
+            tex = params[n_species:]
+            grad[n_species:] = np.bincount(self.codes, weights=dlog * (self.eup - self.mean_energy(tex)[self.codes]),
+                                           minlength=n_species) / (tex * tex)
+
+        return chi2, grad
+
+    def chi_square_batch(self, params, max_bytes=268435456):
+        """
+        Function to compute chi2 of many models at once
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Array with the parameters of a model in each row
+        max_bytes : int, optional
+            Maximum size of the (channel x model) array computed at once
+            Default: 268435456 (256 MB)
+
+        Returns
+        -------
+        chi2 : numpy.ndarray
+            Chi-square of each model
+        """
+        params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+        chi2 = np.empty(len(params))
+        step = max(1, int(max_bytes // (8 * max(len(self.channels), self.profiles.shape[1], 1))))
+        for start in range(0, len(params), step):
+            stop = min(start + step, len(params))
+            residuals = self.profiles @ self.amplitudes(params[start:stop]).T
+            residuals -= self.flux[:, None]
+            residuals *= self.weight[:, None]
+            chi2[start:stop] = self.chi2_floor + np.einsum('ij,ij->j', residuals, residuals)
+
+        return chi2
+
+    def chi_square_grid(self, tex, column, species=None, params=None, max_bytes=268435456):
+        """
+        Function to compute chi2 over a grid of excitation temperatures and column densities
+
+        Parameters
+        ----------
+        tex : array-like
+            Excitation temperatures in K
+        column : array-like
+            Column densities
+        species : str or list of str, optional
+            Species that take the values of the grid; the rest keep their values in params
+            Default: all the species
+        params : numpy.ndarray, optional
+            Parameters of the species that are not in the grid
+            Default: initial_params()
+        max_bytes : int, optional
+            Maximum size of the (channel x model) array computed at once
+            Default: 268435456 (256 MB)
+
+        Returns
+        -------
+        chi2 : numpy.ndarray
+            Chi-square with shape (tex, column)
+        """
+        if not self.excitation:
+            print('The lines have no excitation parameters (Eup[K] and Gup)')
+            return None
+        n_species = len(self.species)
+        if species is None:
+            index = np.arange(n_species)
+        else:
+            species = [species] if isinstance(species, str) else species
+            index = np.array([self.species.index(name) for name in species])
+        if params is None:
+            params = self.initial_params() if species is not None else np.zeros(self.n_params)
+        tex, column = np.meshgrid(np.asarray(tex, dtype=np.float64), np.asarray(column, dtype=np.float64),
+                                  indexing='ij')
+        batch = np.repeat(np.asarray(params, dtype=np.float64)[None, :], tex.size, axis=0)
+        batch[:, index] = np.log10(column.reshape(-1))[:, None]
+        batch[:, n_species + index] = tex.reshape(-1)[:, None]
+
+        return self.chi_square_batch(batch, max_bytes=max_bytes).reshape(tex.shape)
+
+    def initial_params(self, tex=100.0):
+        """
+        Function to estimate the column densities by linear least squares
+
+        At fixed excitation temperatures the model is linear in the column densities, 
+        so they are estimated by solving the normal equations of chi2. Species that get
+        a non-positive column density are set well below the value that fits them alone.
+
+        Parameters
+        ----------
+        tex : float or array-like, optional
+            Excitation temperature of each species in K
+            Default: 100.0
+
+        Returns
+        -------
+        params : numpy.ndarray
+            Initial parameters of the model
+        """
+        n_species = len(self.species)
+        params = np.zeros(self.n_params)
+        if self.excitation:
+            params[n_species:] = tex
+        amplitudes = self.amplitudes(params)[0]
+        # Weighted template of each species, as a sparse (channel x species) matrix
+        templates = sparse.csr_matrix((amplitudes, (np.arange(len(amplitudes)), self.codes)),
+                                      shape=(len(amplitudes), n_species))
+        templates = sparse.diags(self.weight) @ (self.profiles @ templates)
+        normal = (templates.T @ templates).toarray()
+        rhs = templates.T @ (self.flux * self.weight)
+        scale = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+        diagonal = np.diag(normal)
+        alone = np.divide(np.abs(rhs), diagonal, out=np.ones(n_species), where=diagonal > 0)
+        scale = np.where((scale > 0) & np.isfinite(scale), scale, 1e-3 * alone)
+        params[:n_species] = np.log10(scale)
+
+        return params
+
+    def fit(self, params=None, tex=100.0, tex_bounds=(2.73, 1000.0), max_nfev=None):
+        """
+        Function to fit the model to the observed spectra
+
+        chi2 is minimised with the trust region least squares of scipy, using the sparse
+        Jacobian of the residuals, with the excitation temperatures bounded by tex_bounds.
+
+        Parameters
+        ----------
+        params : numpy.ndarray, optional
+            Initial parameters
+            Default: initial_params(tex)
+        tex : float or array-like, optional
+            Initial excitation temperature of each species in K, if params is not given
+            Default: 100.0
+        tex_bounds : tuple, optional
+            Lower and upper bounds of the excitation temperatures in K
+            Default: (2.73, 1000.0)
+        max_nfev : int, optional
+            Maximum number of evaluations of the residuals
+            Default: the default of scipy.optimize.least_squares
+
+        Returns
+        -------
+        table : pandas.DataFrame
+            Fitted parameters of each species
+        result : scipy.optimize.OptimizeResult
+            Result of the minimisation, with the parameters in result.x, chi2 in 
+            result.chi2 and the reduced chi2 in result.reduced_chi2
+        """
+        if params is None:
+            params = self.initial_params(tex)
+        n_species = len(self.species)
+        lower = np.full(self.n_params, -np.inf)
+        upper = np.full(self.n_params, np.inf)
+        if self.excitation:
+            lower[n_species:], upper[n_species:] = tex_bounds
+            params = np.clip(params, lower, upper)
+        result = least_squares(self.residuals, params, jac=self.jacobian, bounds=(lower, upper), 
+                               method='trf', tr_solver='lsmr', x_scale='jac', max_nfev=max_nfev)
+        result.chi2 = self.chi2_floor + 2.0 * result.cost
+        result.reduced_chi2 = result.chi2 / max(self.n_channels - self.n_params, 1)
+
+        if self.excitation:
+            table = pd.DataFrame({'Species': self.species, 'log10N': result.x[:n_species], 
+                                  'N': 10.0 ** result.x[:n_species], 'Tex[K]': result.x[n_species:]})
+        else:
+            table = pd.DataFrame({'Species': self.species, 'log10Scale': result.x, 
+                                  'Scale': 10.0 ** result.x})
+
+        return table, result
+
+    def models(self, params):
+        """
+        Function to render the model of each observed spectrum
+
+        Parameters
+        ----------
+        params : numpy.ndarray
+            Parameters of the model (e.g. result.x of fit)
+
+        Returns
+        -------
+        models : list of specutils.Spectrum1D
+            Model of each observed spectrum, on its spectral axis
+        """
+        model = np.zeros(self.bounds[-1])
+        model[self.channels] = self.profiles @ self.amplitudes(params)[0]
+
+        return [Spectrum1D(flux=u.Quantity(model[start:stop], u.K), spectral_axis=spectrum.spectral_axis)
+                for spectrum, start, stop in zip(self.spectra, self.bounds[:-1], self.bounds[1:])]
+
+
 def flux_to_temp(spectrum):
     """
     Function to convert a flux spectrum to a temperature spectrum
@@ -0,0 +1,40 @@
+import os
+import sys
+
+# The modules of the package are at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+# Lines of a small source catalogue: status, species, frequency [MHz], Eup [K], Gup, 
+# Aij [s-1], upper and lower levels, and origin
+CATALOGUE_LINES = [
+    ('D', 'CO', 86010.0, 5.5, 3, 7.2e-8, 'J=1', 'J=0', 'cdms'),
+    ('D', 'CO', 86030.0, 16.6, 5, 6.9e-7, 'J=2', 'J=1', 'cdms'),
+    ('T', 'CO', 86050.0, 33.2, 7, 2.5e-6, 'J=3', 'J=2', 'cdms'),
+    ('D', 'HCN', 86020.0, 4.3, 3, 2.4e-5, 'J=1', 'J=0', 'jpl'),
+    ('D', 'HCN', 86060.0, 12.8, 5, 2.3e-4, 'J=2', 'J=1', 'jpl'),
+    ('?', 'HCN', 86080.0, 25.5, 7, 8.4e-4, 'J=3', 'J=2', 'jpl'),
+    ('D', 'H41\\ga', 92034.4, 0.0, 1, 1.0e-3, '42', '41', 'rrline'),
+    ('D', 'He41\\ga', 92071.9, 0.0, 1, 1.0e-3, '42', '41', 'rrline'),
+    ('T', 'H52\\gb', 88405.7, 0.0, 1, 1.0e-3, '54', '52', 'rrline'),
+    ('D', 'U-86040', 86040.0, 0.0, 1, 1.0e-3, '', '', 'unknow'),
+]
+
+
+def write_catalogue(filename, lines=CATALOGUE_LINES):
+    # Fixed-width format of the .my-lines.list files, after five header lines
+    rows = ['-' * 100] * 5
+    for status, species, freq, eup, gup, aij, upper, lower, origin in lines:
+        rows.append(f'{status}{1:>3d}{species:<15s}{freq:>10.3f}{0.1:>8.3f}{eup:>8.1f}{gup:>5d}'
+                    f'{aij:>10.2e}{upper:>15s} -- {lower:<15s}{origin:<6s}')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+
+
+@pytest.fixture
+def catalogue_dir(tmp_path):
+    # Directory with the catalogue SRC, ending in a separator as the Catalogue paths
+    write_catalogue(tmp_path / 'SRC.my-lines.list')
+    return str(tmp_path) + os.sep
@@ -0,0 +1,147 @@
+import os
+import glob
+import json
+import pandas as pd
+import pytest
+
+from catalogues import Catalogue
+
+from conftest import CATALOGUE_LINES, write_catalogue
+
+
+def cache_frames(catalogue):
+    # Builds every line class, so that all the frames are cached
+    return {kind: getattr(catalogue, kind).copy() for kind in ['catalogue'] + Catalogue.line_classes}
+
+
+def cache_key(cache_dir):
+    [key_file] = glob.glob(os.path.join(cache_dir, '*.json'))
+    with open(key_file) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_cache_returns_same_frames(catalogue_dir, tmp_path, compact):
+    cache_dir = str(tmp_path / 'cache')
+    frames = cache_frames(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir, compact=compact))
+    cached = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir, compact=compact)
+
+    # Loaded from the cache, without parsing the file again
+    assert 'source' not in cached.frames
+    assert sorted(cache_key(cache_dir)['frames']) == sorted(frames)
+    for kind, data in frames.items():
+        pd.testing.assert_frame_equal(getattr(cached, kind), data)
+    # The frames are stored as Parquet, never as pickles
+    assert glob.glob(os.path.join(cache_dir, '*.parquet'))
+    assert not glob.glob(os.path.join(cache_dir, '*.pkl'))
+
+
+def test_cache_shares_compact_categories(catalogue_dir, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache_frames(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir, compact=True))
+    cached = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir, compact=True)
+
+    dtype = cached.catalogue['Species'].dtype
+    assert isinstance(dtype, pd.CategoricalDtype)
+    assert cached.molecules['Species'].dtype is dtype
+
+
+def test_cache_invalidated_by_file_change(catalogue_dir, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache_frames(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir))
+    write_catalogue(catalogue_dir + 'SRC.my-lines.list', CATALOGUE_LINES[:4])
+
+    changed = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir)
+    assert len(changed.catalogue) == 4
+    assert cache_key(cache_dir)['frames'] == ['catalogue']
+
+
+def test_cache_kept_with_new_modification_time(catalogue_dir, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache_frames(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir))
+    source = catalogue_dir + 'SRC.my-lines.list'
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    cached = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir)
+    assert 'source' not in cached.frames
+    assert cache_key(cache_dir)['mtime'] == stat.st_mtime_ns + 10**9
+
+
+def test_cache_skips_file_changed_after_parsing(catalogue_dir, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    catalogue = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir)
+    write_catalogue(catalogue_dir + 'SRC.my-lines.list', CATALOGUE_LINES[:4])
+    catalogue.molecules
+
+    # The frames come from the old file, so they are not added to the cache
+    assert 'molecules' not in cache_key(cache_dir)['frames']
+    assert len(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir).catalogue) == 4
+
+
+@pytest.mark.parametrize('damage', ['remove', 'corrupt'])
+def test_cache_reparsed_without_frame_file(catalogue_dir, tmp_path, capsys, damage):
+    cache_dir = str(tmp_path / 'cache')
+    frames = cache_frames(Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir))
+    [data_file] = glob.glob(os.path.join(cache_dir, '*.molecules.parquet'))
+    if damage == 'remove':
+        os.remove(data_file)
+    else:
+        with open(data_file, 'wb') as f:
+            f.write(b'not a parquet file')
+
+    reparsed = Catalogue(catalogue_dir, 'SRC', cache_dir=cache_dir)
+    assert 'molecules' not in reparsed.frames
+    pd.testing.assert_frame_equal(reparsed.molecules, frames['molecules'])
+    if damage == 'corrupt':
+        assert 'Error reading cache of SRC' in capsys.readouterr().out
+
+
+def test_cache_disabled(catalogue_dir, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache_frames(Catalogue(catalogue_dir, 'SRC', cache=False, cache_dir=cache_dir))
+
+    assert not os.path.exists(cache_dir)
+
+
+@pytest.fixture
+def catalogue(catalogue_dir):
+    return Catalogue(catalogue_dir, 'SRC', cache=False)
+
+
+def test_match_ranks_lines_of_each_query(catalogue):
+    matches = catalogue.match([86041.0, 92040.0, 50000.0], 15.0)
+
+    assert matches['Query'].tolist() == [0, 0, 0, 1]
+    assert matches['Rank'].tolist() == [1, 2, 3, 1]
+    assert matches['Species'].astype(str).tolist()[:3] == ['U-86040', 'CO', 'CO']
+    assert matches['Class'].tolist() == ['uf', 'molecules', 'molecules', 'rrls']
+    assert matches['Offset[MHz]'].tolist()[:3] == [-1.0, 9.0, -11.0]
+    assert matches['Query[MHz]'].tolist() == [86041.0] * 3 + [92040.0]
+
+
+def test_match_tolerance_per_query_and_candidates(catalogue):
+    matches = catalogue.match([86041.0, 86041.0], [15.0, 0.5], max_candidates=2)
+    assert matches['Query'].tolist() == [0, 0]
+    assert matches['Rank'].tolist() == [1, 2]
+
+    matches = catalogue.match([86041.0], 15.0, kinds='uf')
+    assert matches['Class'].tolist() == ['uf']
+
+
+def test_match_without_queries_or_matches(catalogue):
+    columns = catalogue.match([86041.0], 15.0).columns
+    for freqs in [[], [50000.0]]:
+        matches = catalogue.match(freqs, 1.0)
+        assert len(matches) == 0
+        assert matches.columns.equals(columns)
+
+
+def test_lines_in_range_and_nearest(catalogue):
+    lines = catalogue.lines_in_range(86015.0, 86040.0)
+    assert lines['Freq[MHz]'].tolist() == [86020.0, 86030.0, 86040.0]
+    assert len(catalogue.lines_in_range(1.0, 2.0)) == 0
+
+    nearest = catalogue.nearest(86044.0, k=2)
+    assert nearest['Offset[MHz]'].tolist() == [-4.0, 6.0]
+    assert len(catalogue.nearest(86044.0, k=5, kinds='uf')) == 1
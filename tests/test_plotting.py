@@ -0,0 +1,64 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from astropy import units as u
+from astropy.table import QTable
+from specutils import Spectrum1D
+
+import plotting
+import spectrumfit as sf
+
+
+def test_spectrum_envelope_keeps_extremes():
+    x = np.linspace(86000.0, 87000.0, 100000)
+    y = np.sin(x)
+    y[123] = 5.0
+    y[54321] = np.nan
+
+    ex, ey = plotting.spectrum_envelope(x, y, pixels=100)
+    assert len(ex) <= 2 * 100 + 2
+    assert np.all(np.diff(ex) >= 0)
+    assert ex[0] == x[0] and ex[-1] == x[-1]
+    assert np.nanmax(ey) == 5.0
+    assert np.nanmin(ey) == np.nanmin(y)
+
+
+def test_spectrum_envelope_short_and_zoomed():
+    x = np.arange(10.0)
+    y = x ** 2
+    ex, ey = plotting.spectrum_envelope(x[::-1], y[::-1], pixels=100)
+    np.testing.assert_array_equal(ex, x)
+    np.testing.assert_array_equal(ey, y)
+
+    # One channel more on each side of the zoomed range
+    ex, ey = plotting.spectrum_envelope(x, y, xlim=(3.5, 5.5), pixels=100)
+    np.testing.assert_array_equal(ex, x[3:7])
+    assert len(plotting.spectrum_envelope(x[:0], y[:0])[0]) == 0
+
+
+def test_plot_envelope_recomputed_on_zoom():
+    x = np.linspace(0.0, 1.0, 10000)
+    fig, ax = plt.subplots()
+    line = plotting.plot_envelope(ax, x, np.cos(50 * x), pixels=50)
+    assert len(line.get_xdata()) <= 102
+    ax.set_xlim(0.1, 0.2)
+    # Only the zoomed channels, and the one at each side of them
+    xdata = line.get_xdata()
+    assert xdata[0] == x[x < 0.1][-1] and xdata[-1] == x[x > 0.2][0]
+    assert len(xdata) < np.count_nonzero((x >= 0.1) & (x <= 0.2))
+    plt.close(fig)
+
+
+def test_plot_spectrum_saves_file(tmp_path):
+    freq = np.linspace(86000.0, 86100.0, 5000) * u.MHz
+    flux = np.exp(-0.5 * ((freq.value - 86050.0) / 0.5) ** 2) * u.K
+    spectrum = Spectrum1D(flux=flux, spectral_axis=freq)
+    lines = QTable({'line_center': [86050.0] * u.MHz})
+    filename = tmp_path / 'spectrum.png'
+
+    sf.plot_spectrum(spectrum, lines=lines, filename=str(filename))
+    assert filename.stat().st_size > 0
+    assert not plt.get_fignums()
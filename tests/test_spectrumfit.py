@@ -0,0 +1,241 @@
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+
+from astropy import units as u
+from astropy.table import QTable
+from specutils import Spectrum1D
+
+import catalogues
+import spectrumfit as sf
+
+
+def test_radio_velocity_to_freq_matches_doppler_radio():
+    velocity = np.linspace(-3000.0, 3000.0, 100001)
+    restfreq, offset = 87317.0, 12.0
+    expected = (velocity * u.km / u.s).to(u.MHz, equivalencies=u.doppler_radio(restfreq * u.MHz))
+    expected = expected.to_value(u.MHz) + offset
+
+    frequency = sf.radio_velocity_to_freq(velocity, restfreq, offset)
+
+    np.testing.assert_allclose(frequency, expected, rtol=1e-14, atol=0.0)
+
+
+def test_radio_velocity_to_freq_in_place():
+    velocity = np.linspace(-50.0, 50.0, 11)
+    expected = sf.radio_velocity_to_freq(velocity, 230538.0, 31.0)
+
+    out = sf.radio_velocity_to_freq(velocity, 230538.0, 31.0, out=velocity)
+
+    assert out is velocity
+    np.testing.assert_array_equal(velocity, expected)
+
+
+def test_noise_profile_short_spectra():
+    centers, rms, mad = sf.noise_profile(np.array([1.0]))
+    assert centers.shape == rms.shape == mad.shape == (1,)
+    assert np.isnan(rms[0]) and np.isnan(mad[0])
+
+    # Windows longer than the spectrum are cut to its length
+    flux = np.random.default_rng(0).normal(0.0, 1.0, 100)
+    centers, rms, mad = sf.noise_profile(flux, window=8192)
+    np.testing.assert_array_equal(centers, [49.5])
+    assert np.isfinite(rms).all()
+
+
+def test_rebin_flux_skips_non_finite_channels():
+    flux = np.ones(10)
+    flux[2] = np.nan
+
+    sum_flux, sum_weight = sf.rebin_flux(np.arange(11.0), flux, np.arange(0.0, 11.0, 2.0))
+
+    np.testing.assert_array_equal(sum_weight, [2.0, 1.0, 2.0, 2.0, 2.0])
+    np.testing.assert_array_equal(sum_flux / sum_weight, np.ones(5))
+
+
+def gaussian_spectrum(centers, peaks, sigma=0.5, noise=0.01, channels=4000, seed=0):
+    freq = np.linspace(86000.0, 86100.0, channels)
+    flux = np.random.default_rng(seed).normal(0.0, noise, channels)
+    for center, peak in zip(centers, peaks):
+        flux += peak * np.exp(-0.5 * ((freq - center) / sigma) ** 2)
+    return Spectrum1D(flux=flux * u.K, spectral_axis=freq * u.MHz)
+
+
+def test_fit_gaussian_batch_recovers_windows():
+    x = np.tile(np.linspace(-5.0, 5.0, 201), (3, 1))
+    truth = np.array([[1.0, 0.3, 0.8], [0.5, -1.0, 1.2], [2.0, 0.0, 0.4]])
+    y = truth[:, :1] * np.exp(-0.5 * ((x - truth[:, 1:2]) / truth[:, 2:]) ** 2)
+    weight = np.ones_like(x)
+    weight[0, 150:] = 0.0
+
+    params, covariance, chi2, converged = sf.fit_gaussian_batch(x, y, weight, truth * [0.8, 1.0, 1.3])
+
+    np.testing.assert_allclose(params, truth, rtol=1e-5, atol=1e-6)
+    assert covariance.shape == (3, 3, 3)
+    assert converged.all() and (chi2 < 1e-8).all()
+
+
+
+def test_fit_gaussian_batch_degenerate_windows():
+    params, covariance, chi2, converged = sf.fit_gaussian_batch(np.zeros((0, 10)), np.zeros((0, 10)), 
+                                                                np.zeros((0, 10)), np.zeros((0, 3)))
+    assert params.shape == (0, 3) and covariance.shape == (0, 3, 3) and len(chi2) == len(converged) == 0
+
+    # A window without valid channels keeps its parameters, with an undefined covariance
+    x = np.linspace(-5.0, 5.0, 51)[None, :]
+    params, covariance, chi2, converged = sf.fit_gaussian_batch(x, np.zeros_like(x), np.zeros_like(x), 
+                                                                [[1.0, 0.0, 1.0]])
+    np.testing.assert_array_equal(params, [[1.0, 0.0, 1.0]])
+    assert np.isnan(covariance).all() and chi2[0] == 0.0
+
+def test_fit_line_profiles_blend():
+    spectrum = gaussian_spectrum([86040.0, 86041.5, 86070.0], [0.5, 0.3, 0.4])
+    freq = spectrum.spectral_axis.to_value(u.MHz)
+    lines = QTable({'line_center_index': np.searchsorted(freq, [86070.0, 86040.0, 86041.5])})
+
+    profiles = sf.fit_line_profiles(spectrum, lines, rms=0.01, vel_width=4.0, workers=1)
+
+    np.testing.assert_array_equal(profiles['components'], [1, 2, 2])
+    assert profiles['blend'][1] == profiles['blend'][2] != profiles['blend'][0]
+    np.testing.assert_allclose(profiles['line_center'].to_value(u.MHz), [86070.0, 86040.0, 86041.5], atol=0.02)
+    np.testing.assert_allclose(profiles['peak'].to_value(u.K), [0.4, 0.5, 0.3], atol=0.02)
+    assert profiles['converged'].all()
+
+
+def test_fit_line_profiles_without_lines():
+    spectrum = gaussian_spectrum([], [])
+    lines = QTable({'line_center_index': np.zeros(0, dtype=np.int64)})
+    reference = sf.fit_line_profiles(spectrum, QTable({'line_center_index': [2000]}), rms=0.01, workers=1)
+
+    profiles = sf.fit_line_profiles(spectrum, lines, rms=0.01, workers=1)
+
+    assert len(profiles) == 0
+    assert profiles.colnames == reference.colnames
+    assert all(profiles[name].unit == reference[name].unit for name in profiles.colnames)
+
+
+def test_line_inspector_cluster():
+    spectrum = gaussian_spectrum([86030.0, 86070.0], [0.5, 0.4])
+
+    lines = sf.line_inspector(spectrum, 0.05, 'IC418', 'emission', cluster=True, verbose=False, save=False)
+
+    np.testing.assert_allclose(np.sort(np.asarray(lines['line_center'])), [86030.0, 86070.0], atol=0.1)
+
+
+def test_line_inspector_cluster_without_lines():
+    spectrum = gaussian_spectrum([], [])
+
+    lines = sf.line_inspector(spectrum, 1.0, 'IC418', 'emission', cluster=True, verbose=False, save=False)
+
+    assert len(lines) == 0
+
+
+def write_scan(filename, centers, peaks, seed=0):
+    # Velocity and Tmb columns of a scan of IC418 in the 3mm band
+    entry = sf.get_source_entry('IC418', '3mm')
+    velocity = np.linspace(-2000.0, 2000.0, 20000)
+    freq = sf.radio_velocity_to_freq(velocity, entry['restfreq'].to_value(u.MHz), 
+                                     entry['offset'].to_value(u.MHz))
+    flux = np.random.default_rng(seed).normal(0.0, 0.01, len(velocity))
+    for center, peak in zip(centers, peaks):
+        flux += peak * np.exp(-0.5 * ((freq - center) / 1.0) ** 2)
+    np.savetxt(filename, np.column_stack([velocity, flux]), fmt='%.6f')
+    return freq
+
+
+def batch_manifest(path):
+    freq = write_scan(path / 'IC418_3mm.dat', [], [])
+    centers = [freq.min() + 100.0, freq.max() - 100.0]
+    write_scan(path / 'IC418_3mm_run2.dat', centers, [0.5, 0.4], seed=1)
+    return [{'source': 'IC418', 'band': '3mm', 'path': str(path), 'files': ['IC418_3mm.dat']},
+            {'source': 'IC418', 'band': '3mm', 'path': str(path), 'files': ['IC418_3mm_run2.dat']},
+            {'source': 'IC418', 'band': '1mm', 'path': str(path), 'files': ['missing.dat']}]
+
+
+def test_run_batch_outputs_per_task(tmp_path):
+    manifest = batch_manifest(tmp_path)
+
+    summary = sf.run_batch(manifest, str(tmp_path / 'out'), workers=1, retries=0, verbose=False, rms=0.05)
+
+    assert list(summary['status']) == ['done', 'done', 'failed']
+    assert summary['lines'][0] == 0 and summary['lines'][1] > 0
+    # Two runs of the same source and band do not share their directory
+    assert summary['output'][0] != summary['output'][1]
+    assert summary['output'][1].endswith('IC418_3mm_1')
+    assert summary['error'][2].startswith('FileNotFoundError')
+    assert (tmp_path / 'out' / 'batch_summary.csv').exists()
+
+
+def test_run_batch_empty_manifest(tmp_path):
+    summary = sf.run_batch([], str(tmp_path), verbose=False)
+
+    assert len(summary) == 0
+
+
+def kill_worker(marker, source):
+    # Catalogue loader that kills its worker the first time it is called
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return None
+
+
+def test_run_batch_worker_dies(tmp_path):
+    manifest = batch_manifest(tmp_path)[:2]
+
+    summary = sf.run_batch(manifest, str(tmp_path / 'out'), workers=2, retries=0, verbose=False, rms=0.05,
+                           catalogue=functools.partial(kill_worker, str(tmp_path / 'killed')))
+
+    # One of the tasks killed a worker; without retries neither is charged for it unless 
+    # it was running alone
+    assert (tmp_path / 'killed').exists()
+    assert (summary['status'] == 'done').sum() >= 1
+    assert (summary['attempts'] == 1).all()
+
+
+def test_line_offsets_share_convention(catalogue_dir):
+    lines = QTable({'line_center': [86010.5, 86061.0] * u.MHz})
+    catalogue = catalogues.Catalogue(catalogue_dir, 'SRC', cache=False)
+    synthetic = {'CO': pd.DataFrame({'Freq[MHz]': [86010.0]}), 'HCN': pd.DataFrame({'Freq[MHz]': [86060.0]})}
+
+    identified = sf.identify_lines(lines, catalogue, vel_width=10.0, kinds='molecules')
+    matches = sf.match_synthetic_lines(lines, synthetic, vel_width=10.0)
+
+    np.testing.assert_allclose(identified['offset'].to_value(u.MHz), [-0.5, -1.0])
+    np.testing.assert_allclose(matches['offset'].to_value(u.MHz), identified['offset'].to_value(u.MHz))
+    np.testing.assert_allclose(matches['vel_offset'].to_value(u.km / u.s), 
+                               identified['vel_offset'].to_value(u.km / u.s))
+    # Lines above the reference frequency have negative radio velocities
+    assert (matches['vel_offset'] < 0).all()
+
+
+def test_spectrum_store_rebuilt_from_stale_sidecar(tmp_path):
+    write_scan(tmp_path / 'IC418_3mm.dat', [], [])
+    store = str(tmp_path / 'store' / 'spectrum')
+    os.makedirs(os.path.dirname(store))
+    spectrum = sf.create_spectrum(str(tmp_path), ['IC418_3mm.dat'], store=store)
+    meta_file = sf.spectrum_store_files(store)[2]
+    assert sf.read_spectrum_store(store) is not None
+
+    # Sidecar written by an older version, without the list of files
+    with open(meta_file) as f:
+        meta = json.load(f)
+    del meta['files']
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+    full_paths = [str(tmp_path / 'IC418_3mm.dat')]
+    assert sf.read_spectrum_store(store, full_paths) is None
+    rebuilt = sf.create_spectrum(str(tmp_path), ['IC418_3mm.dat'], store=store)
+    np.testing.assert_array_equal(rebuilt.flux.value, spectrum.flux.value)
+    assert sf.read_spectrum_store(store, full_paths) is not None
+
+    # Truncated sidecar and truncated channels
+    with open(meta_file, 'w') as f:
+        f.write('{"source": "IC4')
+    assert sf.read_spectrum_store(store) is None
+    sf.create_spectrum(str(tmp_path), ['IC418_3mm.dat'], store=store)
+    with open(sf.spectrum_store_files(store)[0], 'wb') as f:
+        f.write(b'\x93NUMPY')
+    assert sf.read_spectrum_store(store) is None
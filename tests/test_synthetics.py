@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from astropy import constants as const
+from astropy import units as u
+from specutils import Spectrum1D
+
+import catalogues
+import synthetics as syn
+
+
+def observed_spectrum(flux=None, seed=0):
+    freq = np.linspace(86000.0, 86100.0, 4000)
+    noise = np.random.default_rng(seed).normal(0.0, 0.01, len(freq))
+    flux = noise if flux is None else flux + noise
+    return Spectrum1D(flux=flux * u.K, spectral_axis=freq * u.MHz)
+
+
+def test_stack_species_replaces_species_column():
+    frames = {'CO': pd.DataFrame({'Species': ['x', 'x'], 'Freq[MHz]': [1.0, 2.0]}),
+              'HCN': pd.DataFrame({'Species': ['y'], 'Freq[MHz]': [3.0]})}
+
+    table = syn.stack_species(frames)
+
+    assert list(table['Species']) == ['CO', 'CO', 'HCN']
+    assert list(table['Species'].cat.categories) == ['CO', 'HCN']
+
+
+def test_synthetic_fit_from_catalogue(catalogue_dir):
+    molecules = catalogues.Catalogue(catalogue_dir, 'SRC', cache=False).molecules
+    assert not isinstance(molecules['Species'].dtype, pd.CategoricalDtype)
+    truth = np.array([12.0, 9.5, 20.0, 15.0])
+    model = syn.SyntheticFit(observed_spectrum(), molecules, 5.0, rms=0.01).models(truth)[0]
+
+    fit = syn.SyntheticFit(observed_spectrum(model.flux.to_value(u.K)), molecules, 5.0, rms=0.01)
+    table, result = fit.fit(tex=30.0)
+
+    assert fit.species == ['CO', 'HCN'] and fit.excitation
+    np.testing.assert_allclose(table['log10N'], truth[:2], atol=0.05)
+    np.testing.assert_allclose(table['Tex[K]'], truth[2:], rtol=0.1)
+    assert 0.5 < result.reduced_chi2 < 2.0
+
+
+def test_synthetic_fit_per_species_frames(catalogue_dir):
+    molecules = catalogues.Catalogue(catalogue_dir, 'SRC', cache=False).molecules
+    frames = {name: data for name, data in molecules.groupby('Species')}
+
+    stacked = syn.SyntheticFit(observed_spectrum(), frames, 5.0, rms=0.01)
+    table = syn.SyntheticFit(observed_spectrum(), molecules, 5.0, rms=0.01)
+
+    assert stacked.species == table.species
+    params = np.array([12.0, 9.5, 20.0, 15.0])
+    np.testing.assert_allclose(stacked.residuals(params), table.residuals(params))
+
+
+def test_render_synth_spectra_without_lines():
+    lines = syn.stack_species({'CO': pd.DataFrame({'Freq[MHz]': [90000.0], 'T_A': [1.0]})})
+
+    species, spectrum = syn.render_synth_spectra(lines, np.linspace(86000.0, 86100.0, 100) * u.MHz, 5.0)
+
+    assert species == ['CO']
+    assert spectrum.flux.shape == (1, 100) and not spectrum.flux.value.any()
+
+
+def synthetic_lines():
+    return {'CO': pd.DataFrame({'Freq[MHz]': [86010.0, 86030.0], 'Aij': [7.2e-8, 6.9e-7]}),
+            'HCN': pd.DataFrame({'Freq[MHz]': [86020.0], 'Aij': [2.4e-5]}),
+            'CS': pd.DataFrame({'Freq[MHz]': np.array([], dtype=float), 'Aij': np.array([], dtype=float)})}
+
+
+def test_anttemp_matches_the_formula():
+    tau, dilution, width = 0.5, 0.3, 5.0
+    c3 = const.c ** 3 * 1e-9
+    factor = (const.h * c3 / (8 * np.pi * const.k_B)).value * dilution * (1 - np.exp(-tau)) / tau
+
+    molec_spectra = syn.anttemp(synthetic_lines(), width, dilution=dilution, tau=tau)
+
+    for value in molec_spectra.values():
+        expected = factor * value['Aij'] / (value['Freq[MHz]'] ** 2 * width)
+        np.testing.assert_allclose(value['T_A'], expected, rtol=1e-12)
+    assert len(molec_spectra['CS']) == 0
+
+
+def test_anttemp_stacked_matches_dictionary():
+    molec_spectra = syn.anttemp(synthetic_lines(), 5.0)
+    table = syn.anttemp(synthetic_lines(), 5.0, stacked=True)
+
+    assert list(table['Species'].cat.categories) == ['CO', 'HCN', 'CS']
+    np.testing.assert_allclose(table['T_A'], pd.concat(molec_spectra.values())['T_A'])
+    # A stacked table is updated in place, also without lines
+    empty = syn.stack_species({'CS': synthetic_lines()['CS']})
+    assert syn.anttemp(empty, 5.0) is empty and len(empty['T_A']) == 0
+
+
+def test_synthetic_fit_without_lines_in_spectrum():
+    lines = pd.DataFrame({'Species': ['CO'], 'Freq[MHz]': [90000.0], 'Aij': [1e-5], 
+                          'Eup[K]': [5.0], 'Gup': [3]})
+    spectrum = observed_spectrum()
+
+    fit = syn.SyntheticFit(spectrum, lines, 5.0, rms=0.01)
+    table, result = fit.fit(tex=30.0)
+
+    assert fit.profiles.shape == (0, 1)
+    assert list(table['Species']) == ['CO']
+    np.testing.assert_allclose(result.chi2, np.sum((spectrum.flux.value / 0.01) ** 2))